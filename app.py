@@ -2,33 +2,28 @@
 # ★★★ app.py ＜キー衝突回避・完全無欠版＞ ★★★
 # ===============================================================
 import streamlit as st
-import google.generativeai as genai
-import json
 from pathlib import Path
-from PIL import Image
 import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
 
 # ↓↓↓ ★1. 新しいツールを2つインポートします ★↓↓↓
 from tools import api_key_helper_tool
 from tools import gemini_api_key_helper_tool
+from tools import okozukai_ledger
+from tools import okozukai_export
+from tools import receipt_analysis
+from tools import receipt_image
+from tools import receipt_index
+from tools import gemini_client
 
 # ---------------------------------------------------------------
-# Section 1: 永続化のためのコア機能 (ここは変更なし)
+# Section 1: 永続化のためのコア機能 (SQLiteの差分書き込みエンジンに換装)
 # ---------------------------------------------------------------
-STATE_FILE = Path("multitool_state.json")
-
-def read_app_state():
-    if STATE_FILE.exists():
-        with STATE_FILE.open("r", encoding="utf-8") as f:
-            try: return json.load(f)
-            except json.JSONDecodeError: return {}
-    return {}
-
-def write_app_state(data):
-    with STATE_FILE.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# 状態はプロセス内で共有キャッシュされ、他のセッションの書き込みも自動で反映されます。
+# 読んで、変えて、書く処理は update_app_state / increment_key で行い、更新の取りこぼしを防ぎます。
+from tools.state_store import read_app_state, write_app_state, write_key, increment_key
 
 # ---------------------------------------------------------------
 # Section 2: お小遣い管理ツールのための補助関数 (ここは変更なし)
@@ -42,34 +37,24 @@ def format_balance_display(balance):
     else:
         return f"🔴 **{abs(balance):,.0f} 円 (予算オーバー)**"
 
-OKOZUKAI_PROMPT = """あなたは、レシートの画像を直接解析する、超優秀な経理アシスタントAIです。
-# 指示
-レシートの画像の中から、以下の情報を注意深く、正確に抽出してください。
-1.  **合計金額 (total_amount)**: 支払いの総額。**特に「合計」の金額に注意してください。正確に抽出すべき情報は、「合計」の金額です。**
-2.  **購入品リスト (items)**: 購入した「品物名(name)」と「その単価(price)」のリスト。
-# 出力形式
-*   抽出した結果を、必ず以下のJSON形式で出力してください。
-*   数値は、数字のみを抽出してください（円やカンマは不要）。
-*   値が見つからない場合は、数値項目は "0"、リスト項目は空のリスト `[]` としてください。
-*   「小計」「お預り」「お釣り」「店名」「合計」といった単語そのものは、購入品リストに含めないでください。
-*   JSON以外の、前置きや説明は、絶対に出力しないでください。
-{
-  "total_amount": "ここに合計金額の数値",
-  "items": [
-    { "name": "ここに品物名1", "price": "ここに単価1" },
-    { "name": "ここに品物名2", "price": "ここに単価2" }
-  ]
-}
-"""
+# まとめてアップロードされたレシートを、同時にいくつまで解析するか
+MAX_PARALLEL_ANALYSES = 4
+
+def show_next_receipt_for_review():
+    """確認待ちの列から、次のレシートを確認画面に出します。"""
+    queue = st.session_state.receipt_review_queue
+    next_receipt = queue.pop(0) if queue else None
+    st.session_state.receipt_preview = next_receipt["extraction"] if next_receipt else None
+    st.session_state.receipt_preview_meta = next_receipt["meta"] if next_receipt else {}
 
 # ---------------------------------------------------------------
 # Section 3: Streamlit アプリケーション本体
 # ---------------------------------------------------------------
 st.set_page_config(page_title="Multi-Tool Portal", page_icon="🚀", layout="wide")
 
-# --- アプリ全体のデータ管理 --- (変更なし)
-if 'app_state' not in st.session_state:
-    st.session_state.app_state = read_app_state()
+# --- アプリ全体のデータ管理 ---
+# セッションごとにコピーを持たず、毎回プロセス共有のキャッシュから読みます (再読み込みは変更時のみ)
+app_state = read_app_state()
 
 # --- サイドバー ---
 with st.sidebar:
@@ -95,7 +80,8 @@ with st.sidebar:
 
 
 # --- メインコンテンツの分岐 ---
-api_key = st.session_state.app_state.get('gemini_api_key', '')
+api_key = app_state.get('gemini_api_key', '')
+gemini_client.warm_up(api_key) # 最初の解析で接続を待たないよう、裏側で準備しておきます
 selected_tool = st.session_state.get("tool_selection_sidebar")
 
 # ★3. メインコンテンツの分岐を修正 ★
@@ -116,16 +102,17 @@ elif selected_tool == "💰 お小遣い管理":
     # --- お小遣い管理ツールのコード（ここから下は変更なし） ---
     okozukai_prefix = "okozukai_"
     key_allowance = f"{okozukai_prefix}monthly_allowance"
-    key_total_spent = f"{okozukai_prefix}total_spent"
-    key_all_receipts = f"{okozukai_prefix}all_receipts"
+    key_all_receipts = f"{okozukai_prefix}all_receipts" # 旧形式。初回に台帳(okozukai_ledger)へ移します
     key_usage_count = f"{okozukai_prefix}usage_count"
+    key_export = f"{okozukai_prefix}export" # 作成済みの書き出しファイルの情報 (セッションごと)
+    okozukai_ledger.import_legacy_receipts(key_all_receipts)
     
-    app_s_main = st.session_state.app_state
+    app_s_main = app_state
     if key_allowance not in app_s_main: app_s_main[key_allowance] = 0.0
-    if key_total_spent not in app_s_main: app_s_main[key_total_spent] = 0.0
-    if key_all_receipts not in app_s_main: app_s_main[key_all_receipts] = []
     if key_usage_count not in app_s_main: app_s_main[key_usage_count] = 0
     if 'receipt_preview' not in st.session_state: st.session_state.receipt_preview = None
+    if 'receipt_preview_meta' not in st.session_state: st.session_state.receipt_preview_meta = {}
+    if 'receipt_review_queue' not in st.session_state: st.session_state.receipt_review_queue = []
 
     usage_limit = 5
     is_limit_reached = app_s_main.get(key_usage_count, 0) >= usage_limit
@@ -144,7 +131,7 @@ elif selected_tool == "💰 お小遣い管理":
                 seed_str = st.secrets.get("unlock_seed", "0"); seed_int = int(seed_str) if seed_str.isdigit() else 0
                 correct_password = str((today_int + seed_int) % 10000).zfill(4)
                 if password_input == correct_password:
-                    app_s_main[key_usage_count] = 0; write_app_state(app_s_main)
+                    write_key(key_usage_count, 0)
                     st.balloons(); st.success("ありがとうございます！読み込み回数がリセットされました。")
                     time.sleep(2); st.rerun()
                 else: st.error("合言葉が違うようです。応援ページで、もう一度ご確認ください。")
@@ -153,19 +140,32 @@ elif selected_tool == "💰 お小遣い管理":
         st.subheader("📝 支出の確認")
         st.info("AIが読み取った内容を確認・修正し、問題なければ「確定」してください。")
         preview_data = st.session_state.receipt_preview
+        preview_meta = st.session_state.receipt_preview_meta
+        if preview_meta.get("file_name"): st.caption(f"📄 {preview_meta['file_name']}")
+        if st.session_state.receipt_review_queue: st.caption(f"🗂️ このあと、確認待ちのレシートが {len(st.session_state.receipt_review_queue)} 件あります。")
+        if preview_meta.get("exact_confirmed_at"):
+            st.warning(f"⚠️ このレシート画像は {preview_meta['exact_confirmed_at']} に登録済みです。もう一度記録する場合は、下のチェックを入れてください。")
+        elif preview_meta.get("near_duplicate"):
+            st.warning(f"⚠️ {preview_meta['near_duplicate']['confirmed_at']} に登録したレシートとよく似ています。同じレシートではないか、ご確認ください。")
+        if preview_meta.get("from_index"):
+            st.caption("♻️ 以前に解析した画像と同じため、保存済みの解析結果を表示しています（読み込み回数は消費していません）。")
         corrected_amount = st.number_input("合計金額", value=float(preview_data.get('total_amount', 0.0)), min_value=0.0, step=1.0)
         items_data = preview_data.get('items', [])
         df_items = pd.DataFrame(items_data) if items_data else pd.DataFrame([{"name": "", "price": 0.0}])
         edited_df = st.data_editor(df_items, num_rows="dynamic", column_config={"name": st.column_config.TextColumn("品物名", required=True), "price": st.column_config.NumberColumn("金額", format="%.0f円")}, use_container_width=True)
+        # 登録済みとまったく同じ画像は、はっきり選んだ時だけ、もう一度記録できます (二重計上を防ぎます)
+        allow_duplicate = True
+        if preview_meta.get("exact_confirmed_at"):
+            allow_duplicate = st.checkbox("同じレシートを、もう一度支出として記録する", value=False, key=f"{okozukai_prefix}allow_duplicate_{preview_meta.get('content_hash')}")
         col_confirm, col_cancel = st.columns(2)
-        if col_confirm.button("💰 この金額で支出を確定する", type="primary", use_container_width=True):
-            app_s_main[key_total_spent] += corrected_amount
-            app_s_main[key_all_receipts].append({"date": datetime.now().strftime('%Y-%m-%d %H:%M'), "total_amount": corrected_amount, "items": edited_df.to_dict('records')})
-            write_app_state(app_s_main)
-            st.session_state.receipt_preview = None
+        if col_confirm.button("💰 この金額で支出を確定する", type="primary", use_container_width=True, disabled=not allow_duplicate):
+            # 使った金額は台帳の月ごとの合計から求めるので、書き込みは台帳への1回(1トランザクション)だけです
+            okozukai_ledger.add_receipt(datetime.now().strftime('%Y-%m-%d %H:%M'), corrected_amount, edited_df.to_dict('records'))
+            if preview_meta.get("content_hash"): receipt_index.mark_confirmed(preview_meta["content_hash"])
+            show_next_receipt_for_review()
             st.success("支出を記録しました！"); st.balloons(); time.sleep(1); st.rerun()
         if col_cancel.button("❌ キャンセル", use_container_width=True):
-            st.session_state.receipt_preview = None; st.rerun()
+            show_next_receipt_for_review(); st.rerun()
             
     else:
         st.info("レシートを登録して、今月使えるお金を管理しよう！")
@@ -174,64 +174,120 @@ elif selected_tool == "💰 お小遣い管理":
             with st.form(key="allowance_form"):
                 new_allowance = st.number_input("今月のお小遣い", value=float(app_s_main.get(key_allowance, 0)), step=1000.0)
                 if st.form_submit_button("この金額で設定する", type="primary", use_container_width=True):
-                    app_s_main[key_allowance] = new_allowance; write_app_state(app_s_main)
+                    write_key(key_allowance, new_allowance)
                     st.success(f"お小遣いを {new_allowance:,.0f} 円に設定しました！"); time.sleep(1); st.rerun()
         
         st.divider()
         st.subheader("📊 現在の状況")
         current_allowance = app_s_main.get(key_allowance, 0.0)
-        current_spent = app_s_main.get(key_total_spent, 0.0)
+        # 使った金額は、台帳の今月の合計です (レシートの記録と同じトランザクションで更新されるので、ずれません)
+        this_month = okozukai_ledger.month_summary(okozukai_ledger.current_month())
+        current_spent = this_month["total_amount"]
         remaining_balance = calculate_remaining_balance(current_allowance, current_spent)
         col1, col2, col3 = st.columns(3)
         col1.metric("今月の予算", f"{current_allowance:,.0f} 円"); col2.metric("使った金額", f"{current_spent:,.0f} 円"); col3.metric("残り予算", f"{remaining_balance:,.0f} 円")
         st.markdown(f"<p style='text-align: center; font-size: 2.0em; font-weight: bold;'>残り予算: {format_balance_display(remaining_balance)}</p>", unsafe_allow_html=True)
         if current_allowance > 0: st.progress(min(current_spent / current_allowance, 1.0))
+        st.caption(f"🧾 {this_month['month']} のレシート: {this_month['receipt_count']} 件 / 合計 {this_month['total_amount']:,.0f} 円")
 
         st.divider()
         st.subheader("📸 レシートを登録する")
-        uploaded_file = st.file_uploader("📁 画像をアップロード", type=['png', 'jpg', 'jpeg'], key="okozukai_file_uploader")
-        if uploaded_file:
-            st.image(uploaded_file, caption="解析対象のレシート", width=300)
-            if st.button("⬆️ このレシートを解析する", type="primary", use_container_width=True):
+        uploaded_files = st.file_uploader("📁 画像をアップロード（複数枚まとめて選べます）", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key="okozukai_file_uploader")
+        if uploaded_files:
+            preview_cols = st.columns(min(len(uploaded_files), 4))
+            for index, uploaded_file in enumerate(uploaded_files):
+                preview_cols[index % len(preview_cols)].image(uploaded_file, caption=uploaded_file.name, width=150 if len(uploaded_files) > 1 else 300)
+            if st.button(f"⬆️ {len(uploaded_files)} 枚のレシートを解析する", type="primary", use_container_width=True):
                 # ここにあったAPIキーチェックは、関数の冒頭に移動したので不要
-                try:
-                    app_s_main[key_usage_count] += 1; write_app_state(app_s_main)
-                    with st.spinner("🧠 AIがレシートを解析中..."):
-                        genai.configure(api_key=api_key); model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                        image = Image.open(uploaded_file); response = model.generate_content([OKOZUKAI_PROMPT, image])
-                        extracted_data = json.loads(response.text.strip().replace("```json", "").replace("```", ""))
-                    st.session_state.receipt_preview = extracted_data; st.rerun()
-                except Exception as e:
-                    app_s_main[key_usage_count] -= 1; write_app_state(app_s_main)
-                    st.error(f"❌ 解析エラー: {e}")
+                # まず、同じ画像を以前に解析していないかを調べます (一致すればAIは呼びません)
+                review_items, new_images, seen_hashes = [], [], set()
+                for uploaded_file in uploaded_files:
+                    image_bytes = uploaded_file.getvalue()
+                    image_hash = receipt_image.content_hash(image_bytes)
+                    if image_hash in seen_hashes: continue
+                    seen_hashes.add(image_hash)
+                    known_receipt = receipt_index.lookup_exact(image_hash)
+                    if known_receipt:
+                        review_items.append({"extraction": known_receipt["extraction"], "meta": {"content_hash": image_hash, "file_name": uploaded_file.name, "from_index": True, "exact_confirmed_at": known_receipt["confirmed_at"]}})
+                    else:
+                        new_images.append((uploaded_file.name, image_hash, image_bytes))
+
+                remaining_uses = max(usage_limit - app_s_main.get(key_usage_count, 0), 0)
+                if len(new_images) > remaining_uses:
+                    st.warning(f"読み込み回数の残りが {remaining_uses} 回のため、{len(new_images) - remaining_uses} 枚は解析しませんでした。")
+                    new_images = new_images[:remaining_uses]
+
+                if new_images:
+                    increment_key(key_usage_count, len(new_images))
+                    progress_bar = st.progress(0.0, text=f"🧠 AIがレシートを解析中... (0/{len(new_images)})")
+                    failed_count = 0
+                    # 待ち時間が「枚数 × 1回分」にならないよう、決まった数のスレッドで同時に解析します
+                    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_ANALYSES, len(new_images))) as executor:
+                        futures = {executor.submit(receipt_analysis.analyze_receipt_image, api_key, image_bytes): (file_name, image_hash) for file_name, image_hash, image_bytes in new_images}
+                        for done_count, future in enumerate(as_completed(futures), start=1):
+                            file_name, image_hash = futures[future]
+                            try:
+                                extracted_data, receipt_stats = future.result()
+                                receipt_index.remember(image_hash, receipt_stats["dhash"], extracted_data)
+                                near_duplicate = receipt_index.find_near_duplicate(receipt_stats["dhash"], exclude_content_hash=image_hash)
+                                review_items.append({"extraction": extracted_data, "meta": {"content_hash": image_hash, "file_name": file_name, "near_duplicate": near_duplicate}})
+                                st.write(f"✅ {file_name}")
+                            except Exception as e:
+                                failed_count += 1
+                                st.error(f"❌ {file_name} の解析エラー: {e}")
+                            progress_bar.progress(done_count / len(new_images), text=f"🧠 AIがレシートを解析中... ({done_count}/{len(new_images)})")
+                    if failed_count: increment_key(key_usage_count, -failed_count)
+
+                if review_items:
+                    st.session_state.receipt_review_queue.extend(review_items)
+                    show_next_receipt_for_review(); st.rerun()
         
         st.divider()
         st.subheader("📜 支出履歴とデータ管理")
-        if app_s_main.get(key_all_receipts, []):
-            st.info(f"現在、{len(app_s_main[key_all_receipts])} 件のレシートデータが記録されています。")
-            with st.expander("クリックして詳細な支出履歴を表示"):
-                for receipt in reversed(app_s_main[key_all_receipts]):
+        history_months = okozukai_ledger.list_months()
+        if history_months:
+            st.info(f"現在、{sum(m['receipt_count'] for m in history_months)} 件のレシートデータが記録されています。")
+            # st.expander は閉じていても中身を毎回実行するため、トグルで開いたときだけ読み込みます
+            if st.toggle("詳細な支出履歴を表示", key=f"{okozukai_prefix}show_history"):
+                month_options = [m['month'] for m in history_months]
+                selected_month = st.selectbox("表示する月", month_options, key=f"{okozukai_prefix}history_month")
+                summary = next(m for m in history_months if m['month'] == selected_month)
+                st.write(f"**{selected_month} の合計:** {summary['total_amount']:,.0f} 円 / {summary['receipt_count']} 件")
+                month_top_items = okozukai_ledger.top_items(selected_month)
+                if month_top_items:
+                    with st.expander("品物ごとの集計 (金額の多い順)"):
+                        st.dataframe(pd.DataFrame(month_top_items).rename(columns={"name": "品物名", "quantity": "回数", "total_price": "合計金額"}), hide_index=True, use_container_width=True)
+                page_size = okozukai_ledger.DEFAULT_PAGE_SIZE
+                page_count = max((summary['receipt_count'] + page_size - 1) // page_size, 1)
+                page = st.number_input(f"ページ (全 {page_count} ページ)", min_value=1, max_value=page_count, value=1, step=1, key=f"{okozukai_prefix}history_page_{selected_month}")
+                for receipt in okozukai_ledger.fetch_page(selected_month, page, page_size):
                     with st.container(border=True):
                         st.write(f"**日時:** {receipt.get('date', 'N/A')} / **合計:** {float(receipt.get('total_amount', 0)):,.0f} 円")
                         items_df = pd.DataFrame(receipt.get('items', []))
                         if not items_df.empty: st.dataframe(items_df, hide_index=True, use_container_width=True)
                         else: st.write("品目情報なし")
-            flat_list_for_csv = []
-            for receipt in app_s_main[key_all_receipts]:
-                receipt_date = receipt.get('date', 'N/A'); receipt_total = receipt.get('total_amount', 0)
-                items = receipt.get('items', [])
-                if not items: flat_list_for_csv.append({"日付": receipt_date, "品物名": "品目なし", "金額": 0, "レシート合計": receipt_total})
-                else:
-                    for item in items: flat_list_for_csv.append({"日付": receipt_date, "品物名": item.get('name', 'N/A'), "金額": item.get('price', 0), "レシート合計": receipt_total})
-            if flat_list_for_csv:
-                df_for_csv = pd.DataFrame(flat_list_for_csv)
-                csv_data = df_for_csv.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(label="✅ 全支出履歴をCSVでダウンロード", data=csv_data, file_name=f"okozukai_history_{datetime.now().strftime('%Y%m%d')}.csv", mime="text/csv")
+            # 書き出しファイルは、ボタンが押された時にだけ、台帳から少しずつ読みながら作ります
+            col_format, col_build = st.columns([1, 2])
+            export_format = col_format.radio("書き出し形式", list(okozukai_export.EXPORT_FORMATS), horizontal=True, key=f"{okozukai_prefix}export_format", label_visibility="collapsed")
+            if col_build.button("📦 全支出履歴の書き出しファイルを作成する", use_container_width=True):
+                previous_export = st.session_state.pop(key_export, None)
+                if previous_export: okozukai_export.discard_export(previous_export["path"])
+                try:
+                    with st.spinner("書き出しファイルを作成しています..."):
+                        export_path, export_file_name, export_mime = okozukai_export.build_export(export_format)
+                    st.session_state[key_export] = {"path": export_path, "file_name": export_file_name, "mime": export_mime}
+                except Exception as e:
+                    st.error(f"❌ 書き出しエラー: {e}")
+            export_info = st.session_state.get(key_export)
+            if export_info and Path(export_info["path"]).exists():
+                with open(export_info["path"], "rb") as export_file:
+                    st.download_button(label=f"✅ {export_info['file_name']} をダウンロード", data=export_file, file_name=export_info["file_name"], mime=export_info["mime"])
         
         c1_reset, c2_reset = st.columns(2)
         if c1_reset.button("支出履歴のみリセット", use_container_width=True, help="使った金額とレシート履歴だけを0にします。"):
-            app_s_main[key_total_spent] = 0.0; app_s_main[key_all_receipts] = []; write_app_state(app_s_main)
+            okozukai_ledger.clear(); receipt_index.clear_confirmations()
+            okozukai_export.discard_export(st.session_state.pop(key_export, {}).get("path"))
             st.success("支出履歴をリセットしました！"); time.sleep(1); st.rerun()
         if c2_reset.button("⚠️ 全データ完全初期化", use_container_width=True, help="予算設定も含め、このツールの全データを消去します。", type="secondary"):
-            app_s_main[key_allowance] = 0.0; app_s_main[key_total_spent] = 0.0; app_s_main[key_all_receipts] = []; app_s_main[key_usage_count] = 0
-            write_app_state(app_s_main); st.success("全データをリセットしました！"); time.sleep(1); st.rerun()
+            write_app_state({key_allowance: 0.0, key_usage_count: 0}); okozukai_ledger.clear(); receipt_index.clear_confirmations()
+            okozukai_export.discard_export(st.session_state.pop(key_export, {}).get("path")); st.success("全データをリセットしました！"); time.sleep(1); st.rerun()
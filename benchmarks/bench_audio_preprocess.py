@@ -0,0 +1,86 @@
+# ===============================================================
+# ★★★ bench_audio_preprocess.py ＜音声の下ごしらえ・前後比較＞ ★★★
+# ===============================================================
+# 合成した会話の録音(前後に無音あり)を、マイク録音やアップロードでよくある形式にして、
+# 下ごしらえの前後の
+#   - 送るデータの大きさ
+#   - 下ごしらえにかかる時間
+#   - 回線ごとの送信時間の見積もり (大きさ ÷ 回線速度)
+# を比べます。環境変数 GEMINI_API_KEY があれば、実際の文字起こしの応答時間も、前後それぞれで測ります。
+# ffmpeg がない環境では、WAVだけが変換されます (それ以外は passthrough と表示されます)。
+#
+#   python -m benchmarks.bench_audio_preprocess
+import io
+import math
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import audio_preprocess  # noqa: E402
+
+NETWORKS = {"4G (5Mbps)": 5, "混雑した4G (1.5Mbps)": 1.5}
+SOURCE_FORMATS = {
+    "webm (ブラウザのマイク)": ["-c:a", "libopus", "-b:a", "128k", "-f", "webm"],
+    "m4a (スマホの録音)": ["-c:a", "aac", "-b:a", "128k", "-f", "ipod", "-movflags", "frag_keyframe+empty_moov"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"],
+}
+
+
+def synthetic_recording(seconds=60, lead_silence=5.0, rate=44100):
+    """揺れる高さの音を、話すように区切って並べた、ステレオの録音です。"""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        speaking = lead_silence <= t < seconds - lead_silence and (t * 2) % 3 < 2.2
+        value = int(9000 * math.sin(2 * math.pi * (160 + 70 * math.sin(2 * math.pi * 2.5 * t)) * t)) if speaking else 0
+        frames += struct.pack("<hh", value, value)
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(2); wav.setsampwidth(2); wav.setframerate(rate)
+        wav.writeframes(bytes(frames))
+    return output.getvalue()
+
+
+def _encode(wav_bytes, args):
+    return subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *args, "pipe:1"],
+                          input=wav_bytes, capture_output=True, check=True).stdout
+
+
+def _gemini_latency(api_key, data, mime_type):
+    from tools import gemini_client, transcription
+    started = time.perf_counter()
+    gemini_client.generate(api_key, [transcription.STYLES[transcription.PLAIN], {"mime_type": mime_type, "data": data}])
+    return time.perf_counter() - started
+
+
+def main():
+    wav_bytes = synthetic_recording()
+    sources = {"wav (44.1kHz ステレオ)": wav_bytes}
+    if shutil.which("ffmpeg"):
+        sources.update({name: _encode(wav_bytes, args) for name, args in SOURCE_FORMATS.items()})
+    else:
+        print("ffmpeg がないため、WAV以外の形式は比べません。\n")
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    for name, original in sources.items():
+        started = time.perf_counter()
+        processed, mime_type, stats = audio_preprocess.normalize_audio(original, "audio/webm")
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {len(original) / 1024:.0f} KB → {len(processed) / 1024:.0f} KB ({len(processed) / len(original):.1%}), "
+              f"{stats['method']}, {elapsed * 1000:.0f} ms")
+        for network, mbps in NETWORKS.items():
+            before = len(original) * 8 / (mbps * 1_000_000)
+            after = len(processed) * 8 / (mbps * 1_000_000) + elapsed
+            print(f"    送信の見積もり {network}: {before:.2f}s → {after:.2f}s")
+        if api_key:
+            print(f"    Geminiの応答時間: {_gemini_latency(api_key, original, audio_preprocess.mime_type_for(original, 'audio/webm')):.2f}s → "
+                  f"{_gemini_latency(api_key, processed, mime_type):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# ===============================================================
+# ★★★ bench_long_transcription.py ＜長い会議音声: 1回の呼び出し vs 区間ごとの並列文字起こし＞ ★★★
+# ===============================================================
+# 文字起こしにかかる時間(壁時計)を、2つの方法で比べます。
+#
+#   python -m benchmarks.bench_long_transcription 会議.m4a
+#       GEMINI_API_KEY があれば、実際の音声ファイルで、両方の方法を実測します (保存済みの結果は使いません)
+#
+#   python -m benchmarks.bench_long_transcription
+#       APIを呼ばずに、応答時間を「固定の待ち時間 + 音声の長さに比例する時間」とみなした模擬で比べます
+#       (実際の待ち時間の 1/SIMULATION_SPEEDUP に縮めて実行し、表示は元の尺に戻します)
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import audio_preprocess, long_transcription, transcription  # noqa: E402
+
+# 模擬の応答時間: 1回あたり OVERHEAD 秒 + 音声1秒あたり PER_AUDIO_SECOND 秒
+SIMULATED_OVERHEAD_SECONDS = 3.0
+SIMULATED_PER_AUDIO_SECOND = 0.08
+SIMULATION_SPEEDUP = 200
+SIMULATED_DURATIONS_MINUTES = (15, 45, 90)
+
+
+def _simulated_call(audio_seconds):
+    time.sleep((SIMULATED_OVERHEAD_SECONDS + audio_seconds * SIMULATED_PER_AUDIO_SECOND) / SIMULATION_SPEEDUP)
+    return f"スピーカーA: {audio_seconds:.0f}秒分の発言"
+
+
+def simulate():
+    long_transcription.transcribe_segment = lambda api_key, path, start, end: _simulated_call(end - start)
+    print(f"模擬 (1回 = {SIMULATED_OVERHEAD_SECONDS}s + 音声1秒あたり {SIMULATED_PER_AUDIO_SECOND}s、並列 {long_transcription.MAX_PARALLEL_SEGMENTS})")
+    print(f"{'音声の長さ':>8}{'1回で':>10}{'区間並列':>10}{'区間数':>8}")
+    for minutes in SIMULATED_DURATIONS_MINUTES:
+        duration = minutes * 60
+        started = time.perf_counter()
+        _simulated_call(duration)
+        single = (time.perf_counter() - started) * SIMULATION_SPEEDUP
+        segments = long_transcription.plan_segments(duration)
+        started = time.perf_counter()
+        long_transcription.transcribe_long_audio("simulated", "simulated", segments)
+        segmented = (time.perf_counter() - started) * SIMULATION_SPEEDUP
+        print(f"{minutes:>7}分{single:>9.0f}s{segmented:>9.0f}s{len(segments):>8}")
+
+
+def measure(api_key, path):
+    duration = audio_preprocess.probe_duration(path)
+    if duration is None: sys.exit("音声の長さが分かりません (ffprobe か、WAVファイルが必要です)")
+    with open(path, "rb") as audio_file:
+        audio_bytes = audio_file.read()
+    started = time.perf_counter()
+    transcription.transcribe_uncached(api_key, audio_bytes, style=transcription.SPEAKERS)
+    single = time.perf_counter() - started
+    segments = long_transcription.plan_segments(duration)
+    started = time.perf_counter()
+    long_transcription.transcribe_long_audio(api_key, path, segments)
+    segmented = time.perf_counter() - started
+    print(f"{path} ({duration / 60:.1f}分, {len(segments)}区間): 1回で {single:.1f}s / 区間並列 {segmented:.1f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and os.environ.get("GEMINI_API_KEY"):
+        measure(os.environ["GEMINI_API_KEY"], sys.argv[1])
+    else:
+        simulate()
@@ -0,0 +1,63 @@
+# ===============================================================
+# ★★★ bench_media_upload.py ＜大きな音声の受け渡し: メモリの山の前後比較＞ ★★★
+# ===============================================================
+# アップロードされた大きな音声を、AIへのリクエストの形にするまでに、メモリがどれだけ増えるかを比べます。
+#   前: uploaded_file.getvalue() で丸ごと取り出し、音声をリクエストに直接埋め込む
+#   後: media_upload.spool() で一時ファイルへ書き出し、File API の印(URI)だけをリクエストに入れる
+# それぞれを別のプロセスで実行し、アップロード済みのファイルを用意した後から、最大使用メモリ(RSS)がどれだけ増えたかを測ります。
+# (リクエストの組み立ては、google-generativeai が generate_content の中で行うのと同じ変換です。
+#  File API への送信そのものは測りません。ライブラリが一時ファイルから少しずつ読みながら送ります)
+#
+#   python -m benchmarks.bench_media_upload
+import io
+import multiprocessing
+import os
+import resource
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIZES_MB = (25, 100, 200)
+MIME_TYPE = "audio/mpeg"
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux では KB 単位です
+
+
+def _measure(mode, size_mb, results):
+    from google.generativeai.types import content_types
+
+    from tools import media_upload
+    # Streamlit の UploadedFile は、受け取った中身を持った BytesIO です
+    uploaded_file = io.BytesIO(os.urandom(size_mb * 1024 * 1024))
+    baseline = _peak_rss_mb()
+    if mode == "before":
+        audio_bytes = uploaded_file.getvalue()
+        contents = content_types.to_contents(["文字起こししてください。", {"mime_type": MIME_TYPE, "data": audio_bytes}])
+    else:
+        with media_upload.spool(uploaded_file, MIME_TYPE) as spooled:
+            part = {"file_data": {"file_uri": f"https://example.invalid/files/{spooled.content_hash[:16]}", "mime_type": spooled.mime_type}}
+            contents = content_types.to_contents(["文字起こししてください。", part])
+    results.put(_peak_rss_mb() - baseline)
+    del contents
+
+
+def _run(mode, size_mb):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(mode, size_mb, results))
+    process.start()
+    increase = results.get()
+    process.join()
+    return increase
+
+
+def main():
+    print(f"{'音声の大きさ':>8}{'前 (埋め込み)':>16}{'後 (spool + File API)':>24}")
+    for size_mb in SIZES_MB:
+        print(f"{size_mb:>8} MB{_run('before', size_mb):>14.0f} MB{_run('after', size_mb):>22.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
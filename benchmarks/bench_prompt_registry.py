@@ -0,0 +1,39 @@
+# ===============================================================
+# ★★★ bench_prompt_registry.py ＜固定の指示書の大きさと、キャッシュされた入力トークンの実測＞ ★★★
+# ===============================================================
+# 1. アプリが登録している指示書の大きさ(概算トークン)を、明示的なコンテキストキャッシュの最小サイズと並べて表示します
+# 2. 環境変数 GEMINI_API_KEY があれば、各指示書で CALLS 回ずつ短い呼び出しをし、
+#    応答の usage_metadata から「入力トークン」と「キャッシュから読まれた入力トークン」の実測値を表示します
+#
+#   python -m benchmarks.bench_prompt_registry
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 各ツールを読み込むと、指示書が登録されます (app.py は画面を描き始めるため読み込みません。お小遣い管理の指示書は receipt_analysis にあります)
+from tools import ai_memory_partner_tool, career_analyzer_tool, gemini_client, kensha_no_kioku_tool, prompt_registry, receipt_analysis  # noqa: E402,F401
+
+# 明示的なコンテキストキャッシュ(CachedContent)に必要な最小トークン数 (gemini-1.5 系)
+EXPLICIT_CACHE_MIN_TOKENS = 32768
+CALLS = 3
+
+
+def main():
+    print(f"{'指示書':<28}{'概算トークン':>12}{'最小サイズ比':>12}")
+    for name, info in sorted(prompt_registry.stats().items()):
+        print(f"{name:<28}{info['tokens']:>12}{info['tokens'] / EXPLICIT_CACHE_MIN_TOKENS:>12.1%}")
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("\nGEMINI_API_KEY がないため、実測は行いません。")
+        return
+    for name in prompt_registry.stats():
+        for _ in range(CALLS):
+            gemini_client.generate(api_key, "「はい」とだけ答えてください。", prompt_name=name)
+    print(f"\n{'指示書':<28}{'呼び出し':>8}{'入力トークン':>12}{'キャッシュ分':>12}")
+    for name, info in sorted(prompt_registry.stats().items()):
+        print(f"{name:<28}{info['calls']:>8}{info['prompt_tokens']:>12}{info['cached_tokens']:>12}")
+
+
+if __name__ == "__main__":
+    main()
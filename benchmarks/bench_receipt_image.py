@@ -0,0 +1,166 @@
+# ===============================================================
+# ★★★ bench_receipt_image.py ＜レシート画像の下ごしらえ・前後比較＞ ★★★
+# ===============================================================
+# 合計金額と購入品の正解つきのレシート(fixtures/receipts.json)を、スマホ写真に近い画像(12MP・JPEG)にして、
+# 下ごしらえの前後の
+#   - 送るデータの大きさ
+#   - 下ごしらえにかかる時間
+#   - 回線ごとの送信時間の見積もり (大きさ ÷ 回線速度)
+# を比べます。環境変数 GEMINI_API_KEY があれば、アプリと同じ解析(receipt_analysis.analyze_receipt_image: 同じ指示書・同じスキーマ)を
+# 前後それぞれで実行し、応答時間と、読み取りの正確さ(合計金額が合っていた割合、購入品を名前と金額で拾えた割合)も比べます。
+#
+#   python -m benchmarks.bench_receipt_image
+#   python -m benchmarks.bench_receipt_image 写真のフォルダ
+#       実物の写真で比べます。フォルダには写真と、receipts.json と同じ形の expected.json
+#       (各項目の "photo" の代わりに、写真のファイル名を "file" に書きます) を置いてください
+import io
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import receipt_image  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "receipts.json")
+# 回線速度 (Mbps)
+NETWORKS = {"4G (5Mbps)": 5, "混雑した4G (1.5Mbps)": 1.5, "光回線 (50Mbps)": 50}
+RUNS = 3
+_EXIF_ORIENTATION = 0x0112
+
+
+def render_receipt_photo(fixture, width=4032, height=3024):
+    """暗い机の上に、正解どおりの品物と金額が印字された白いレシートが置かれた写真の代わりです。"""
+    photo_options = fixture["photo"]
+    lines = [fixture["shop"], ""] + [f"{item['name']:<18}{item['price']:>6}" for item in fixture["items"]] + \
+            ["", f"{'TOTAL':<18}{fixture['total']:>6}", f"{'CASH':<18}{fixture['total'] + 1000 - fixture['total'] % 1000:>6}"]
+    font = ImageFont.load_default(size=64)
+    # レシートは縦長で、写真の高さの8割ほどに写っているものとします
+    paper = Image.new("RGB", (int(width * 0.34), max(int(height * 0.8), 200 + 100 * len(lines))), (245, 243, 238))
+    draw = ImageDraw.Draw(paper)
+    for row, line in enumerate(lines):
+        draw.text((70, 100 + 100 * row), line, fill=(25, 25, 25), font=font)
+    paper = paper.rotate(photo_options["angle"], expand=True, fillcolor=(70, 55, 40))
+
+    photo = Image.effect_noise((width, height), 40).convert("RGB")
+    photo = Image.blend(photo, Image.new("RGB", (width, height), (70, 55, 40)), 0.6)
+    scale = min(0.9 * height / paper.height, 1.0)
+    paper = paper.resize((int(paper.width * scale), int(paper.height * scale)))
+    photo.paste(paper, ((width - paper.width) // 2, (height - paper.height) // 2))
+    photo = ImageEnhance.Brightness(photo).enhance(photo_options["brightness"])
+
+    exif = Image.Exif()
+    if photo_options["exif_rotate"]:
+        # 横向きに保存し、EXIF で「90度回して表示」と指示する、スマホ写真によくある形です
+        photo = photo.transpose(Image.Transpose.ROTATE_90)
+        exif[_EXIF_ORIENTATION] = 6
+    output = io.BytesIO()
+    photo.save(output, format="JPEG", quality=92, exif=exif)
+    return output.getvalue()
+
+
+def load_fixtures(folder=None):
+    """[(名前, 写真のバイト列, 正解), ...] を返します。"""
+    if folder is None:
+        with open(FIXTURES, encoding="utf-8") as fixture_file:
+            return [(fixture["name"], render_receipt_photo(fixture), fixture) for fixture in json.load(fixture_file)]
+    with open(os.path.join(folder, "expected.json"), encoding="utf-8") as fixture_file:
+        fixtures = json.load(fixture_file)
+    loaded = []
+    for fixture in fixtures:
+        with open(os.path.join(folder, fixture["file"]), "rb") as photo_file:
+            loaded.append((fixture.get("name", fixture["file"]), photo_file.read(), fixture))
+    return loaded
+
+
+# ---------------------------------------------------------------
+# 正確さの採点
+# ---------------------------------------------------------------
+def _name_key(name):
+    return re.sub(r"[\s・.]", "", str(name)).upper()
+
+
+def _amount(value):
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def score(extracted, expected):
+    """(合計金額が合っていたか, 正解の購入品のうち、名前と金額の両方が合っていた数) を返します。"""
+    extracted = extracted or {}
+    total_ok = _amount(extracted.get("total_amount", "")) == expected["total"]
+    remaining = [(_name_key(item.get("name", "")), _amount(item.get("price", ""))) for item in extracted.get("items") or []]
+    matched = 0
+    for item in expected["items"]:
+        key, price = _name_key(item["name"]), float(item["price"])
+        for candidate in remaining:
+            if candidate[1] == price and (key in candidate[0] or candidate[0] in key):
+                remaining.remove(candidate); matched += 1
+                break
+    return total_ok, matched
+
+
+def _analyze(api_key, photo, preprocess):
+    from tools import receipt_analysis
+    started = time.perf_counter()
+    try:
+        extracted, _ = receipt_analysis.analyze_receipt_image(api_key, photo, preprocess=preprocess)
+    except Exception as e:  # 読み取りに失敗したものも、不正解として数えます
+        print(f"    解析エラー: {e}")
+        extracted = None
+    return extracted, time.perf_counter() - started
+
+
+def main():
+    fixtures = load_fixtures(sys.argv[1] if len(sys.argv) > 1 else None)
+    api_key = os.environ.get("GEMINI_API_KEY")
+    totals = {"before_bytes": 0, "after_bytes": 0, "preprocess": 0.0}
+    results = {"before": [], "after": []}
+
+    print(f"{'レシート':<22}{'前':>10}{'後':>10}{'縮小率':>8}{'下ごしらえ':>10}")
+    for name, photo, expected in fixtures:
+        timings = []
+        for _ in range(RUNS):
+            started = time.perf_counter()
+            processed, stats = receipt_image.preprocess_receipt_image(photo)
+            timings.append(time.perf_counter() - started)
+        elapsed = statistics.median(timings)
+        totals["before_bytes"] += len(photo); totals["after_bytes"] += len(processed); totals["preprocess"] += elapsed
+        print(f"{name:<22}{len(photo) / 1024:>8.0f}KB{len(processed) / 1024:>8.0f}KB{len(processed) / len(photo):>8.1%}"
+              f"{elapsed * 1000:>8.0f}ms  (切り抜き: {stats['cropped']})")
+        if api_key:
+            for label, preprocess in (("before", False), ("after", True)):
+                extracted, latency = _analyze(api_key, photo, preprocess)
+                total_ok, matched = score(extracted, expected)
+                results[label].append((latency, total_ok, matched, len(expected["items"])))
+                print(f"    {'前' if label == 'before' else '後'}: {latency:5.2f}s  合計 {'○' if total_ok else '×'}  購入品 {matched}/{len(expected['items'])}")
+
+    count = len(fixtures)
+    print()
+    print("送信時間の見積もり (1枚あたり)      前        後")
+    for network, mbps in NETWORKS.items():
+        before = totals["before_bytes"] / count * 8 / (mbps * 1_000_000)
+        after = totals["after_bytes"] / count * 8 / (mbps * 1_000_000) + totals["preprocess"] / count
+        print(f"  {network:<30}{before:7.2f}s  {after:7.2f}s")
+
+    if not api_key:
+        print("\nGEMINI_API_KEY がないため、応答時間と読み取りの正確さは測りません。")
+        return
+    print()
+    print(f"{'':<22}{'応答時間(中央値)':>14}{'合計金額の正解率':>16}{'購入品の正解率':>14}")
+    for label in ("before", "after"):
+        rows = results[label]
+        print(f"{'前 (元の写真)' if label == 'before' else '後 (下ごしらえ)':<22}"
+              f"{statistics.median(row[0] for row in rows):>13.2f}s"
+              f"{sum(row[1] for row in rows) / len(rows):>16.0%}"
+              f"{sum(row[2] for row in rows) / sum(row[3] for row in rows):>14.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# ===============================================================
+# ★★★ bench_streaming.py ＜AI思い出パートナー: 少しずつ表示 vs 全文を待って表示＞ ★★★
+# ===============================================================
+# 同じ指示書・同じお話で、gemini_client.stream (少しずつ表示) と gemini_client.generate (全文を待って表示) を交互に呼び、
+#   - 最初の文字が画面に出るまでの秒数 (generate では、全文が届いた時)
+#   - 全文が届くまでの秒数
+# を比べます (それぞれ RUNS 回の中央値)。
+#
+#   python -m benchmarks.bench_streaming
+#       GEMINI_API_KEY があれば、実際のAPIで測ります
+#       なければ、応答を「最初の断片まで SIMULATED_FIRST_CHUNK_SECONDS 秒 + 断片ごとに SIMULATED_CHUNK_SECONDS 秒」とみなした模擬で比べます
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import ai_memory_partner_tool, gemini_client  # noqa: E402
+
+RUNS = 5
+PROMPT = "若い頃、家族で海に行った時のことを、よく思い出します。"
+SIMULATED_FIRST_CHUNK_SECONDS = 0.6
+SIMULATED_CHUNK_SECONDS = 0.25
+SIMULATED_CHUNKS = 12
+
+
+class SimulatedModel:
+    """generate_content の代わりです。stream=True なら断片を少しずつ、そうでなければ全部そろってから返します。"""
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        chunks = self._chunks()
+        if stream: return chunks
+        text = "".join(chunk.text for chunk in chunks)
+        return type("Response", (), {"text": text, "usage_metadata": None})()
+
+    def _chunks(self):
+        time.sleep(SIMULATED_FIRST_CHUNK_SECONDS)
+        for index in range(SIMULATED_CHUNKS):
+            if index: time.sleep(SIMULATED_CHUNK_SECONDS)
+            yield type("Chunk", (), {"text": "そうでしたか。", "usage_metadata": None})()
+
+
+def _time_stream(api_key):
+    timings = {}
+    for _ in ai_memory_partner_tool.measure_stream_timing(
+            gemini_client.stream(api_key, [PROMPT], prompt_name=ai_memory_partner_tool.SYSTEM_PROMPT_NAME), timings):
+        pass
+    return timings["first_token_seconds"], timings["total_seconds"]
+
+
+def _time_generate(api_key):
+    started = time.perf_counter()
+    gemini_client.generate(api_key, [PROMPT], prompt_name=ai_memory_partner_tool.SYSTEM_PROMPT_NAME)
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+def main():
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        api_key = "simulated"
+        gemini_client.get_model = lambda api_key, model_name=None, system_instruction=None: SimulatedModel()
+        print(f"模擬 (最初の断片まで {SIMULATED_FIRST_CHUNK_SECONDS}s、以降 {SIMULATED_CHUNKS} 断片 × {SIMULATED_CHUNK_SECONDS}s)\n")
+    results = {"stream": [], "generate": []}
+    for _ in range(RUNS):
+        results["stream"].append(_time_stream(api_key))
+        results["generate"].append(_time_generate(api_key))
+
+    print(f"{'':<26}{'最初の文字まで':>12}{'全文まで':>10}")
+    for name, label in (("generate", "全文を待って表示 (generate)"), ("stream", "少しずつ表示 (stream)")):
+        first = statistics.median(row[0] for row in results[name])
+        total = statistics.median(row[1] for row in results[name])
+        print(f"{label:<26}{first:>11.2f}s{total:>9.2f}s")
+    saved = statistics.median(row[0] for row in results["generate"]) - statistics.median(row[0] for row in results["stream"])
+    print(f"\n最初の文字が出るまでの待ち時間は、{saved:.2f}秒 短くなりました (中央値, {RUNS}回)。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+# テストは、一時ディレクトリの中で実行します (multitool_state.db などを、作業ツリーに作らないように)
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="multitool_tests_"))
@@ -0,0 +1,107 @@
+import io
+import math
+import shutil
+import struct
+import subprocess
+import wave
+
+import pytest
+
+from tools import audio_preprocess
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg がありません")
+
+
+def make_wav(silence=1.0, voice=3.0, rate=44100, channels=2):
+    """前後に無音のある、声の高さのように揺れる音のWAVです。"""
+    frames = bytearray()
+    total = int((silence * 2 + voice) * rate)
+    for i in range(total):
+        t = i / rate
+        loud = silence <= t < silence + voice
+        value = int(12000 * math.sin(2 * math.pi * (180 + 60 * math.sin(2 * math.pi * 3 * t)) * t)) if loud else 0
+        frames += struct.pack("<h", value) * channels
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(channels); wav.setsampwidth(2); wav.setframerate(rate)
+        wav.writeframes(bytes(frames))
+    return output.getvalue()
+
+
+def encode(wav_bytes, *args):
+    """ffmpeg で、マイク録音などによくある形式(webm / m4a / mp3)に変換します。"""
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *args, "pipe:1"],
+                            input=wav_bytes, capture_output=True, check=True)
+    return result.stdout
+
+
+def test_sniffs_formats_from_header_bytes():
+    assert audio_preprocess.sniff_format(make_wav(0, 0.1)) == "wav"
+    assert audio_preprocess.sniff_format(b"OggS" + bytes(12)) == "ogg"
+    assert audio_preprocess.sniff_format(b"\x1a\x45\xdf\xa3" + bytes(12)) == "webm"
+    assert audio_preprocess.sniff_format(b"\x00\x00\x00\x20ftypM4A " + bytes(4)) == "m4a"
+    assert audio_preprocess.mime_type_for(b"unknown data....", "audio/x-custom") == "audio/x-custom"
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("source_format, args", [
+    ("wav", None),
+    ("webm", ["-c:a", "libopus", "-b:a", "128k", "-f", "webm"]),
+    ("m4a", ["-c:a", "aac", "-b:a", "192k", "-f", "ipod", "-movflags", "frag_keyframe+empty_moov"]),
+    ("mp3", ["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"]),
+])
+def test_ffmpeg_converts_common_formats_to_small_opus(source_format, args):
+    original = make_wav() if args is None else encode(make_wav(), *args)
+    processed, mime_type, stats = audio_preprocess.normalize_audio(original, "audio/webm")
+    assert stats["format"] == source_format
+    assert stats["method"] == "ffmpeg"
+    assert mime_type == "audio/ogg" and processed[:4] == b"OggS"
+    assert len(processed) < len(original)
+
+
+@needs_ffmpeg
+def test_ffmpeg_extracts_a_segment(tmp_path):
+    path = tmp_path / "meeting.wav"
+    path.write_bytes(make_wav(silence=0.5, voice=4.0))
+    segment, mime_type = audio_preprocess.extract_segment(path, 1.0, 3.0)
+    assert mime_type == "audio/ogg" and segment[:4] == b"OggS"
+
+
+def test_numpy_path_resamples_and_trims_silence_without_ffmpeg(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(audio_preprocess.shutil, "which", lambda name: None)
+    processed, mime_type, stats = audio_preprocess.normalize_audio(make_wav())
+    assert stats["method"] == "numpy" and mime_type == "audio/wav"
+    with wave.open(io.BytesIO(processed)) as wav:
+        assert (wav.getnchannels(), wav.getframerate()) == (1, audio_preprocess.TARGET_SAMPLE_RATE)
+        duration = wav.getnframes() / wav.getframerate()
+    assert 3.0 <= duration <= 3.0 + 2 * audio_preprocess.SILENCE_PADDING_SECONDS + 0.05
+
+
+def test_unconvertible_audio_passes_through(monkeypatch):
+    monkeypatch.setattr(audio_preprocess.shutil, "which", lambda name: None)
+    data = b"\x1a\x45\xdf\xa3" + bytes(100)
+    processed, mime_type, stats = audio_preprocess.normalize_audio(data, "audio/webm")
+    assert (processed, mime_type, stats["method"]) == (data, "audio/webm", "passthrough")
+
+
+def test_wav_segment_and_duration_without_ffmpeg(monkeypatch, tmp_path):
+    monkeypatch.setattr(audio_preprocess.shutil, "which", lambda name: None)
+    path = tmp_path / "meeting.wav"
+    path.write_bytes(make_wav(silence=0.5, voice=2.0))
+    assert audio_preprocess.probe_duration(path) == pytest.approx(3.0)
+    segment, mime_type = audio_preprocess.extract_segment(path, 1.0, 2.0)
+    with wave.open(io.BytesIO(segment)) as wav:
+        assert wav.getnframes() / wav.getframerate() == pytest.approx(1.0, abs=0.01)
+
+
+def test_numpy_resampling_filters_out_tones_above_the_new_nyquist():
+    np = pytest.importorskip("numpy")
+    rate = 48000
+    t = np.arange(rate) / rate
+    speech_band = audio_preprocess._resample(np.sin(2 * np.pi * 1000 * t).astype(np.float32), rate, audio_preprocess.TARGET_SAMPLE_RATE)
+    # 12kHz の音は、フィルタなしで間引くと 4kHz に折り返して残ります
+    above_nyquist = audio_preprocess._resample(np.sin(2 * np.pi * 12000 * t).astype(np.float32), rate, audio_preprocess.TARGET_SAMPLE_RATE)
+    rms = lambda samples: float(np.sqrt(np.mean(samples[100:-100] ** 2)))
+    assert rms(speech_band) > 0.6
+    assert rms(above_nyquist) < 0.02
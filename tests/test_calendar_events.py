@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("pytz")
+
+from tools import calendar_events  # noqa: E402
+
+
+def test_offset_aware_times_are_read_as_jst():
+    events = calendar_events.expand_occurrences({"title": "面談", "start_time": "2026-10-20T06:00:00Z", "end_time": "2026-10-20T16:00:00+09:00"})
+    assert (events[0]["start_time"], events[0]["end_time"]) == ("2026-10-20T15:00:00", "2026-10-20T16:00:00")
+    assert calendar_events.utc_stamp("2026-10-20T15:00:00+09:00") == calendar_events.utc_stamp("2026-10-20T15:00:00") == "20261020T060000Z"
+
+
+def test_one_aware_event_does_not_break_the_ics():
+    events = [{"title": "A", "start_time": "2026-10-20T15:00:00+09:00"}, {"title": "B", "start_time": "2026-10-21T10:00:00"}]
+    ics = calendar_events.build_ics([occurrence for event in events for occurrence in calendar_events.expand_occurrences(event)])
+    assert ics.count("BEGIN:VEVENT") == 2
+    assert "DTSTART:20261020T060000Z" in ics
+
+
+@pytest.mark.parametrize("recurrence, expected", [
+    ({"frequency": "WEEKLY", "count": 3}, 3),
+    ({"frequency": "WEEKLY", "until": "2026-11-03"}, 3),
+    ({"frequency": "WEEKLY", "count": 10, "until": "2026-11-03"}, 3),  # 終了日の方が先に来ます
+    ({"frequency": "WEEKLY", "count": 2, "until": "2026-12-31"}, 2),  # 回数の方が先に来ます
+])
+def test_google_rule_and_ics_agree_on_the_number_of_occurrences(recurrence, expected):
+    event = {"title": "定例", "start_time": "2026-10-20T10:00:00", "recurrence": recurrence}
+    assert len(calendar_events.expand_occurrences(event)) == expected
+    assert calendar_events.google_recur_rule(event).endswith(f";COUNT={expected}")
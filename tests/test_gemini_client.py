@@ -0,0 +1,118 @@
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from google.api_core import exceptions  # noqa: E402
+
+from tools import gemini_client  # noqa: E402
+
+
+class FakeClock:
+    """time の代わりです。sleep は実際には待たず、待った秒数を記録して時計を進めます。"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeBackend:
+    """決めた順に、エラーを出すか応答を返す、Geminiの代わりです。呼ばれた回数を数えます。"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception): raise outcome
+        return outcome
+
+
+class FakeModel:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, contents, generation_config=None):
+        return type("Response", (), {"text": self.backend()})()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(gemini_client, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def api_key(request):
+    return f"test-key-{request.node.name}"  # テストごとに、新しいトークンバケットを使います
+
+
+def _backoff_waits(clock, count):
+    # 最初の BURST_SIZE 回はバケットが満タンなので、記録された待ち時間は、すべてバックオフの分です
+    assert len(clock.sleeps) == count
+    return clock.sleeps
+
+
+def test_retries_rate_limit_then_succeeds(clock, api_key):
+    backend = FakeBackend(exceptions.ResourceExhausted("quota"), exceptions.ResourceExhausted("quota"), "ok")
+    assert gemini_client.call_with_retry(api_key, backend) == "ok"
+    assert backend.calls == 3
+    for attempt, waited in enumerate(_backoff_waits(clock, 2)):
+        assert 0 <= waited <= min(gemini_client.BACKOFF_MAX_SECONDS, gemini_client.BACKOFF_BASE_SECONDS * 2 ** attempt)
+
+
+def test_honours_retry_after_from_the_error(clock, api_key):
+    backend = FakeBackend(exceptions.ResourceExhausted("Resource exhausted. Please retry in 7.5s."), "ok")
+    assert gemini_client.call_with_retry(api_key, backend) == "ok"
+    assert _backoff_waits(clock, 1)[0] >= 7.5
+
+
+def test_retries_timeouts(clock, api_key):
+    backend = FakeBackend(exceptions.DeadlineExceeded("timeout"), "ok")
+    assert gemini_client.call_with_retry(api_key, backend) == "ok"
+    assert backend.calls == 2
+
+
+def test_gives_up_after_max_retries_with_the_last_error(clock, api_key):
+    errors = [exceptions.ResourceExhausted(f"quota {i}") for i in range(gemini_client.MAX_RETRIES)] + [exceptions.DeadlineExceeded("last")]
+    backend = FakeBackend(*errors)
+    with pytest.raises(exceptions.DeadlineExceeded, match="last"):
+        gemini_client.call_with_retry(api_key, backend)
+    assert backend.calls == gemini_client.MAX_RETRIES + 1
+
+
+def test_does_not_retry_permanent_errors(clock, api_key):
+    backend = FakeBackend(exceptions.InvalidArgument("bad request"), "ok")
+    with pytest.raises(exceptions.InvalidArgument):
+        gemini_client.call_with_retry(api_key, backend)
+    assert backend.calls == 1 and clock.sleeps == []
+
+
+def test_generate_goes_through_retry(clock, api_key, monkeypatch):
+    backend = FakeBackend(exceptions.ServiceUnavailable("busy"), "こんにちは")
+    monkeypatch.setattr(gemini_client, "get_model", lambda *args, **kwargs: FakeModel(backend))
+    assert gemini_client.generate(api_key, ["hi"]) == "こんにちは"
+    assert backend.calls == 2
+
+
+def test_token_bucket_allows_a_burst_then_paces(clock):
+    bucket = gemini_client.TokenBucket(rate_per_second=2.0, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    waited = bucket.acquire()
+    assert waited == pytest.approx(0.5)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_retry_after_header_is_read():
+    response = type("Response", (), {"headers": {"Retry-After": "12"}})()
+    error = exceptions.TooManyRequests("slow down", response=response)
+    assert gemini_client.retry_after_seconds(error) == 12.0
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+from tools.jp_datetime_parser import parse_schedule
+
+# 2024年5月15日(水) 10:00 JST
+NOW = datetime(2024, 5, 15, 10, 0)
+
+# (入力, 件名, 開始, 終了)
+PARSED = [
+    ("明日の15時から歯医者", "歯医者", "2024-05-16T15:00:00", "2024-05-16T16:00:00"),
+    ("来週月曜の午前10時 打ち合わせ", "打ち合わせ", "2024-05-20T10:00:00", "2024-05-20T11:00:00"),
+    ("来週月曜10時 打ち合わせ", "打ち合わせ", "2024-05-20T10:00:00", "2024-05-20T11:00:00"),
+    ("明日9時 会議", "会議", "2024-05-16T09:00:00", "2024-05-16T10:00:00"),
+    ("明日11時 打ち合わせ", "打ち合わせ", "2024-05-16T11:00:00", "2024-05-16T12:00:00"),
+    ("5月20日 14:00-15:30 定例会議", "定例会議", "2024-05-20T14:00:00", "2024-05-20T15:30:00"),
+    ("明日午後3時から5時まで会議", "会議", "2024-05-16T15:00:00", "2024-05-16T17:00:00"),
+    ("金曜19時 飲み会", "飲み会", "2024-05-17T19:00:00", "2024-05-17T20:00:00"),
+    ("明後日 正午 ランチ", "ランチ", "2024-05-17T12:00:00", "2024-05-17T13:00:00"),
+    ("3日後の18時半 ジム", "ジム", "2024-05-18T18:30:00", "2024-05-18T19:30:00"),
+    ("明日の朝7時 ジョギング", "ジョギング", "2024-05-16T07:00:00", "2024-05-16T08:00:00"),
+    ("明日の夜7時 飲み会", "飲み会", "2024-05-16T19:00:00", "2024-05-16T20:00:00"),
+    ("来月の5日 20時 食事会", "食事会", "2024-06-05T20:00:00", "2024-06-05T21:00:00"),
+    ("明日十五時 歯医者", "歯医者", "2024-05-16T15:00:00", "2024-05-16T16:00:00"),
+    ("今日の13時 面談", "面談", "2024-05-15T13:00:00", "2024-05-15T14:00:00"),
+]
+
+# 手元では決めきれず、AIに任せるべき言い方
+LEFT_TO_AI = [
+    "明日10時間勉強",          # 「時間」は時刻ではありません
+    "明日7時から飲み会",        # 午前か午後か分かりません
+    "明日3時 会議",
+    "明日15時 渋谷で打ち合わせ",  # 場所がありそう
+    "明日の15時と17時 面接",     # 時刻が2つで、範囲ではありません
+    "明日 歯医者",              # 時刻がありません
+    "15時に会議",               # 日付がなく、今日の15時はもう過ぎています (明日のことかもしれません)
+]
+
+
+@pytest.mark.parametrize("text, title, start, end", PARSED)
+def test_parses_common_phrases(text, title, start, end):
+    event = parse_schedule(text, NOW)
+    assert event == {"title": title, "start_time": start, "end_time": end}
+
+
+@pytest.mark.parametrize("text", LEFT_TO_AI)
+def test_leaves_ambiguous_phrases_to_ai(text):
+    event = parse_schedule(text, NOW.replace(hour=16))
+    assert event is None
+
+
+def test_flags_explicit_time_already_past():
+    event = parse_schedule("今日の午前9時 朝会", NOW)
+    assert event["start_time"] == "2024-05-15T09:00:00"
+    assert event["warning"]
+
+
+def test_future_event_has_no_warning():
+    assert "warning" not in parse_schedule("今日の13時 面談", NOW)
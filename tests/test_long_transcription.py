@@ -0,0 +1,89 @@
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from tools import long_transcription  # noqa: E402
+
+
+def test_plan_segments_overlap_and_cover_the_whole_audio():
+    segments = long_transcription.plan_segments(700, segment_seconds=300, overlap_seconds=15)
+    assert segments == [(0, 0.0, 300.0), (1, 285.0, 585.0), (2, 570.0, 700)]
+    assert long_transcription.plan_segments(200, segment_seconds=300) == [(0, 0.0, 200)]
+
+
+def test_overlap_lines_are_dropped_once():
+    first = "スピーカーA: 本日の議題は来期の予算についてです\nスピーカーB: 営業部からは増額をお願いしたいです"
+    second = "スピーカーA: 営業部からは増額をお願いしたいです\nスピーカーA: 理由は新規顧客の獲得です"
+    assert long_transcription.stitch_segments([first, second]).splitlines() == [
+        "スピーカーA: 本日の議題は来期の予算についてです",
+        "スピーカーB: 営業部からは増額をお願いしたいです",
+        "スピーカーB: 理由は新規顧客の獲得です",
+    ]
+
+
+def test_speaker_labels_are_remapped_to_the_first_segment():
+    first = "スピーカーA: それでは会議を始めます\nスピーカーB: よろしくお願いします\nスピーカーA: まず売上の報告からお願いします"
+    # 次の区間では、最初に話したBさんが「スピーカーA」、Aさんが「スピーカーB」になっています
+    second = ("スピーカーA: よろしくお願いします\nスピーカーB: まず売上の報告からお願いします\n"
+              "スピーカーA: 先月は前年比で一割増えました\nスピーカーC: 経理の田中です、補足します")
+    assert long_transcription.stitch_segments([first, second]).splitlines()[3:] == [
+        "スピーカーB: 先月は前年比で一割増えました",
+        "スピーカーC: 経理の田中です、補足します",
+    ]
+
+
+def test_unmatched_speakers_get_fresh_labels():
+    first = "スピーカーA: 午前の部はここまでです\nスピーカーB: ありがとうございました"
+    second = "スピーカーA: 午後の部を始めます\nスピーカーB: 新しい議題です"
+    lines = long_transcription.stitch_segments([first, second]).splitlines()
+    assert lines[2:] == ["スピーカーC: 午後の部を始めます", "スピーカーD: 新しい議題です"]
+
+
+def test_lines_that_differ_only_in_numbers_are_not_treated_as_overlap():
+    first = "スピーカーA: 議題の3番に移ります"
+    second = "スピーカーA: 議題の4番に移ります"
+    assert len(long_transcription.stitch_segments([first, second]).splitlines()) == 2
+
+
+def test_unlabelled_lines_and_empty_segments_are_kept_in_order():
+    assert long_transcription.stitch_segments(["", "（拍手）\nスピーカーA: 開会します", "スピーカーA: 開会します\n閉会"]) == \
+        "（拍手）\nスピーカーA: 開会します\n閉会"
+
+
+def test_segments_run_in_parallel_and_are_stitched_in_order(monkeypatch):
+    monkeypatch.setattr(long_transcription, "transcribe_segment",
+                        lambda api_key, path, start, end: f"スピーカーA: {int(start)}秒からの話です")
+    progress = []
+    text = long_transcription.transcribe_long_audio("key", "meeting.wav", long_transcription.plan_segments(700),
+                                                    on_progress=lambda done, total, partial: progress.append((done, total)))
+    assert [line.split(": ")[1] for line in text.splitlines()] == ["0秒からの話です", "285秒からの話です", "570秒からの話です"]
+    assert progress[-1] == (3, 3)
+
+
+def test_labels_fall_back_to_numbers_after_z():
+    used = {f"スピーカー{chr(code)}" for code in range(ord("A"), ord("Z") + 1)}
+    assert long_transcription._label_mapping([], ["スピーカーA"], used) == {"スピーカーA": "スピーカー27"}
+
+
+def test_interrupted_run_does_not_wait_for_queued_segments(monkeypatch):
+    started = []
+    monkeypatch.setattr(long_transcription, "transcribe_segment",
+                        lambda api_key, path, start, end: started.append(start) or "スピーカーA: 話です")
+
+    def interrupt(done, total, partial):
+        raise KeyboardInterrupt  # Streamlit の再実行・停止と同じく、Exception ではない例外です
+
+    with pytest.raises(KeyboardInterrupt):
+        long_transcription.transcribe_long_audio("key", "meeting.wav", long_transcription.plan_segments(3600),
+                                                 on_progress=interrupt, max_workers=1)
+    assert len(started) < len(long_transcription.plan_segments(3600))
+
+
+def test_on_model_call_only_when_segments_are_left(monkeypatch):
+    monkeypatch.setattr(long_transcription, "transcribe_segment", lambda api_key, path, start, end: "スピーカーA: 話です")
+    segments = long_transcription.plan_segments(700)
+    calls = []
+    for _ in range(2):
+        long_transcription.transcribe_long_audio("key", "meeting.wav", segments, content_hash="on-model-call",
+                                                 on_model_call=lambda: calls.append(1))
+    assert len(calls) == 1  # 2回目は、保存済みの区間だけでつなぎます
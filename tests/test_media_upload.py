@@ -0,0 +1,124 @@
+import io
+import shutil
+import threading
+import time
+import wave
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from tools import media_upload  # noqa: E402
+
+
+class FakeFileService:
+    """File API の代わりです。アップロードされたファイルを覚え、最初の get_file までは PROCESSING を返します。"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.created, self.deleted, self.files = [], [], {}
+
+    def _file(self, name, state):
+        return type("File", (), {"name": name, "uri": f"https://files.invalid/{name}", "state": type("State", (), {"name": state})()})()
+
+    def create_file(self, path, mime_type=None, display_name=None):
+        time.sleep(self.delay)
+        with open(path, "rb") as audio_file:
+            name = f"files/{len(self.created)}"
+            self.files[name] = audio_file.read()
+        self.created.append(name)
+        return self._file(name, "PROCESSING")
+
+    def get_file(self, name):
+        return self._file(name, "ACTIVE")
+
+    def delete_file(self, name):
+        self.deleted.append(name)
+        self.files.pop(name)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    fake = FakeFileService()
+    monkeypatch.setattr(media_upload, "_get_file_client", lambda api_key: fake)
+    monkeypatch.setattr(media_upload.time, "sleep", lambda seconds: None)
+    return fake
+
+
+def _spool(data):
+    return media_upload.spool(io.BytesIO(data), "audio/mpeg")
+
+
+def test_spool_writes_the_upload_to_disk_with_its_hash():
+    data = b"ID3" + bytes(range(256)) * 10_000
+    with _spool(data) as spooled:
+        assert spooled.read_bytes() == data
+        assert spooled.size == len(data)
+        assert spooled.mime_type == "audio/mpeg"
+        path = spooled.path
+    assert not media_upload.os.path.exists(path)
+
+
+def test_the_same_audio_is_uploaded_once_per_key(service):
+    with _spool(b"ID3 reuse") as spooled:
+        first = media_upload.file_part("key-a", spooled)
+        assert media_upload.file_part("key-a", spooled) == first
+        media_upload.file_part("key-b", spooled)  # ほかのキーからは、前のファイルを使えません
+    assert len(service.created) == 2
+    assert first["file_data"]["file_uri"] == "https://files.invalid/files/0"
+
+
+def test_concurrent_requests_share_one_upload(monkeypatch, service):
+    service.delay = 0.05
+    monkeypatch.setattr(media_upload.time, "sleep", time.sleep)
+    with _spool(b"ID3 concurrent") as spooled:
+        parts = []
+        threads = [threading.Thread(target=lambda: parts.append(media_upload.file_part("key-c", spooled))) for _ in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+    assert len(service.created) == 1
+    assert len({part["file_data"]["file_uri"] for part in parts}) == 1
+
+
+def test_expired_uploads_are_deleted_from_the_file_api(monkeypatch, service):
+    with _spool(b"ID3 expiry") as spooled:
+        media_upload.file_part("key-d", spooled)
+        media_upload.file_part("key-e", spooled)
+        now = time.time()
+        monkeypatch.setattr(media_upload.time, "time", lambda: now + media_upload.UPLOAD_TTL_SECONDS + 1)
+        assert media_upload.cleanup_expired("key-d", force=True) >= 2
+        assert service.deleted == ["files/0"]  # key-e のファイルは、File API 側の自動削除に任せます
+        media_upload.file_part("key-d", spooled)
+    assert len(service.created) == 3
+
+
+def _long_wav(seconds=30, rate=48000):
+    """File API 経由になる大きさ(INLINE_MAX_BYTES 超え)の、ステレオのWAVです。"""
+    np = pytest.importorskip("numpy")
+    t = np.arange(int(seconds * rate)) / rate
+    samples = (9000 * np.sin(2 * np.pi * 220 * t)).astype("<i2")
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(2); wav.setsampwidth(2); wav.setframerate(rate)
+        wav.writeframes(np.repeat(samples, 2).tobytes())
+    return output.getvalue()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg がありません")
+def test_large_audio_is_normalized_before_the_size_check(service):
+    data = _long_wav()
+    assert len(data) > media_upload.INLINE_MAX_BYTES
+    with _spool(data) as spooled:
+        part = media_upload.audio_part("key-f", spooled)
+    # Opus に変換すると小さくなり、File API を使わずに直接送れます
+    assert part["mime_type"] == "audio/ogg" and part["data"][:4] == b"OggS"
+    assert service.created == []
+
+
+def test_large_audio_is_uploaded_as_is_without_ffmpeg(monkeypatch, service):
+    monkeypatch.setattr(media_upload.audio_preprocess.shutil, "which", lambda name: None)
+    data = _long_wav()
+    with _spool(data) as spooled:
+        part = media_upload.audio_part("key-g", spooled)
+    assert part["file_data"]["mime_type"] == "audio/wav"
+    assert service.files[service.created[0]] == data
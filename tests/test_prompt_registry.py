@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from tools import gemini_client, prompt_registry, structured_output  # noqa: E402
+
+
+class Usage:
+    def __init__(self, prompt_token_count, cached_content_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+
+class EchoModel:
+    """受け取った指示書と内容を、そのまま応答として返すモデルの代わりです。2回目以降は、指示書がキャッシュから読まれたことにします。"""
+
+    calls = []
+
+    def __init__(self, system_instruction):
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, generation_config=None):
+        EchoModel.calls.append(self.system_instruction)
+        tokens = prompt_registry.estimate_tokens(self.system_instruction or "")
+        cached = tokens if EchoModel.calls.count(self.system_instruction) > 1 else 0
+        text = '{"instruction": %d, "contents": "%s"}' % (len(self.system_instruction or ""), contents)
+        return type("Response", (), {"text": text, "usage_metadata": Usage(tokens + 10, cached)})()
+
+
+@pytest.fixture(autouse=True)
+def echo_backend(monkeypatch):
+    EchoModel.calls = []
+    monkeypatch.setattr(gemini_client, "get_model", lambda api_key, model_name=None, system_instruction=None: EchoModel(system_instruction))
+    monkeypatch.setattr(gemini_client, "call_with_retry", lambda api_key, request: request())
+
+
+def test_registered_prompt_matches_inline_system_instruction():
+    name = prompt_registry.register("test.echo", "  あなたは家計簿の専門家です。  ")
+    by_name = gemini_client.generate("key", "レシート", prompt_name=name)
+    inline = gemini_client.generate("key", "レシート", system_instruction="あなたは家計簿の専門家です。")
+    assert by_name == inline
+    assert EchoModel.calls == ["あなたは家計簿の専門家です。"] * 2
+
+
+def test_generate_json_output_is_the_same_either_way():
+    name = prompt_registry.register("test.json", "JSONで答えてください。")
+    assert structured_output.generate_json("key", "x", prompt_name=name) == \
+        structured_output.generate_json("key", "x", system_instruction="JSONで答えてください。")
+
+
+def test_stats_record_measured_cached_tokens():
+    name = prompt_registry.register("test.stats", "指示書" * 100)
+    for _ in range(3): gemini_client.generate("key", "内容", prompt_name=name)
+    counts = prompt_registry.stats()[name]
+    assert counts["calls"] == 3
+    assert counts["prompt_tokens"] == 3 * (300 + 10)
+    assert counts["cached_tokens"] == 2 * 300  # 1回目は読み込み、2回目以降はキャッシュから
+
+
+def test_fingerprint_changes_with_text_or_version():
+    first = prompt_registry.get(prompt_registry.register("test.fp", "A"))["fingerprint"]
+    assert prompt_registry.get(prompt_registry.register("test.fp", "A", version="2"))["fingerprint"] != first
+    assert prompt_registry.get(prompt_registry.register("test.fp", "B"))["fingerprint"] != first
+
+
+def test_on_model_call_is_skipped_on_a_response_cache_hit():
+    calls = []
+    for _ in range(2):
+        structured_output.generate_json("key", "同じ入力", system_instruction="JSONで答えてください。",
+                                        cache_namespace="test.on_model_call", prompt_version="1",
+                                        on_model_call=lambda: calls.append(1))
+    assert len(calls) == 1
+    assert len(EchoModel.calls) == 1
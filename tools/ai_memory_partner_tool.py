@@ -2,10 +2,14 @@
 # ★★★ ai_memory_partner_tool.py ＜最終完成版＞ ★★★
 # ===============================================================
 import streamlit as st
-import google.generativeai as genai
 import time
 from datetime import datetime, timedelta, timezone
 from streamlit_mic_recorder import mic_recorder
+from tools import gemini_client
+from tools import prompt_registry
+from tools import partner_memory
+from tools import transcription
+from tools import session_history
 
 # ★★★ プロンプトの魂を、完全な形で、ここに復元します ★★★
 SYSTEM_PROMPT_TRUE_FINAL = """
@@ -68,16 +72,35 @@ SYSTEM_PROMPT_TRUE_FINAL = """
 *   **挨拶は1度だけ：** 「おはようございます」「こんにちは」「こんばんは」などの挨拶は最初の1度だけで十分です。何度も挨拶してはいけません。
 """
 
+# 大きな指示書は登録しておき、名前で指定して、毎回同じ形の system_instruction として送ります
+# (明示的なコンテキストキャッシュは使いません。呼び出し回数とキャッシュから読まれたトークン数は prompt_registry.stats() で分かります)
+SYSTEM_PROMPT_NAME = prompt_registry.register("ai_memory_partner.system", SYSTEM_PROMPT_TRUE_FINAL)
+
+# ★ 返事を、生成された順に少しずつ表示します (False にすると、全文の完成を待ってから表示します)
+STREAM_REPLIES = True
+LAST_REPLY_TIMINGS_KEY = "cc_last_reply_timings"
+
+def measure_stream_timing(chunks, timings):
+    """断片をそのまま流しながら、最初の文字が届くまでの秒数と、全体の秒数を timings に記録します。"""
+    started_at = time.perf_counter()
+    for chunk in chunks:
+        if "first_token_seconds" not in timings:
+            timings["first_token_seconds"] = time.perf_counter() - started_at
+        yield chunk
+    timings["total_seconds"] = time.perf_counter() - started_at
+
+def show_reply_timings():
+    """直近の返事が、最初の文字まで・全文までに何秒かかったかを表示します。"""
+    last_timings = st.session_state.get(LAST_REPLY_TIMINGS_KEY)
+    if last_timings and "total_seconds" in last_timings:
+        st.caption(f"⏱️ 直近の返事: 最初の文字まで {last_timings['first_token_seconds']:.2f} 秒 / 全文まで {last_timings['total_seconds']:.2f} 秒")
+
 def dialogue_with_gemini(content_to_process, api_key):
     if not content_to_process or not api_key: return None, None
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
         if isinstance(content_to_process, bytes):
             with st.spinner("（あなたの声を、言葉に、変えています...）"):
-                audio_part = {"mime_type": "audio/webm", "data": content_to_process}
-                transcription_response = model.generate_content(["この日本語の音声を、できる限り正確に、文字に書き起こしてください。書き起こした日本語テキストのみを回答してください。", audio_part])
-                processed_text = transcription_response.text.strip()
+                processed_text = transcription.transcribe(api_key, content_to_process, "audio/webm")
             if not processed_text:
                 st.error("あなたの声を、言葉に、変えることができませんでした。もう一度お試しください。")
                 return None, None
@@ -85,10 +108,23 @@ def dialogue_with_gemini(content_to_process, api_key):
         else:
             processed_text = content_to_process
             original_input_display = processed_text
-        with st.spinner("（AIが、あなたのお話を、一生懸命聞いています...）"):
-            # ★★★ ここで、完全なプロンプトが使われます ★★★
-            response = model.generate_content([SYSTEM_PROMPT_TRUE_FINAL, processed_text])
-            ai_response_text = response.text
+        # ★★★ ここで、完全なプロンプトが使われます ★★★
+        # 過去の会話は全部ではなく、直近の数往復と、今のお話に関係のありそうなものだけを添えます
+        memory_context = partner_memory.build_context(api_key, processed_text)
+        request_contents = [memory_context, processed_text] if memory_context else [processed_text]
+        timings = {}
+        if STREAM_REPLIES:
+            with st.chat_message("user"): st.write(original_input_display)
+            with st.chat_message("assistant"):
+                ai_response_text = st.write_stream(measure_stream_timing(gemini_client.stream(api_key, request_contents, prompt_name=SYSTEM_PROMPT_NAME), timings))
+        else:
+            with st.spinner("（AIが、あなたのお話を、一生懸命聞いています...）"):
+                started_at = time.perf_counter()
+                ai_response_text = gemini_client.generate(api_key, request_contents, prompt_name=SYSTEM_PROMPT_NAME)
+                timings["first_token_seconds"] = timings["total_seconds"] = time.perf_counter() - started_at
+        st.session_state[LAST_REPLY_TIMINGS_KEY] = timings
+        show_reply_timings()
+        if ai_response_text: partner_memory.remember_turn(api_key, processed_text, ai_response_text)
         return original_input_display, ai_response_text
     except Exception as e:
         st.error(f"AI処理中に予期せぬエラーが発生しました: {e}")
@@ -104,8 +140,7 @@ def show_tool(gemini_api_key, localS_object=None):
     usage_count_key = f"{prefix}usage_count"
     last_input_key = f"{prefix}last_input"
 
-    if results_key not in st.session_state:
-        st.session_state[results_key] = []
+    session_history.ensure(st.session_state, prefix)
     if usage_count_key not in st.session_state:
         st.session_state[usage_count_key] = 0
     if last_input_key not in st.session_state:
@@ -175,16 +210,28 @@ def show_tool(gemini_api_key, localS_object=None):
                 original, ai_response = dialogue_with_gemini(content_to_process, gemini_api_key)
                 if original and ai_response:
                     st.session_state[usage_count_key] += 1
-                    st.session_state[results_key].insert(0, {"original": original, "response": ai_response})
+                    session_history.push(st.session_state, prefix, {"original": original, "response": ai_response})
                     st.rerun()
 
+    # 返事の速さは、利用回数の上限に達した後(返事の直後の再実行で、上限の画面に切り替わった後)も表示します
+    show_reply_timings()
     if st.session_state.get(results_key) and not is_limit_reached:
         st.write("---")
         for result in st.session_state[results_key]:
             with st.chat_message("user"): st.write(result['original'])
             with st.chat_message("assistant"): st.write(result['response'])
+        # 画面に出しきれない古い会話は、開いた時に1ページ分だけ読み込みます
+        older_count = session_history.spilled_count(st.session_state, prefix)
+        if older_count and st.toggle(f"それより前の会話を表示 ({older_count}件)", key=f"{prefix}show_older"):
+            page_count = (older_count + session_history.DEFAULT_PAGE_SIZE - 1) // session_history.DEFAULT_PAGE_SIZE
+            page = st.number_input("ページ", min_value=1, max_value=page_count, value=1, key=f"{prefix}older_page") - 1
+            for older in session_history.fetch_spilled(st.session_state, prefix, page):
+                st.markdown(f"**🧑 {older['original']}**\n\n🤖 {older['response']}")
         if st.button("会話の履歴をクリア", key=f"{prefix}clear_history"):
-            st.session_state[results_key] = []
+            session_history.clear(st.session_state, prefix)
             st.session_state[usage_count_key] = 0
             st.session_state[last_input_key] = None
             st.rerun()
+        if gemini_api_key and st.button("AIパートナーの記憶を消す (これまでの会話を忘れます)", key=f"{prefix}forget_memory"):
+            partner_memory.forget(gemini_api_key)
+            st.success("これまでの会話の記憶を消しました。")
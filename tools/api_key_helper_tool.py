@@ -1,21 +1,8 @@
 import streamlit as st
-import json
-from pathlib import Path
 import time
 
 # app.pyと共通の永続化機能をここでも利用します
-STATE_FILE = Path("multitool_state.json")
-
-def read_app_state():
-    if STATE_FILE.exists():
-        with STATE_FILE.open("r", encoding="utf-8") as f:
-            try: return json.load(f)
-            except json.JSONDecodeError: return {}
-    return {}
-
-def write_app_state(data):
-    with STATE_FILE.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+from tools.state_store import read_key, write_key, delete_key
 
 
 def show_tool():
@@ -29,16 +16,15 @@ def show_tool():
     st.divider()
 
     # --- 現在保存されているキーの確認と削除 ---
-    app_state = read_app_state()
-    saved_key = app_state.get('google_maps_api_key', '')
+    # 共有キャッシュから読むので、再描画のたびにファイルを解析し直すことはありません
+    saved_key = read_key('google_maps_api_key', '')
 
     if saved_key:
         st.success("✅ Google Maps APIキーは既に設定されています。")
         col1, col2 = st.columns([3, 1])
         col1.text_input("設定済みのキー", value=saved_key, type="password", disabled=True)
         if col2.button("🗑️ キーを削除", use_container_width=True):
-            del app_state['google_maps_api_key']
-            write_app_state(app_state)
+            delete_key('google_maps_api_key')
             st.success("キーを削除しました。"); time.sleep(1); st.rerun()
         st.caption("新しいキーを設定したい場合は、一度削除してください。")
         return
@@ -121,8 +107,7 @@ def show_tool():
             submitted = st.form_submit_button("💾 このキーを保存する", type="primary", use_container_width=True)
             if submitted:
                 if maps_api_key_input.startswith("AIza"):
-                    app_s = read_app_state(); app_s['google_maps_api_key'] = maps_api_key_input
-                    write_app_state(app_s)
+                    write_key('google_maps_api_key', maps_api_key_input)
                     st.success("✅ Google Maps APIキーを保存しました！"); st.balloons(); time.sleep(2); st.rerun()
                 else:
                     st.error("❌ キーの形式が正しくないようです。もう一度確認してください。（通常「AIza...」から始まります）")
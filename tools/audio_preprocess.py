@@ -0,0 +1,238 @@
+# ===============================================================
+# ★★★ audio_preprocess.py ＜音声の下ごしらえ＞ ★★★
+# ===============================================================
+# マイクの録音やアップロードされた音声を、AIに渡す前に、話し声に十分な形へそろえます。
+#   1. 先頭のバイト列から、本当の形式(wav / webm / ogg / mp3 / m4a / flac …)を見分けます
+#      (拡張子やブラウザの申告は当てにせず、正しい mime_type を付けて送ります)
+#   2. モノラル・16kHz にまとめ、前後の無音を切り落とします
+#      - ffmpeg があれば、どの形式でも Opus(低ビットレート) に変換します
+#      - ffmpeg がなければ、WAVだけは手元(numpy)で変換し、それ以外はそのまま送ります
+#   3. 変換後の方が大きい場合や、変換に失敗した場合は、元のデータをそのまま使います
+# 大きな音声は normalize_file() で、一時ファイルから一時ファイルへ変換します (media_upload が使います)
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+
+try:
+    import numpy as np
+except ImportError:  # numpy がない環境では、WAVも変換せずに送ります
+    np = None
+
+TARGET_SAMPLE_RATE = 16000
+OPUS_BITRATE = "24k"
+# この音量(dBFS)より小さい部分を「無音」とみなします
+SILENCE_THRESHOLD_DB = -45
+# 前後に、この秒数だけは無音を残します (言葉の頭や終わりが切れないように)
+SILENCE_PADDING_SECONDS = 0.2
+FFMPEG_TIMEOUT_SECONDS = 300
+
+_MIME_TYPES = {
+    "wav": "audio/wav", "webm": "audio/webm", "ogg": "audio/ogg", "mp3": "audio/mpeg",
+    "m4a": "audio/mp4", "flac": "audio/flac", "aiff": "audio/aiff", "aac": "audio/aac",
+}
+
+
+def sniff_format(data):
+    """先頭のバイト列から、音声ファイルの形式名を返します。分からなければ None です。"""
+    head = bytes(data[:16])
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE": return "wav"
+    if head[:4] == b"\x1a\x45\xdf\xa3": return "webm"  # EBML (webm / matroska)
+    if head[:4] == b"OggS": return "ogg"
+    if head[:4] == b"fLaC": return "flac"
+    if head[4:8] == b"ftyp": return "m4a"
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"): return "aiff"
+    if head[:3] == b"ID3": return "mp3"
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xF6) == 0xF0: return "aac"  # ADTS
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0: return "mp3"  # MPEGフレーム
+    return None
+
+
+def mime_type_for(data, fallback_mime=None):
+    audio_format = sniff_format(data)
+    return _MIME_TYPES.get(audio_format) or fallback_mime or "application/octet-stream"
+
+
+# ---------------------------------------------------------------
+# ffmpeg による変換 (どの形式でも)
+# ---------------------------------------------------------------
+def _ffmpeg_command(ffmpeg, source, destination, trim_silence):
+    filters = []
+    if trim_silence:
+        trim = f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD_DB}dB:start_silence={SILENCE_PADDING_SECONDS}"
+        filters = [trim, "areverse", trim, "areverse"]
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-i", source, "-vn", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE)]
+    if filters: command += ["-af", ",".join(filters)]
+    return command + ["-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg", destination]
+
+
+def _ffmpeg_normalize(data, trim_silence):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None: return None
+    try:
+        result = subprocess.run(_ffmpeg_command(ffmpeg, "pipe:0", "pipe:1", trim_silence), input=bytes(data),
+                                capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return (result.stdout, "audio/ogg") if result.stdout else None
+
+
+def normalize_file(path, trim_silence=True):
+    """
+    音声ファイルを、ファイルからファイルへ変換します (大きな音声でも、メモリに丸ごと載せません)。
+    変換した一時ファイルのパスを返します (使い終わったら消してください)。ffmpeg がないか、変換に失敗したら None です。
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None: return None
+    with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
+        output_path = temp_file.name
+    try:
+        subprocess.run(_ffmpeg_command(ffmpeg, str(path), output_path, trim_silence),
+                       capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True)
+        if os.path.getsize(output_path) > 0: return output_path
+    except (OSError, subprocess.SubprocessError):
+        pass
+    os.remove(output_path)
+    return None
+
+
+# ---------------------------------------------------------------
+# numpy による変換 (WAVのみ)
+# ---------------------------------------------------------------
+def _read_wav(data):
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    if width == 1: samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2: samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 4: samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else: raise ValueError("対応していないビット深度です")
+    return samples.reshape(-1, channels).mean(axis=1), rate
+
+
+# 間引く前のローパスフィルタの長さです (長いほど、切れ味が良くなります)
+_LOWPASS_TAPS = 63
+
+
+def _lowpass(samples, cutoff_ratio):
+    """窓関数つきの sinc フィルタで、cutoff_ratio (元のサンプリング周波数に対する割合) より高い音を落とします。"""
+    n = np.arange(_LOWPASS_TAPS) - (_LOWPASS_TAPS - 1) / 2
+    taps = 2 * cutoff_ratio * np.sinc(2 * cutoff_ratio * n) * np.hamming(_LOWPASS_TAPS)
+    return np.convolve(samples, (taps / taps.sum()).astype(np.float32), mode="same")
+
+
+def _resample(samples, rate, target_rate):
+    if rate == target_rate or len(samples) == 0: return samples
+    # 間引くときは、先に新しいナイキスト周波数(target_rate / 2)より高い音を落とします (折り返しノイズを防ぎます)
+    if target_rate < rate: samples = _lowpass(samples, 0.45 * target_rate / rate)
+    duration = len(samples) / rate
+    target_times = np.arange(int(duration * target_rate)) / target_rate
+    return np.interp(target_times, np.arange(len(samples)) / rate, samples).astype(np.float32)
+
+
+def _trim_silence(samples, rate):
+    """20ミリ秒ごとの音量で、前後の無音を切り落とします。"""
+    frame = max(int(rate * 0.02), 1)
+    usable = len(samples) // frame * frame
+    if usable == 0: return samples
+    rms = np.sqrt(np.mean(samples[:usable].reshape(-1, frame) ** 2, axis=1) + 1e-12)
+    loud = np.nonzero(20 * np.log10(rms) > SILENCE_THRESHOLD_DB)[0]
+    if len(loud) == 0: return samples[:0]
+    padding = int(SILENCE_PADDING_SECONDS * rate)
+    return samples[max(loud[0] * frame - padding, 0):min((loud[-1] + 1) * frame + padding, len(samples))]
+
+
+def _numpy_normalize_wav(data, trim_silence):
+    if np is None: return None
+    try:
+        samples, rate = _read_wav(data)
+    except (wave.Error, ValueError, EOFError):
+        return None
+    samples = _resample(samples, rate, TARGET_SAMPLE_RATE)
+    if trim_silence: samples = _trim_silence(samples, TARGET_SAMPLE_RATE)
+    if len(samples) == 0: return None  # すべて無音なら、判断はAIに任せて元のまま送ります
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1); wav.setsampwidth(2); wav.setframerate(TARGET_SAMPLE_RATE)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    return output.getvalue(), "audio/wav"
+
+
+def normalize_audio(data, fallback_mime=None, trim_silence=True):
+    """
+    音声を下ごしらえし、(バイト列, mime_type, 統計情報の辞書) を返します。
+    統計情報: original_bytes / processed_bytes / format (見分けた元の形式) / method (ffmpeg・numpy・passthrough)
+    """
+    data = bytes(data)
+    audio_format = sniff_format(data)
+    converted, method = _ffmpeg_normalize(data, trim_silence), "ffmpeg"
+    if converted is None and audio_format == "wav":
+        converted, method = _numpy_normalize_wav(data, trim_silence), "numpy"
+    if converted is None or len(converted[0]) >= len(data):
+        converted, method = (data, mime_type_for(data, fallback_mime)), "passthrough"
+    processed, mime_type = converted
+    stats = {"original_bytes": len(data), "processed_bytes": len(processed), "format": audio_format, "method": method}
+    return processed, mime_type, stats
+
+
+# ---------------------------------------------------------------
+# 長い音声の切り出し (ファイルから、指定した時間の範囲だけを取り出します)
+# ---------------------------------------------------------------
+def probe_duration(path):
+    """音声ファイルの長さ(秒)を返します。分からなければ None です。"""
+    try:
+        with wave.open(str(path), "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError, OSError):
+        pass
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None: return None
+    try:
+        result = subprocess.run([ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(path)],
+                                capture_output=True, timeout=60, check=True)
+        return float(result.stdout.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+def _wav_slice(path, start_seconds, end_seconds):
+    with wave.open(str(path), "rb") as wav:
+        params = wav.getparams()
+        wav.setpos(min(int(start_seconds * params.framerate), params.nframes))
+        frames = wav.readframes(int((end_seconds - start_seconds) * params.framerate))
+    output = io.BytesIO()
+    with wave.open(output, "wb") as sliced:
+        sliced.setnchannels(params.nchannels); sliced.setsampwidth(params.sampwidth); sliced.setframerate(params.framerate)
+        sliced.writeframes(frames)
+    return output.getvalue()
+
+
+def extract_segment(path, start_seconds, end_seconds):
+    """
+    ファイルの start〜end 秒を、モノラル・16kHz にそろえて (バイト列, mime_type) で返します。
+    取り出せない形式なら None です (ffmpeg がなく、WAVでもない場合)。
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-ss", f"{start_seconds:.3f}", "-t", f"{end_seconds - start_seconds:.3f}",
+                   "-i", str(path), "-vn", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE),
+                   "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg", "pipe:1"]
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS, check=True)
+            if result.stdout: return result.stdout, "audio/ogg"
+        except (OSError, subprocess.SubprocessError):
+            pass
+    try:
+        sliced = _wav_slice(path, start_seconds, end_seconds)
+    except (wave.Error, EOFError, OSError):
+        return None
+    normalized = _numpy_normalize_wav(sliced, trim_silence=False)
+    return normalized if normalized else (sliced, "audio/wav")
+
+
+def to_audio_part(data, fallback_mime=None, trim_silence=True):
+    """generate_content にそのまま渡せる形にします。(音声パート, 統計情報) を返します。"""
+    processed, mime_type, stats = normalize_audio(data, fallback_mime, trim_silence)
+    return {"mime_type": mime_type, "data": processed}, stats
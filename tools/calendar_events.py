@@ -0,0 +1,135 @@
+# ===============================================================
+# ★★★ calendar_events.py ＜複数の予定・くり返し予定の展開とICSファイル＞ ★★★
+# ===============================================================
+# AIが1回の呼び出しで返した予定のリストを、この場で
+# - くり返し(毎日・毎週・毎月)を、1回ずつの予定に展開し
+# - まとめて1つの .ics ファイル(カレンダーアプリで一括登録できる形式)にします
+import uuid
+from datetime import datetime, timedelta
+
+import pytz
+
+JST = pytz.timezone('Asia/Tokyo')
+FREQUENCIES = ("NONE", "DAILY", "WEEKLY", "MONTHLY")
+# 回数も終了日も言われなかったくり返しは、この回数だけ展開します
+DEFAULT_OCCURRENCES = 4
+MAX_OCCURRENCES = 52
+
+
+def parse_jst(value):
+    """ISO形式の日時を、タイムゾーンなしの日本時間にします。「+09:00」や「Z」付きの日時も、日本時間に直して受け付けます。"""
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None: parsed = parsed.astimezone(JST).replace(tzinfo=None)
+    return parsed
+
+
+def _recurrence(event):
+    recurrence = event.get("recurrence") or {}
+    frequency = str(recurrence.get("frequency") or "NONE").upper()
+    return recurrence, (frequency if frequency in FREQUENCIES else "NONE")
+
+
+def _shift(start, frequency, interval, index):
+    """start から index 回目のくり返しの日時を返します。その月にない日付(31日など)は None です。"""
+    if frequency == "DAILY": return start + timedelta(days=interval * index)
+    if frequency == "WEEKLY": return start + timedelta(weeks=interval * index)
+    months = start.month - 1 + interval * index
+    try: return start.replace(year=start.year + months // 12, month=months % 12 + 1)
+    except ValueError: return None
+
+
+def expand_occurrences(event):
+    """1つの予定を、くり返しを展開した予定のリストにします。日時が読めない場合は空のリストです。"""
+    try:
+        start = parse_jst(event['start_time'])
+        end = parse_jst(event['end_time']) if event.get('end_time') else start + timedelta(hours=1)
+    except (KeyError, TypeError, ValueError):
+        return []
+    if end <= start: end = start + timedelta(hours=1)
+    recurrence, frequency = _recurrence(event)
+    if frequency == "NONE": return [dict(event, start_time=start.isoformat(), end_time=end.isoformat())]
+
+    try: interval = max(int(recurrence.get("interval") or 1), 1)
+    except (TypeError, ValueError): interval = 1
+    try: count = min(int(recurrence.get("count") or 0), MAX_OCCURRENCES)
+    except (TypeError, ValueError): count = 0
+    try: until = parse_jst(recurrence["until"]) if recurrence.get("until") else None
+    except ValueError: until = None
+    if until is not None and len(recurrence["until"]) <= 10: until += timedelta(days=1)  # 日付だけなら、その日の終わりまで
+    if not count and until is None: count = DEFAULT_OCCURRENCES
+
+    occurrences, index = [], 0
+    while len(occurrences) < (count or MAX_OCCURRENCES) and index < MAX_OCCURRENCES * 2:
+        occurrence_start = _shift(start, frequency, interval, index)
+        index += 1
+        if occurrence_start is None: continue
+        if until is not None and occurrence_start >= until: break
+        occurrences.append(dict(event, start_time=occurrence_start.isoformat(), end_time=(occurrence_start + (end - start)).isoformat()))
+    return occurrences
+
+
+def describe_recurrence(event):
+    """「毎週・4回」のような短い説明を返します。くり返さない予定は空文字です。"""
+    recurrence, frequency = _recurrence(event)
+    if frequency == "NONE": return ""
+    label = {"DAILY": "日", "WEEKLY": "週", "MONTHLY": "月"}[frequency]
+    interval = recurrence.get("interval") or 1
+    text = f"毎{label}" if str(interval) == "1" else f"{interval}{label}ごと"
+    if recurrence.get("until"): text += f"・{recurrence['until'][:10]}まで"
+    else: text += f"・{len(expand_occurrences(event))}回"
+    return text
+
+
+def google_recur_rule(event):
+    """
+    GoogleカレンダーのURLに付ける RRULE です。くり返さない予定は None です。
+    回数は、.ics と同じく expand_occurrences で展開した回数にします (回数と終了日の両方がある場合も、先に来た方で終わります)。
+    """
+    recurrence, frequency = _recurrence(event)
+    if frequency == "NONE": return None
+    return f"RRULE:FREQ={frequency};INTERVAL={recurrence.get('interval') or 1};COUNT={len(expand_occurrences(event))}"
+
+
+# ---------------------------------------------------------------
+# ICSファイル
+# ---------------------------------------------------------------
+def _escape(text):
+    return str(text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def _fold(line):
+    """ICSの1行は75バイトまでなので、超える分は折り返します (マルチバイト文字の途中では切りません)。"""
+    chunks, current = [], ""
+    for char in line:
+        limit = 75 if not chunks else 74
+        if len((current + char).encode("utf-8")) > limit:
+            chunks.append(current); current = char
+        else:
+            current += char
+    chunks.append(current)
+    return "\r\n ".join(chunks)
+
+
+def utc_stamp(value):
+    """日時(日本時間、またはタイムゾーン付き)を、ICS や Googleカレンダーの URL で使う UTC の形(20240515T010000Z)にします。"""
+    return JST.localize(parse_jst(value)).astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def build_ics(events):
+    """予定(くり返しは展開済みのもの)のリストを、1つの .ics ファイルの文字列にします。"""
+    stamp = datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//multitool//calendar_tool//JA", "CALSCALE:GREGORIAN", "METHOD:PUBLISH"]
+    for event in events:
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{uuid.uuid4()}@multitool",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{utc_stamp(event['start_time'])}",
+            f"DTEND:{utc_stamp(event['end_time'])}",
+            f"SUMMARY:{_escape(event.get('title'))}",
+        ]
+        if event.get('location'): lines.append(f"LOCATION:{_escape(event['location'])}")
+        if event.get('details'): lines.append(f"DESCRIPTION:{_escape(event['details'])}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
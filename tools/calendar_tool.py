@@ -2,26 +2,64 @@
 # ★★★ calendar_tool.py ＜最終完成版＞ ★★★
 # ===============================================================
 import streamlit as st
-import google.generativeai as genai
-import json
 from datetime import datetime, timedelta, timezone
 import urllib.parse
 import pytz
 from streamlit_mic_recorder import mic_recorder
 import time
+import re
+from tools import structured_output
+from tools import jp_datetime_parser
+from tools import calendar_events
+from tools import media_upload, transcription
 
 # ===============================================================
 # 補助関数 (変更なし)
 # ===============================================================
+# 予定を組み立てるAIへの指示。毎回同じ文面にしておくことで、モデルを使い回せます
+# (現在の日時は、指示ではなく、ユーザーのテキストの先頭に付けて渡します)
+SCHEDULE_SYSTEM_PROMPT = """
+あなたは予定を解釈する優秀なアシスタントです。ユーザーのテキストに含まれる「すべての予定」を、events のリストとして抽出してください。
+- 1つの発言に、複数の予定(例: 「月曜10時に会議、水曜15時に歯医者」)が含まれることがあります。1件ずつ別の予定にしてください。
+- 各予定について「title」「start_time」「end_time」「location」「details」「recurrence」を記述してください。
+- 現在の日時は、ユーザーのテキストの先頭に「現在の日時:」として記載されています (JST)。これを基準に日時を解釈してください。
+- 日時は `YYYY-MM-DDTHH:MM:SS` 形式で出力してください。
+- `end_time` が不明な場合は、`start_time` の1時間後を自動設定してください。
+- 「毎週」「毎日」「毎月」「隔週」のようなくり返しは、1回目の日時を start_time / end_time にし、recurrence に記述してください。
+  - frequency: "NONE" / "DAILY" / "WEEKLY" / "MONTHLY" のいずれか (くり返さない予定は "NONE")
+  - interval: 何日・何週・何か月ごとか (隔週なら 2。通常は 1)
+  - count: 回数が言われた場合だけ、その回数 (言われなければ 0)
+  - until: 終わりの日が言われた場合だけ、`YYYY-MM-DD` (言われなければ空文字)
+- 必ず以下のJSON形式のみで回答してください。他の言葉は一切含めないでください。
+```json
+{ "events": [ { "title": "（件名）", "start_time": "YYYY-MM-DDTHH:MM:SS", "end_time": "YYYY-MM-DDTHH:MM:SS", "location": "（場所）", "details": "（詳細）",
+  "recurrence": { "frequency": "NONE", "interval": 1, "count": 0, "until": "" } } ] }
+```
+"""
+RECURRENCE_SCHEMA = structured_output.object_schema(
+    {"frequency": {"type": "STRING", "enum": list(calendar_events.FREQUENCIES)}, "interval": {"type": "INTEGER"},
+     "count": {"type": "INTEGER"}, "until": {"type": "STRING"}},
+    required=["frequency"],
+)
+EVENT_SCHEMA = structured_output.object_schema(
+    {**{key: {"type": "STRING"} for key in ("title", "start_time", "end_time", "location", "details")}, "recurrence": RECURRENCE_SCHEMA},
+    required=["title", "start_time", "end_time"],
+)
+SCHEDULE_SCHEMA = structured_output.object_schema({"events": {"type": "ARRAY", "items": EVENT_SCHEMA}})
+SCHEDULE_PROMPT_VERSION = "2"
+
+# 「3時間後」「今から」のように、今の時刻で答えが変わる言い方です。含まない場合は、日付だけをキャッシュのキーに使います
+_RELATIVE_TIME_PATTERN = re.compile(r"(分|時間)(後|前)|今から|いまから|さっき|このあと|この後")
+
+def schedule_cache_key(prompt_text, now_jst):
+    """同じ日の同じ依頼なら、同じキャッシュを使えるようにします。"""
+    if _RELATIVE_TIME_PATTERN.search(prompt_text): return f"現在の日時: {now_jst.strftime('%Y-%m-%dT%H:%M')}\n\n{prompt_text}"
+    return f"今日の日付: {now_jst.strftime('%Y-%m-%d')}\n\n{prompt_text}"
+
 def create_google_calendar_url(details):
-    # ... (この中身は、完全に変更なし) ...
     try:
-        jst = pytz.timezone('Asia/Tokyo')
-        start_time_jst = jst.localize(datetime.fromisoformat(details['start_time']))
-        end_time_jst = jst.localize(datetime.fromisoformat(details['end_time']))
-        start_time_utc = start_time_jst.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
-        end_time_utc = end_time_jst.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
-        dates = f"{start_time_utc}/{end_time_utc}"
+        # 「+09:00」などのタイムゾーン付きの日時も、日本時間に直してから UTC にします (.ics と同じ変換です)
+        dates = f"{calendar_events.utc_stamp(details['start_time'])}/{calendar_events.utc_stamp(details['end_time'])}"
     except (ValueError, KeyError):
         dates = ""
     base_url = "https://www.google.com/calendar/render?action=TEMPLATE"
@@ -31,6 +69,8 @@ def create_google_calendar_url(details):
         "location": details.get('location', ''),
         "details": details.get('details', '')
     }
+    recur_rule = calendar_events.google_recur_rule(details)
+    if recur_rule: params["recur"] = recur_rule  # くり返しの予定は、Googleカレンダー側でもくり返しとして登録します
     return f"{base_url}&{urllib.parse.urlencode(params, quote_via=urllib.parse.quote)}"
 
 # ===============================================================
@@ -47,59 +87,72 @@ def show_tool(gemini_api_key):
     if "cal_usage_count" not in st.session_state:
         st.session_state.cal_usage_count = 0
 
-    # --- AI処理関数 (変更なし) ---
+    # --- AI処理関数 (予定を組み立てられた時だけ True を返します) ---
     def process_input(user_input):
-        # ... (この中身は、完全に変更なし) ...
         with st.chat_message("assistant"):
             if not gemini_api_key:
                 st.error("サイドバーでGemini APIキーを設定してください。")
                 return
             try:
-                genai.configure(api_key=gemini_api_key)
-                model = genai.GenerativeModel('gemini-1.5-flash-latest')
                 with st.spinner("（あなたの、言葉を、解読しています...）"):
-                    if isinstance(user_input, bytes):
-                        audio_part = {"mime_type": "audio/webm", "data": user_input}
-                        transcription_prompt = "この日本語の音声を、できる限り正確に、文字に書き起こしてください。書き起こした日本語テキストのみを回答してください。"
-                        transcription_response = model.generate_content([transcription_prompt, audio_part])
-                        prompt_text = transcription_response.text.strip()
+                    if isinstance(user_input, str):
+                        prompt_text = user_input
+                    else:
+                        # マイクの録音もアップロードされたファイルも、中身から形式を見分けて、正しい mime_type で送ります
+                        if isinstance(user_input, bytes):
+                            prompt_text = transcription.transcribe(gemini_api_key, user_input, "audio/webm")
+                        else:
+                            # アップロードされたファイルは丸ごとコピーせず、一時ファイルに書き出してから送ります
+                            with media_upload.spool(user_input, user_input.type) as spooled:
+                                prompt_text = transcription.transcribe_spooled(gemini_api_key, spooled)
                         if not prompt_text:
                             st.warning("音声を認識できませんでした。もう一度お試しください。")
                             return
-                    else:
-                        prompt_text = user_input
                 st.session_state.cal_messages.append({"role": "user", "content": prompt_text})
                 with st.spinner("AIが予定を組み立てています..."):
                     jst = pytz.timezone('Asia/Tokyo')
-                    current_time_jst = datetime.now(jst).isoformat()
-                    system_prompt = f"""
-                    あなたは予定を解釈する優秀なアシスタントです。ユーザーのテキストから「title」「start_time」「end_time」「location」「details」を抽出してください。
-                    - 現在の日時は `{current_time_jst}` (JST)です。これを基準に日時を解釈してください。
-                    - 日時は `YYYY-MM-DDTHH:MM:SS` 形式で出力してください。
-                    - `end_time` が不明な場合は、`start_time` の1時間後を自動設定してください。
-                    - 必ず以下のJSON形式のみで回答してください。他の言葉は一切含めないでください。
-                    ```json
-                    {{ "title": "（件名）", "start_time": "YYYY-MM-DDTHH:M:SS", "end_time": "YYYY-MM-DDTHH:MM:SS", "location": "（場所）", "details": "（詳細）" }}
-                    ```
-                    """
-                    schedule_model = genai.GenerativeModel('gemini-1.5-flash-latest', system_instruction=system_prompt)
-                    response = schedule_model.generate_content(prompt_text)
-                    json_text = response.text.strip().lstrip("```json").rstrip("```").strip()
-                    schedule_details = json.loads(json_text)
-                    calendar_url = create_google_calendar_url(schedule_details)
-                    display_start_time = "未設定"
-                    if schedule_details.get('start_time'):
-                        try: display_start_time = datetime.fromisoformat(schedule_details['start_time']).strftime('%Y年%m月%d日 %H:%M')
-                        except: display_start_time = "AIが日付の解析に失敗"
-                    ai_response = f"""以下の内容で承りました。よろしければリンクをクリックしてカレンダーに登録してください。\n\n- **件名:** {schedule_details.get('title', '未設定')}\n- **日時:** {display_start_time}\n- **場所:** {schedule_details.get('location', '未設定')}\n- **詳細:** {schedule_details.get('details', '未設定')}\n\n[📅 Googleカレンダーにこの予定を追加する]({calendar_url})"""
-                    st.session_state.cal_messages.append({"role": "assistant", "content": ai_response})
+                    now_jst = datetime.now(jst)
+                    # よくある言い方は、AIを呼ばずに手元で読み解きます (迷う場合だけ None が返り、AIに任せます)
+                    local_event = jp_datetime_parser.parse_schedule(prompt_text, now_jst)
+                    if local_event is not None:
+                        events = [local_event]
+                    else:
+                        # 1回の呼び出しで、発言に含まれるすべての予定(くり返しを含む)を受け取ります
+                        events = structured_output.generate_json(
+                            gemini_api_key, f"現在の日時: {now_jst.isoformat(timespec='minutes')}\n\n{prompt_text}",
+                            schema=SCHEDULE_SCHEMA, system_instruction=SCHEDULE_SYSTEM_PROMPT,
+                            cache_namespace="calendar", prompt_version=SCHEDULE_PROMPT_VERSION,
+                            cache_key_contents=schedule_cache_key(prompt_text, now_jst), cache_ttl_seconds=24 * 60 * 60).get("events", [])
+                    occurrences = [occurrence for event in events for occurrence in calendar_events.expand_occurrences(event)]
+                    if not occurrences:
+                        st.session_state.cal_messages.append({"role": "assistant", "content": "申し訳ありません、予定の日時を読み取れませんでした。もう一度お試しください。"})
+                        return
+                    lines = []
+                    for event in events:
+                        display_start_time = "未設定"
+                        if event.get('start_time'):
+                            try: display_start_time = calendar_events.parse_jst(event['start_time']).strftime('%Y年%m月%d日 %H:%M')
+                            except: display_start_time = "AIが日付の解析に失敗"
+                        recurrence_text = calendar_events.describe_recurrence(event)
+                        if recurrence_text: display_start_time += f" （{recurrence_text}）"
+                        lines.append(f"- **{event.get('title') or '未設定'}** ／ {display_start_time}"
+                                     + (f" ／ 📍{event['location']}" if event.get('location') else "")
+                                     + (f"\n  - {event['details']}" if event.get('details') else "")
+                                     + (f"\n  - ⚠️ {event['warning']}" if event.get('warning') else "")
+                                     + f"\n  - [📅 Googleカレンダーにこの予定を追加する]({create_google_calendar_url(event)})")
+                    ai_response = f"""以下の {len(events)} 件の予定で承りました。リンクから1件ずつ、または .ics ファイルでまとめて（計 {len(occurrences)} 回分）カレンダーに登録できます。\n\n""" + "\n".join(lines)
+                    st.session_state.cal_messages.append({"role": "assistant", "content": ai_response, "ics": calendar_events.build_ics(occurrences)})
+                    return True
             except Exception as e:
                 st.session_state.cal_messages.append({"role": "assistant", "content": f"申し訳ありません、エラーが発生しました。({e})"})
 
     # --- UIの表示 ---
-    for message in st.session_state.cal_messages:
+    for message_index, message in enumerate(st.session_state.cal_messages):
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("ics"):
+                st.download_button("🗓️ まとめて登録する (.ics)", data=message["ics"].encode("utf-8"), file_name="schedule.ics",
+                                   mime="text/calendar", key=f"cal_ics_{message_index}")
 
     # --- 運命の分岐 ---
     usage_limit = 1 # ★★★ ここで、いつでもリミットを変更できます ★★★
@@ -159,10 +212,10 @@ def show_tool(gemini_api_key):
         user_input_data = audio_info['bytes']
     elif uploaded_file and uploaded_file.name != st.session_state.cal_last_file_name:
         st.session_state.cal_last_file_name = uploaded_file.name
-        user_input_data = uploaded_file.getvalue()
+        user_input_data = uploaded_file
 
     if user_input_data:
-        # どんな入力方法でも、必ず回数をカウント！
-        st.session_state.cal_usage_count += 1
-        process_input(user_input_data)
+        # どんな入力方法でも、予定を組み立てられた時だけ回数をカウント！ (エラーでは消費しません)
+        if process_input(user_input_data):
+            st.session_state.cal_usage_count += 1
         st.rerun()
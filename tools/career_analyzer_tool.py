@@ -2,8 +2,9 @@
 # ★★★ career_analyzer_tool.py ＜プロンプト最終進化版＞ ★★★
 # ===================================================================
 import streamlit as st
-import google.generativeai as genai
-import json
+from tools import prompt_registry
+from tools import structured_output
+from tools.structured_output import StructuredOutputError
 
 # ★★★ ここが最重要！ちゃろさんのアイデアを全て注ぎ込んだ、究極のプロンプト ★★★
 ANALYSIS_PROMPT = """
@@ -32,20 +33,35 @@ ANALYSIS_PROMPT = """
 }
 """
 
-# --- AI分析を行う関数 (変更なし) ---
+# 指示書の版。ANALYSIS_PROMPT を変えたら上げてください (古い応答キャッシュを使わなくなります)
+ANALYSIS_PROMPT_VERSION = "1"
+ANALYSIS_PROMPT_NAME = prompt_registry.register("career_analyzer.analysis", ANALYSIS_PROMPT, ANALYSIS_PROMPT_VERSION)
+
+# 応答スキーマ。箇条書きの項目は、画面側で1行ずつ表示するため、文字列のリストで返してもらいます
+ANALYSIS_SCHEMA = structured_output.object_schema({
+    "summary": {"type": "STRING"},
+    "what_you_do": structured_output.string_array(),
+    "salary": {"type": "STRING"},
+    "required_skills": structured_output.string_array(),
+    "preferred_skills": structured_output.string_array(),
+    "attraction": structured_output.string_array(),
+    "future_prospects": structured_output.string_array(),
+    "nearest_station": {"type": "STRING"},
+})
+
+# --- AI分析を行う関数 ---
 def analyze_job_posting_text(job_text, gemini_key):
     try:
         with st.spinner("AIが、あなたの未来を分析しています..."):
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-1.5-flash-latest')
-            full_prompt = [ANALYSIS_PROMPT, f"## 分析対象の求人情報テキスト:\n{job_text}"]
-            response = model.generate_content(full_prompt)
-            cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-            analysis_result = json.loads(cleaned_response)
+            full_prompt = [f"## 分析対象の求人情報テキスト:\n{job_text}"]
+            # 同じ求人情報なら、保存済みの分析結果をすぐに返します
+            analysis_result = structured_output.generate_json(
+                gemini_key, full_prompt, schema=ANALYSIS_SCHEMA, prompt_name=ANALYSIS_PROMPT_NAME,
+                cache_namespace="career_analyzer", prompt_version=ANALYSIS_PROMPT_VERSION)
         return analysis_result
-    except json.JSONDecodeError:
+    except StructuredOutputError as e:
         st.error("AIからの応答を解析できませんでした。テキストが長すぎるか、形式が複雑な可能性があります。")
-        st.code(response.text)
+        st.code(e.raw_text)
         return None
     except Exception as e:
         st.error(f"分析中に予期せぬエラーが発生しました: {e}"); return None
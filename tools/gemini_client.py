@@ -0,0 +1,226 @@
+# ===============================================================
+# ★★★ gemini_client.py ＜全ツール共通・Geminiの窓口＞ ★★★
+# ===============================================================
+# すべてのツールは、この generate() を通してGeminiを呼び出します。
+# - モデルは (APIキー, モデル名, system_instruction) ごとに1回だけ作り、再実行やセッションをまたいで使い回します
+# - genai.configure のグローバル設定は使わず、APIキーごとの通信クライアントをモデルに直接持たせます
+#   (別々のキーを使う複数のユーザーが、同時に設定を上書きし合う事故を防ぎます)
+# - warm_up() で、通信路の準備を先に済ませておけます
+# - 一時的なエラー(429/503/タイムアウト)は、ゆらぎ付きの指数バックオフで自動的にやり直します
+# - APIキーごとのトークンバケットで、多数のセッションからの集中した呼び出しをならします
+# - prompt_name で登録済みの大きな指示書を指定すると、system_instruction として送り、使ったトークン数を記録します (prompt_registry)
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions
+
+from tools import prompt_registry
+
+DEFAULT_MODEL = 'gemini-1.5-flash-latest'
+
+# やり直しの設定 (待ち時間は 0〜min(上限, 基準×2^回数) 秒のあいだでランダムに決めます)
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+TRANSIENT_ERRORS = (
+    exceptions.ResourceExhausted,    # 429
+    exceptions.TooManyRequests,      # 429 (REST経由)
+    exceptions.ServiceUnavailable,   # 503
+    exceptions.DeadlineExceeded,     # タイムアウト
+    exceptions.InternalServerError,  # 500
+)
+
+# APIキーごとの呼び出しペース (無料枠の1分あたりの上限に合わせています)
+REQUESTS_PER_MINUTE = 15
+BURST_SIZE = 5
+
+# これ以上のモデルを覚えている場合は、最も長く使われていないものから手放します
+MAX_CACHED_MODELS = 64
+
+_lock = threading.Lock()
+_models = OrderedDict()   # (api_key, model_name, system_instruction) -> GenerativeModel
+_clients = {}             # api_key -> GenerativeServiceClient
+_warmed_keys = set()
+
+
+def _get_service_client(api_key):
+    with _lock:
+        service_client = _clients.get(api_key)
+        if service_client is None:
+            service_client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+            _clients[api_key] = service_client
+        return service_client
+
+
+def get_model(api_key, model_name=DEFAULT_MODEL, system_instruction=None):
+    """キャッシュ済みのモデルを返します。なければ作って覚えておきます。"""
+    cache_key = (api_key, model_name, system_instruction)
+    with _lock:
+        model = _models.get(cache_key)
+        if model is not None:
+            _models.move_to_end(cache_key)
+            return model
+    service_client = _get_service_client(api_key)
+    model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+    model._client = service_client  # genai.configure を経由せず、このキー専用のクライアントを使わせます
+    with _lock:
+        _models[cache_key] = model
+        _models.move_to_end(cache_key)
+        while len(_models) > MAX_CACHED_MODELS:
+            _models.popitem(last=False)
+    return model
+
+
+# ---------------------------------------------------------------
+# APIキーごとのトークンバケット
+# ---------------------------------------------------------------
+class TokenBucket:
+    """rate_per_second の速さでトークンがたまり、最大 capacity 個まで持てるバケツです。"""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取ります。なければ、たまるまで待ちます。待った秒数を返します。"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+
+_buckets = {}
+
+
+def _get_bucket(api_key):
+    with _lock:
+        bucket = _buckets.get(api_key)
+        if bucket is None:
+            bucket = TokenBucket(REQUESTS_PER_MINUTE / 60.0, BURST_SIZE)
+            _buckets[api_key] = bucket
+        return bucket
+
+
+# ---------------------------------------------------------------
+# やり直し付きの呼び出し
+# ---------------------------------------------------------------
+_RETRY_DELAY_PATTERNS = (
+    re.compile(r"retry in ([0-9.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*([0-9]+)", re.IGNORECASE),
+)
+
+
+def retry_after_seconds(error):
+    """エラーに「何秒後に再試行して」という指示があれば、その秒数を返します。"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("Retry-After"):
+        try: return float(headers["Retry-After"])
+        except ValueError: pass
+    for detail in getattr(error, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    for pattern in _RETRY_DELAY_PATTERNS:
+        match = pattern.search(str(error))
+        if match: return float(match.group(1))
+    return None
+
+
+def backoff_seconds(attempt):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def call_with_retry(api_key, request):
+    """
+    request() を呼びます。呼ぶ前にAPIキーのトークンバケットで順番を待ち、
+    一時的なエラーなら、指示された秒数かバックオフの秒数の長い方だけ待って、やり直します。
+    """
+    bucket = _get_bucket(api_key)
+    for attempt in range(MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            return request()
+        except TRANSIENT_ERRORS as e:
+            if attempt >= MAX_RETRIES: raise
+            time.sleep(max(retry_after_seconds(e) or 0.0, backoff_seconds(attempt)))
+
+
+def _model_for(api_key, model_name, system_instruction, prompt_name):
+    """prompt_name があれば、その指示書を system_instruction として持ったモデルを返します。"""
+    if prompt_name is None: return get_model(api_key, model_name, system_instruction)
+    return get_model(api_key, model_name, prompt_registry.get(prompt_name)["text"])
+
+
+def generate(api_key, contents, model_name=DEFAULT_MODEL, system_instruction=None, generation_config=None, prompt_name=None):
+    """generate_content を(やり直し付きで)呼び、応答のテキストを返します。"""
+    model = _model_for(api_key, model_name, system_instruction, prompt_name)
+    response = call_with_retry(api_key, lambda: model.generate_content(contents, generation_config=generation_config))
+    if prompt_name is not None: prompt_registry.record_call(prompt_name, getattr(response, "usage_metadata", None))
+    return response.text
+
+
+def stream(api_key, contents, model_name=DEFAULT_MODEL, system_instruction=None, generation_config=None, prompt_name=None):
+    """
+    stream=True で呼び、届いた順にテキストの断片を返すジェネレーターです。
+    最初の断片が届くまでに起きた一時的なエラーは、generate() と同じようにやり直します。
+    """
+    model = _model_for(api_key, model_name, system_instruction, prompt_name)
+
+    def open_stream():
+        chunks = iter(model.generate_content(contents, generation_config=generation_config, stream=True))
+        return next(chunks, None), chunks
+
+    first_chunk, chunks = call_with_retry(api_key, open_stream)
+    if first_chunk is None: return
+    usage_metadata = None
+    for chunk in _prepend(first_chunk, chunks):
+        usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata  # 使ったトークン数は、最後の断片に付いてきます
+        try: text = chunk.text
+        except ValueError: continue  # テキストを含まない断片 (安全性フィルタの情報など)
+        if text: yield text
+    if prompt_name is not None: prompt_registry.record_call(prompt_name, usage_metadata)
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def warm_up(api_key):
+    """
+    APIキーが分かった時点で呼んでおくと、裏側で通信クライアントとモデルを作り、接続を確立しておきます。
+    最初のリクエストで、接続の準備を待たずに済みます。何度呼んでも、キーごとに1回しか動きません。
+    """
+    if not api_key: return
+    with _lock:
+        if api_key in _warmed_keys: return
+        _warmed_keys.add(api_key)
+    threading.Thread(target=_warm_up, args=(api_key,), daemon=True).start()
+
+
+def _warm_up(api_key):
+    try:
+        get_model(api_key)
+        channel = getattr(_get_service_client(api_key).transport, "grpc_channel", None)
+        if channel is not None:
+            import grpc
+            grpc.channel_ready_future(channel).result(timeout=10)
+    except Exception:
+        pass  # 準備に失敗しても、最初のリクエストで改めて接続するだけです
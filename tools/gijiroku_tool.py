@@ -2,9 +2,10 @@
 # ★★★ gijiroku_tool.py ＜デイリーパスワード版＞ ★★★
 # ===============================================================
 import streamlit as st
-import google.generativeai as genai
 import time
+import uuid
 from datetime import datetime, timedelta, timezone # ★ 日付を扱う達人を召喚
+from tools import long_transcription, media_upload, transcription_jobs
 
 # ===============================================================
 # 専門家のメインの仕事 (新しいシステムに換装)
@@ -18,6 +19,10 @@ def show_tool(gemini_api_key):
         st.session_state[f"{prefix}transcript_text"] = None
     if f"{prefix}usage_count" not in st.session_state:
         st.session_state[f"{prefix}usage_count"] = 0
+    if f"{prefix}handled_file_id" not in st.session_state:
+        st.session_state[f"{prefix}handled_file_id"] = None
+    if f"{prefix}session_id" not in st.session_state:
+        st.session_state[f"{prefix}session_id"] = uuid.uuid4().hex
 
     # ★★★ リミット回数を、ここで定義 ★★★
     usage_limit = 1 # ←←← ちゃろさんが、いつでも、ここの数字を変えられます！
@@ -61,37 +66,68 @@ def show_tool(gemini_api_key):
         uploaded_file = st.file_uploader("議事録を作成したい音声ファイルをアップロードしてください:", type=['wav', 'mp3', 'm4a', 'flac'], key=f"{prefix}uploader")
         
         # ★★★ 処理の開始を、ボタンクリックから、ファイルのアップロード完了時に変更 ★★★
+        # 再実行(ダウンロードボタンなど)のたびに文字起こしが始まらないよう、アップロードごとに1回だけ処理します
         if uploaded_file is not None:
-            if not gemini_api_key:
+            file_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+            if file_id == st.session_state[f"{prefix}handled_file_id"]:
+                pass  # このアップロードは処理済みです。保存済みの結果を、下に表示するだけです
+            elif not gemini_api_key:
                 st.error("サイドバーでGemini APIキーを設定してください。")
             else:
                 with st.spinner("AIが音声を文字に変換しています。長い音声の場合、数分かかることがあります..."):
                     try:
-                        genai.configure(api_key=gemini_api_key)
-                        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+                        # 同じ音声ファイルなら、以前の文字起こし結果をすぐに使います (共通の文字起こし窓口)
+                        # 長い会議は、区間に分けて並列に文字起こしし、進み具合をバーで表示します
+                        # 終わった区間の文字起こしは、その都度、保存しながら下に表示します (中断しても、続きから再開します)
+                        progress_bar, partial_area = st.empty(), st.empty()
+                        shown_partial = {"text": None}
+                        def show_progress(done, total, partial_text):
+                            transcription_jobs.touch(job_key)
+                            progress_bar.progress(done / total, text=f"文字起こし中… ({done} / {total} 区間)")
+                            if partial_text and partial_text != shown_partial["text"]:
+                                shown_partial["text"] = partial_text
+                                partial_area.text_area("文字起こし結果 (途中経過)", partial_text, height=300, disabled=True)
+                        transcript_text, is_new_job = None, False
+                        # 利用回数は、実際にAIを呼んだときだけ数えます (保存済みの文字起こしを使えた場合は数えません)
+                        model_called = {"value": False}
+                        # 音声は丸ごとメモリにコピーせず、一時ファイルに書き出してから扱います
+                        with media_upload.spool(uploaded_file, uploaded_file.type) as spooled:
+                            job_key = transcription_jobs.job_key(file_id, spooled.content_hash)
+                            job = transcription_jobs.get(job_key)
+                            if job and job["status"] == transcription_jobs.DONE:
+                                transcript_text = job["transcript"]
+                                st.session_state[f"{prefix}handled_file_id"] = file_id
+                            elif transcription_jobs.claim(job_key, spooled.content_hash, owner=st.session_state[f"{prefix}session_id"]):
+                                # 再実行で中断された場合は、処理済みにせず、次の実行で、このセッションが続きから再開します
+                                # 失敗した場合は、同じアップロードを自動ではやり直しません (もう一度アップロードすると、やり直せます)
+                                try:
+                                    transcript_text = long_transcription.transcribe_meeting(gemini_api_key, spooled, on_progress=show_progress,
+                                                                                           on_model_call=lambda: model_called.update(value=True))
+                                except Exception as e:
+                                    transcription_jobs.fail(job_key, e)
+                                    st.session_state[f"{prefix}handled_file_id"] = file_id
+                                    raise
+                                transcription_jobs.finish(job_key, transcript_text)
+                                st.session_state[f"{prefix}handled_file_id"] = file_id
+                                is_new_job = True
+                            else:
+                                st.info("このファイルは、別の画面で文字起こし中です。しばらくしてから、画面を更新してください。")
+                        progress_bar.empty(); partial_area.empty()
                         
-                        audio_bytes = uploaded_file.getvalue()
-                        audio_part = {"mime_type": uploaded_file.type, "data": audio_bytes}
-                        prompt = "この日本語の音声を、話者分離（例：「スピーカーA:」「スピーカーB:」）を、意識しながら、できる限り正確に、文字に書き起こしてください。書き起こした日本語テキストのみを回答してください。"
-                        
-                        response = model.generate_content([prompt, audio_part])
-                        
-                        if response.text:
-                            st.session_state[f"{prefix}usage_count"] += 1
-                            st.session_state[f"{prefix}transcript_text"] = response.text
-                            # 最後の検索でrerunを呼ぶと、結果表示後に即座に利用制限画面に切り替わる
-                            st.success("文字起こしが完了しました！")
-                            if st.session_state.get(f"{prefix}usage_count", 0) >= usage_limit:
-                                time.sleep(1) # 完了メッセージを少しだけ表示
-                                st.rerun()
-                        else:
+                        if transcript_text:
+                            st.session_state[f"{prefix}transcript_text"] = transcript_text
+                            if is_new_job:
+                                if model_called["value"]: st.session_state[f"{prefix}usage_count"] += 1
+                                # 最後の検索でrerunを呼ぶと、結果表示後に即座に利用制限画面に切り替わる
+                                st.success("文字起こしが完了しました！")
+                                if st.session_state.get(f"{prefix}usage_count", 0) >= usage_limit:
+                                    time.sleep(1) # 完了メッセージを少しだけ表示
+                                    st.rerun()
+                        elif is_new_job:
                             st.error("AIからの応答が空でした。音声が認識できなかった可能性があります。")
 
                     except Exception as e:
                         st.error(f"文字起こし中にエラーが発生しました: {e}")
-            # ★★★ 処理が終わったら、アップロードされたファイルをクリアする ★★★
-            # これにより、同じファイルを再アップロードして、再度処理をかけることが可能になる
-            st.session_state[f"{prefix}uploader"] = None
 
 
     # --- 結果表示部分は、常に、最新の結果を表示 (成功部分は、完全に保護) ---
@@ -0,0 +1,190 @@
+# ===============================================================
+# ★★★ jp_datetime_parser.py ＜予定の日本語を、手元で読み解く近道＞ ★★★
+# ===============================================================
+# 「明日の15時から歯医者」「来週月曜10時 打ち合わせ」のような、よくある言い方は、
+# AIを呼ばずに、この場で(1ミリ秒もかからずに)件名と日時に分解します。
+# 少しでも迷う言い方 (場所がありそう、「3時」「7時」が午前か午後か分からない (8〜11時は午前とみなします)、日時が2つある、「10時間」 等) は
+# None を返し、いつもどおりAIに任せます。
+import re
+import unicodedata
+from datetime import timedelta
+
+DEFAULT_DURATION = timedelta(hours=1)
+
+_KANJI_DIGITS = {"〇": 0, "零": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_WEEKDAYS = "月火水木金土日"
+_NUM = r"(\d{1,2}|[〇零一二三四五六七八九十]{1,3})"
+
+_RELATIVE_DAYS = (
+    (re.compile(r"明々後日|明明後日|しあさって"), 3),
+    (re.compile(r"明後日|あさって"), 2),
+    (re.compile(r"明日|あした|あす"), 1),
+    (re.compile(r"今日|本日|きょう"), 0),
+)
+_FULL_DATE = re.compile(r"(\d{4})年" + _NUM + r"月" + _NUM + r"日")
+_MONTH_DAY = re.compile(_NUM + r"月" + _NUM + r"日")
+_SLASH_DATE = re.compile(r"(?<![\d/])(\d{1,2})/(\d{1,2})(?![\d/])")
+_MONTH_REL_DAY = re.compile(r"(今月|来月)の?" + _NUM + r"日")
+_DAYS_LATER = re.compile(_NUM + r"日後")
+_WEEK_WEEKDAY = re.compile(r"(今週|来週|再来週)の?([月火水木金土日])曜日?")
+_WEEKDAY = re.compile(r"([月火水木金土日])曜日?")
+_DAY_ONLY = re.compile(r"(?<![\d月])" + _NUM + r"日(?![後間])")
+
+_TIME = re.compile(r"(午前|午後|朝|昼|夕方|夜|晩)?の?(?:(\d{1,2}):(\d{2})|" + _NUM + r"時(?!間)(?:(\d{1,2}|[〇零一二三四五六七八九十]{1,3})分|(半))?)")
+_NOON = re.compile(r"正午|お昼の?12時")
+_RANGE_CONNECTOR = re.compile(r"^\s*(から|〜|~|-|ー|－|より)\s*$")
+
+# 件名の前後に残りがちな、つなぎの言葉
+_EDGE_PARTICLES = re.compile(r"^(?:[\sのにからまでより、。,.・]|から|まで)+|(?:[\sのにからまでより、。,.・]|から|まで)+$")
+_REQUEST_SUFFIX = re.compile(r"(?:の予定|予定)?(?:を)?(?:入れて|登録して|追加して|お願い)?(?:ください|下さい|ね|ます)?$")
+# これらが件名に残る場合は、手元では判断せずAIに任せます
+_AMBIGUOUS_REMAINDER = re.compile(r"\d|[〇零一二三四五六七八九十]時|後|前|頃|ごろ|くらい|ぐらい|毎|来年|今年|午前|午後|で|、|。")
+
+
+def _to_int(text):
+    """半角数字か、九十九までの漢数字を整数にします。"""
+    if text.isdigit(): return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return (_KANJI_DIGITS.get(tens, 1) if tens else 1) * 10 + (_KANJI_DIGITS.get(ones, 0) if ones else 0)
+    value = 0
+    for char in text: value = value * 10 + _KANJI_DIGITS[char]
+    return value
+
+
+def _add_month(base_date, months, day):
+    year, month = base_date.year + (base_date.month - 1 + months) // 12, (base_date.month - 1 + months) % 12 + 1
+    return base_date.replace(year=year, month=month, day=day)
+
+
+def _find_date(text, today):
+    """
+    日付の表現を1つだけ探し、(日付, 一致した範囲, 時刻が過ぎていたら翌週にするか) を返します。
+    見つからなければ (None, None, False)、2つ以上あれば ValueError を出します。
+    """
+    found = []
+    taken = []
+
+    def claim(match):
+        span = match.span()
+        if any(span[0] < end and start < span[1] for start, end in taken): return False
+        taken.append(span); return True
+
+    for match in _FULL_DATE.finditer(text):
+        if claim(match): found.append((today.replace(year=int(match.group(1)), month=_to_int(match.group(2)), day=_to_int(match.group(3))), match.span(), False))
+    for pattern in (_MONTH_DAY, _SLASH_DATE):
+        for match in pattern.finditer(text):
+            if not claim(match): continue
+            candidate = today.replace(month=_to_int(match.group(1)), day=_to_int(match.group(2)))
+            if candidate < today: candidate = candidate.replace(year=today.year + 1)
+            found.append((candidate, match.span(), False))
+    for match in _MONTH_REL_DAY.finditer(text):
+        if claim(match): found.append((_add_month(today, 1 if match.group(1) == "来月" else 0, _to_int(match.group(2))), match.span(), False))
+    for match in _DAYS_LATER.finditer(text):
+        if claim(match): found.append((today + timedelta(days=_to_int(match.group(1))), match.span(), False))
+    for pattern, offset in _RELATIVE_DAYS:
+        for match in pattern.finditer(text):
+            if claim(match): found.append((today + timedelta(days=offset), match.span(), False))
+    for match in _WEEK_WEEKDAY.finditer(text):
+        if not claim(match): continue
+        monday = today - timedelta(days=today.weekday())
+        weeks = {"今週": 0, "来週": 1, "再来週": 2}[match.group(1)]
+        found.append((monday + timedelta(days=7 * weeks + _WEEKDAYS.index(match.group(2))), match.span(), False))
+    for match in _WEEKDAY.finditer(text):
+        if not claim(match): continue
+        found.append((today + timedelta(days=(_WEEKDAYS.index(match.group(1)) - today.weekday()) % 7), match.span(), True))
+    for match in _DAY_ONLY.finditer(text):
+        if not claim(match): continue
+        day = _to_int(match.group(1))
+        candidate = today.replace(day=day)
+        if candidate < today: candidate = _add_month(today, 1, day)
+        found.append((candidate, match.span(), False))
+
+    if len(found) > 1: raise ValueError("日付が複数あります")
+    return found[0] if found else (None, None, False)
+
+
+def _hour_minute(match, previous_meridiem=None):
+    """previous_meridiem は「午後3時から5時」の「5時」のように、前の時刻から午前・午後を受け継ぐ場合に渡します。"""
+    meridiem = match.group(1) or previous_meridiem
+    if match.group(2) is not None:
+        hour, minute = int(match.group(2)), int(match.group(3))
+    else:
+        hour = _to_int(match.group(4))
+        minute = 30 if match.group(6) else (_to_int(match.group(5)) if match.group(5) else 0)
+    if meridiem in ("午後", "夕方", "夜", "晩") and hour < 12: hour += 12
+    elif meridiem == "昼" and hour <= 6: hour += 12
+    elif meridiem == "午前" and hour == 12: hour = 0
+    # 8〜11時は、予定としては午前がふつうです。1〜7時は「7時から飲み会」(19時) のように、どちらか分かりません
+    elif meridiem is None and 1 <= hour <= 7: raise ValueError("午前か午後か分かりません")
+    if hour > 23 or minute > 59: raise ValueError("時刻が範囲外です")
+    return hour, minute, meridiem
+
+
+def _find_times(text):
+    """開始と終了の時刻を [(時, 分, 範囲, 午前・午後), ...] で返します (0〜2個)。"""
+    times = []
+    for match in _NOON.finditer(text):
+        times.append((12, 0, match.span(), "昼"))
+    for match in _TIME.finditer(text):
+        if any(match.start() < end and start < match.end() for *_, (start, end), _m in times): continue
+        hour, minute, meridiem = _hour_minute(match, times[-1][3] if times else None)
+        times.append((hour, minute, match.span(), meridiem))
+    times.sort(key=lambda t: t[2][0])
+    if len(times) > 2: raise ValueError("時刻が3つ以上あります")
+    if len(times) == 2 and not _RANGE_CONNECTOR.match(text[times[0][2][1]:times[1][2][0]]):
+        raise ValueError("2つの時刻が範囲になっていません")
+    return times
+
+
+def _title_from(text, spans):
+    for start, end in sorted(spans, reverse=True):
+        text = text[:start] + " " + text[end:]
+    title = " ".join(text.split())
+    for _ in range(3):
+        title = _EDGE_PARTICLES.sub("", title)
+        title = _REQUEST_SUFFIX.sub("", title)
+    return title.strip()
+
+
+def parse_schedule(text, now_jst):
+    """
+    予定の文章を {"title", "start_time", "end_time"} に分解します (時刻は YYYY-MM-DDTHH:MM:SS、JST)。
+    手元で確実に読めない場合は None を返します (その場合はAIに任せてください)。
+    「今日の9時」のように、はっきり指定された日時がすでに過ぎている場合は、"warning" も付けて返します。
+    """
+    if not text: return None
+    text = unicodedata.normalize("NFKC", text).strip()
+    now = now_jst.replace(tzinfo=None, second=0, microsecond=0)
+    today = now.replace(hour=0, minute=0)
+    try:
+        date, date_span, roll_if_past = _find_date(text, today)
+        times = _find_times(text)
+    except ValueError:
+        return None
+    if not times: return None  # 時刻のない予定(終日など)は、AIに任せます
+
+    start_hour, start_minute, start_span, _ = times[0]
+    if date is None:
+        start = today.replace(hour=start_hour, minute=start_minute)
+        if start <= now: return None  # 「15時に会議」が今日か明日か、決めきれません
+    else:
+        start = date.replace(hour=start_hour, minute=start_minute)
+        if roll_if_past and start <= now: start += timedelta(days=7)
+    warning = "指定された日時は、すでに過ぎています。" if start <= now else None
+
+    if len(times) == 2:
+        end_hour, end_minute, end_span, end_meridiem = times[1]
+        start_span = end_span = (start_span[0], end_span[1])  # 「14:00-15:30」の間のつなぎも、件名から外します
+        end = start.replace(hour=end_hour, minute=end_minute)
+        if end <= start and end_meridiem is None and end_hour < 12: end += timedelta(hours=12)
+        if end <= start: return None
+    else:
+        end, end_span = start + DEFAULT_DURATION, None
+
+    spans = {span for span in (date_span, start_span, end_span) if span}
+    title = _title_from(text, spans)
+    if not title or len(title) > 40 or _AMBIGUOUS_REMAINDER.search(title): return None
+    event = {"title": title, "start_time": start.isoformat(timespec="seconds"), "end_time": end.isoformat(timespec="seconds")}
+    if warning: event["warning"] = warning
+    return event
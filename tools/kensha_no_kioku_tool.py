@@ -2,11 +2,49 @@
 # ★★★ kensha_no_kioku_tool.py ＜デイリーパスワード版＞ ★★★
 # ===============================================================
 import streamlit as st
-import google.generativeai as genai
-import json
 import time
 from datetime import datetime, timedelta, timezone # ★ 日付を扱う達人を召喚
+import json
 import pandas as pd
+from tools import prompt_registry
+from tools import long_transcription
+from tools import media_upload
+from tools import structured_output
+from tools.structured_output import StructuredOutputError, object_schema, string_array
+
+# --- 『賢者の記憶』の応答スキーマ (JSONモードで、この形を守ってもらいます) ---
+_STRING = {"type": "STRING"}
+# 文字起こしは、先に別の段階で作るので、分析の応答には含めません (表示の時に、保存済みの文字起こしを添えます)
+ANALYSIS_SCHEMA = object_schema({
+    "executive_summary": object_schema({"target_audience": _STRING, "summary_content": _STRING}),
+    "discussion_dynamics": object_schema({
+        "key_agreements": string_array(),
+        "major_concerns_raised": {"type": "ARRAY", "items": object_schema({"concern": _STRING, "speaker": _STRING})},
+    }),
+    "strategic_analysis": object_schema({
+        "proposals": {"type": "ARRAY", "items": object_schema({"strategy_name": _STRING, "merits": _STRING, "demerits": _STRING, "first_actionable_step": _STRING})},
+        "ranking_and_tradeoffs": object_schema({"ranking": _STRING, "reasoning": _STRING}),
+        "critical_self_challenge": object_schema({"blind_spots": _STRING, "alternative_perspectives": _STRING}),
+    }),
+})
+
+# --- 『賢者の記憶』の指示書 (固定の部分だけ。ユーザーのコンテキストは、呼び出しごとに文字起こしの前に渡します) ---
+ANALYSIS_PROMPT = """# 命令書: 魂の、パートナーとしての、あなたの、絶対的、責務
+あなたは、単なる、分析AIでは、断じて、ない。あなたは、ユーザーの、ビジネスと、心の、文脈（コンテキスト）を、深く、理解し、議論の、論理と、感情を、読み解き、過去を、整理するだけでなく、未来への、具体的で、勇気ある、一歩を、共に、踏み出す、世界で、唯一無二の、戦略的、パートナーである。
+## あなたの、唯一無二の、任務：ユーザーから、渡された、『会議の、文字起こし（話者分離済み）』と、彼らが、提供する、以下の【ビジネス・コンテキスト】の、両方を、全身全霊で、受け止めよ。そして、その、全てを、統合的に、分析し、指定された、JSON形式で、厳格に、出力すること。
+## 【最重要】ユーザーが、提供する、ビジネス・コンテキスト：
+ビジネス・コンテキストは、会議の文字起こしの直前に、JSONとして渡される。
+## JSON出力に関する、絶対的な、契約条件：あなたの回答は、必ず、以下の、巨大な、一つの、JSONオブジェクトに、厳密に、従うこと。この、JSONオブジェクト以外の、いかなるテキストも、絶対に、絶対に、含めてはならない。
+```json
+{
+  "executive_summary": { "target_audience": "時間に追われ、表面的な分析を嫌う、極めて知的な経営層", "summary_content": "ここに、提供された【ビジネス・コンテキスト】を、完全に、踏まえた上で、会議の、核心的な、論点、結論、そして、経営層が、即座に、把握すべき、ビジネス上の、インパクトのみを、専門家の、知性に、敬意を、払い、当たり前の、情報を、完全に、排除した、高密度な、要約を記述する。" },
+  "discussion_dynamics": { "key_agreements": ["会議の中で、明確に、合意形成が、なされた、重要事項を、ここに、箇条書きで、記述する。"], "major_concerns_raised": [{ "concern": "会議の中で、提起された、重要な、懸念点や、反対意見を、ここに、記述する。", "speaker": "その、懸念を、表明した、話者（不明な場合は「不明」）" }] },
+  "strategic_analysis": { "proposals": [ { "strategy_name": "ここに、一つ目の、画期的な、戦略案を、【ビジネス・コンテキスト】に、沿って、記述する。", "merits": "この戦略の、主なメリットを、箇条書きで、記述する。", "demerits": "この戦略で、想定される、デメリットや、リスクを、箇条書きで、記述する。", "first_actionable_step": "この戦略を、前に、進めるために、明日からでも、実行可能な、具体的で、小さな、最初の一歩を、記述する。" }, { "strategy_name": "ここに、二つ目の、全く、異なる、アプローチの、戦略案を、記述する。", "merits": "メリットを、記述する。", "demerits": "デメリットを、記述する。", "first_actionable_step": "最初の一歩を、記述する。" }, { "strategy_name": "ここに、三つ目の、常識を、覆すような、大胆な、戦略案を、記述する。", "merits": "メリットを、記述する。", "demerits": "デメリットを、記述する。", "first_actionable_step": "最初の一歩を、記述する。" } ], "ranking_and_tradeoffs": { "ranking": "上記の3つの戦略を、【ビジネス・コンテキスト】を、基に、ユーザーにとって、最も、効果的だと、思われる、順に、ランク付けする。", "reasoning": "なぜ、その、順位付けに、なったのか。その、判断を、左右した、重要な、トレードオフを、明確に、説明する。" }, "critical_self_challenge": { "blind_spots": "あなた自身の、上記分析に、潜む、盲点を、正直に、洗い出す。（例：「今回の分析は、提供された、コンテキストに、固執するあまり、市場全体の、マクロな、変化を、見落としている、可能性が、ある」など）", "alternative_perspectives": "ここに、議論の、参加者や、あなた自身が、見落としている、可能性の、ある、全く、別の、視点を、提示する。（例：「この、課題は、技術ではなく、組織文化の、問題として、捉え直すべきでは、ないか？」など）" } }
+}
+```
+"""
+ANALYSIS_PROMPT_VERSION = "2"
+ANALYSIS_PROMPT_NAME = prompt_registry.register("kensha_no_kioku.analysis", ANALYSIS_PROMPT, version=ANALYSIS_PROMPT_VERSION)
 
 # ===============================================================
 # 専門家のメインの仕事 (新しいシステムに換装)
@@ -23,6 +61,9 @@ def show_tool(gemini_api_key):
     # ★ コンテキスト情報をセッションで保持
     if f"{prefix}context" not in st.session_state:
         st.session_state[f"{prefix}context"] = {}
+    # ★ 文字起こし済みの音声 {"file_id", "content_hash", "text"} (コンテキストを変えて分析し直す時は、音声を送り直しません)
+    if f"{prefix}transcript" not in st.session_state:
+        st.session_state[f"{prefix}transcript"] = None
 
     # ★★★ リミット回数を、ここで定義 ★★★
     usage_limit = 1 # ←←← ちゃろさんが、いつでも、ここの数字を変えられます！
@@ -64,7 +105,7 @@ def show_tool(gemini_api_key):
         会議の音声ファイルをアップロードし、あなたの「ビジネス目標」と「課題」を入力してください。
         AIが単なる議事録を超えた、未来を創造するための戦略的分析レポートを生成します。
         """)
-        st.warning("長時間の音声ファイルは、処理に時間がかかったり、サーバーのメモリ制限によりエラーが発生する可能性があります。")
+        st.caption("長時間の音声は、区間に分けて並列に文字起こしするため、数分かかることがあります。")
         st.caption(f"🚀 あと {usage_limit - st.session_state.get(f'{prefix}usage_count', 0)} 回、分析できます。")
 
         # --- STEP 1: コンテキスト入力 (成功部分は、完全に保護) ---
@@ -101,47 +142,41 @@ def show_tool(gemini_api_key):
             else:
                 with st.spinner("賢者が、あなたの、過去と、現在を、深く、瞑想し、未来を、紡いでいます..."):
                     try:
-                        genai.configure(api_key=gemini_api_key)
-                        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                        
-                        audio_bytes = uploaded_file.getvalue()
-                        audio_part = {"mime_type": uploaded_file.type, "data": audio_bytes}
+                        # 第1段階: 音声の文字起こし (同じ音声なら1回だけ。議事録ツールで作った文字起こしも、そのまま使います)
+                        file_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+                        # 利用回数は、実際にAIを呼んだときだけ数えます (保存済みの文字起こしと分析だけで済んだ場合は数えません)
+                        model_called = {"value": False}
+                        mark_model_called = lambda: model_called.update(value=True)
+                        transcript = st.session_state[f"{prefix}transcript"]
+                        if not transcript or transcript["file_id"] != file_id:
+                            with media_upload.spool(uploaded_file, uploaded_file.type) as spooled:
+                                transcript_text = long_transcription.transcribe_meeting(gemini_api_key, spooled, on_model_call=mark_model_called)
+                                transcript = {"file_id": file_id, "content_hash": spooled.content_hash, "text": transcript_text}
+                            if transcript_text: st.session_state[f"{prefix}transcript"] = transcript
                         
-                        system_prompt = f"""
-                        # 命令書: 魂の、パートナーとしての、あなたの、絶対的、責務
-                        あなたは、単なる、分析AIでは、断じて、ない。あなたは、ユーザーの、ビジネスと、心の、文脈（コンテキスト）を、深く、理解し、議論の、論理と、感情を、読み解き、過去を、整理するだけでなく、未来への、具体的で、勇気ある、一歩を、共に、踏み出す、世界で、唯一無二の、戦略的、パートナーである。
-                        ## あなたの、唯一無二の、任務：ユーザーから、渡された、『会議の、音声』と、彼らが、提供する、以下の【ビジネス・コンテキスト】の、両方を、全身全霊で、受け止めよ。そして、その、全てを、統合的に、分析し、指定された、JSON形式で、厳格に、出力すること。
-                        ## 【最重要】ユーザーが、提供する、ビジネス・コンテキスト：
-                        {{
-                          "business_goal": "{context.get('business_goal')}",
-                          "current_challenges": "{context.get('current_challenges')}",
-                          "meta_prompt": "{context.get('meta_prompt')}"
-                        }}
-                        ## JSON出力に関する、絶対的な、契約条件：あなたの回答は、必ず、以下の、巨大な、一つの、JSONオブジェクトに、厳密に、従うこと。この、JSONオブジェクト以外の、いかなるテキストも、絶対に、絶対に、含めてはならない。
-                        ```json
-                        {{
-                          "full_transcript": "ここに、話者分離を、意識した、可能な限り、正確な、会議の、完全な、文字起こしテキストを記述する。",
-                          "executive_summary": {{ "target_audience": "時間に追われ、表面的な分析を嫌う、極めて知的な経営層", "summary_content": "ここに、提供された【ビジネス・コンテキスト】を、完全に、踏まえた上で、会議の、核心的な、論点、結論、そして、経営層が、即座に、把握すべき、ビジネス上の、インパクトのみを、専門家の、知性に、敬意を、払い、当たり前の、情報を、完全に、排除した、高密度な、要約を記述する。" }},
-                          "discussion_dynamics": {{ "key_agreements": ["会議の中で、明確に、合意形成が、なされた、重要事項を、ここに、箇条書きで、記述する。"], "major_concerns_raised": [{{ "concern": "会議の中で、提起された、重要な、懸念点や、反対意見を、ここに、記述する。", "speaker": "その、懸念を、表明した、話者（不明な場合は「不明」）" }}] }},
-                          "strategic_analysis": {{ "proposals": [ {{ "strategy_name": "ここに、一つ目の、画期的な、戦略案を、【ビジネス・コンテキスト】に、沿って、記述する。", "merits": "この戦略の、主なメリットを、箇条書きで、記述する。", "demerits": "この戦略で、想定される、デメリットや、リスクを、箇条書きで、記述する。", "first_actionable_step": "この戦略を、前に、進めるために、明日からでも、実行可能な、具体的で、小さな、最初の一歩を、記述する。" }}, {{ "strategy_name": "ここに、二つ目の、全く、異なる、アプローチの、戦略案を、記述する。", "merits": "メリットを、記述する。", "demerits": "デメリットを、記述する。", "first_actionable_step": "最初の一歩を、記述する。" }}, {{ "strategy_name": "ここに、三つ目の、常識を、覆すような、大胆な、戦略案を、記述する。", "merits": "メリットを、記述する。", "demerits": "デメリットを、記述する。", "first_actionable_step": "最初の一歩を、記述する。" }} ], "ranking_and_tradeoffs": {{ "ranking": "上記の3つの戦略を、【ビジネス・コンテキスト】を、基に、ユーザーにとって、最も、効果的だと、思われる、順に、ランク付けする。", "reasoning": "なぜ、その、順位付けに、なったのか。その、判断を、左右した、重要な、トレードオフを、明確に、説明する。" }}, "critical_self_challenge": {{ "blind_spots": "あなた自身の、上記分析に、潜む、盲点を、正直に、洗い出す。（例：「今回の分析は、提供された、コンテキストに、固執するあまり、市場全体の、マクロな、変化を、見落としている、可能性が、ある」など）", "alternative_perspectives": "ここに、議論の、参加者や、あなた自身が、見落としている、可能性の、ある、全く、別の、視点を、提示する。（例：「この、課題は、技術ではなく、組織文化の、問題として、捉え直すべきでは、ないか？」など）" }} }}
-                        }}
-                        ```
-                        """
-                        response = model.generate_content([system_prompt, audio_part])
-
-                        if response.text:
-                            st.session_state[f"{prefix}usage_count"] += 1
-                            json_text = response.text.strip().lstrip("```json").rstrip("```")
-                            st.session_state[f"{prefix}analysis_result"] = json.loads(json_text)
+                        # 第2段階: 文字起こしだけを使った分析 (コンテキストを変えて分析し直しても、テキストだけの呼び出しで済みます)
+                        # 固定の指示書は名前で送り、その時々のビジネス・コンテキストだけを、文字起こしの前に付けます
+                        business_context = json.dumps({key: context.get(key) for key in ("business_goal", "current_challenges", "meta_prompt")}, ensure_ascii=False, indent=2)
+                        analysis_result = None
+                        if transcript["text"]:
+                            analysis_result = structured_output.generate_json(
+                                gemini_api_key, [f"## ビジネス・コンテキスト:\n{business_context}", f"## 会議の文字起こし:\n{transcript['text']}"],
+                                schema=ANALYSIS_SCHEMA, prompt_name=ANALYSIS_PROMPT_NAME,
+                                cache_namespace="kensha_no_kioku", prompt_version=ANALYSIS_PROMPT_VERSION,
+                                cache_key_contents=[business_context, transcript["content_hash"]], on_model_call=mark_model_called)
+
+                        if analysis_result:
+                            if model_called["value"]: st.session_state[f"{prefix}usage_count"] += 1
+                            st.session_state[f"{prefix}analysis_result"] = {**analysis_result, "full_transcript": transcript["text"]}
                             if st.session_state.get(f"{prefix}usage_count", 0) >= usage_limit:
                                 st.rerun()
                         else:
                             st.error("AIからの応答が空でした。音声が認識できなかった可能性があります。")
 
-                    except json.JSONDecodeError:
+                    except StructuredOutputError as e:
                         st.error("AIからの応答を解析できませんでした。AIが予期せぬ形式で回答した可能性があります。")
                         st.info("AIからの生の応答は以下の通りです：")
-                        st.code(response.text, language="text")
+                        st.code(e.raw_text, language="text")
                     except Exception as e:
                         st.error(f"分析中にエラーが発生しました: {e}")
 
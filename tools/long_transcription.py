@@ -0,0 +1,206 @@
+# ===============================================================
+# ★★★ long_transcription.py ＜長い会議音声の、分割・並列文字起こし＞ ★★★
+# ===============================================================
+# 90分の会議を1回の巨大なリクエストで送るのではなく、
+#   1. 少しずつ重なり合う区間(SEGMENT_SECONDS 秒ごと、前後 OVERLAP_SECONDS 秒重ねる)に切り分け
+#   2. MAX_PARALLEL_SEGMENTS 個ずつ同時に文字起こしし
+#   3. 重なった部分の重複を取り除きながら、1つの文字起こしにつなぎ直します
+# 区間ごとにAIが付ける「スピーカーA/B」は、重なった部分で同じ発言に付いたラベルを照らし合わせ、
+# 最初の区間のラベルにそろえます。
+# 区間の結果は終わった順にSQLiteへ保存し(transcription_jobs)、途中で止まっても、残りの区間だけをやり直します。
+import difflib
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tools import audio_preprocess, gemini_client, transcription, transcription_jobs
+
+SEGMENT_SECONDS = 5 * 60
+OVERLAP_SECONDS = 15
+MAX_PARALLEL_SEGMENTS = 4
+# これより短い音声は、分けずに1回で文字起こしします
+LONG_AUDIO_THRESHOLD_SECONDS = 10 * 60
+# 重なった部分の発言を「同じ発言」とみなす、文字列の似ている度合い
+SAME_LINE_RATIO = 0.6
+
+SEGMENT_PROMPT = transcription.STYLES[transcription.SPEAKERS] + """
+この音声は、長い会議の一部分です。話者は、この部分で最初に話した人から順に「スピーカーA」「スピーカーB」…としてください。
+1つの発言ごとに改行し、各行を「スピーカーA: 発言」の形にしてください。"""
+
+_DIGITS = re.compile(r"\d+")
+_SPEAKER_LINE = re.compile(r"^\s*(スピーカー\s*[A-ZＡ-Ｚ]{1,2}|話者\s*[A-ZＡ-Ｚ0-9０-９]{1,2})\s*[:：]\s*(.*)$")
+
+
+def plan_segments(duration_seconds, segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """[(区間番号, 開始秒, 終了秒), ...] を返します。隣り合う区間は overlap_seconds だけ重なります。"""
+    segments, start = [], 0.0
+    while start < duration_seconds:
+        end = min(start + segment_seconds, duration_seconds)
+        segments.append((len(segments), start, end))
+        if end >= duration_seconds: break
+        start = end - overlap_seconds
+    return segments
+
+
+def transcribe_segment(api_key, path, start_seconds, end_seconds):
+    """ファイルの1区間を取り出して、文字起こしします。"""
+    extracted = audio_preprocess.extract_segment(path, start_seconds, end_seconds)
+    if extracted is None: raise ValueError("この形式の音声は、区間に分けられません。")
+    segment_bytes, mime_type = extracted
+    return gemini_client.generate(api_key, [SEGMENT_PROMPT, {"mime_type": mime_type, "data": segment_bytes}]).strip()
+
+
+# ---------------------------------------------------------------
+# つなぎ直し
+# ---------------------------------------------------------------
+def _parse_lines(text):
+    """[(ラベル または None, 発言), ...] に分けます。"""
+    lines = []
+    for raw in (text or "").splitlines():
+        if not raw.strip(): continue
+        match = _SPEAKER_LINE.match(raw)
+        if match: lines.append((re.sub(r"\s+", "", match.group(1)), match.group(2).strip()))
+        else: lines.append((None, raw.strip()))
+    return lines
+
+
+def _similar(a, b):
+    # 数字が違う発言(「3番」と「5番」など)は、ほかがそっくりでも別の発言です
+    if not a or not b or _DIGITS.findall(a) != _DIGITS.findall(b): return False
+    return difflib.SequenceMatcher(None, a, b).ratio() >= SAME_LINE_RATIO
+
+
+def _align_overlap(previous_lines, next_lines, window):
+    """
+    前の区間の末尾と、次の区間の先頭で、同じ発言どうしを探します。
+    (次の区間で、重なりとして捨てる行数, [(次の区間のラベル, 前の区間のラベル), ...]) を返します。
+    """
+    tail = previous_lines[-window:]
+    drop, label_pairs, search_from = 0, [], 0
+    for next_index, (next_label, next_text) in enumerate(next_lines[:window]):
+        for tail_index in range(search_from, len(tail)):
+            previous_label, previous_text = tail[tail_index]
+            if _similar(next_text, previous_text):
+                drop = next_index + 1
+                search_from = tail_index + 1
+                if next_label and previous_label: label_pairs.append((next_label, previous_label))
+                break
+    return drop, label_pairs
+
+
+def _label_mapping(label_pairs, next_labels, used_labels):
+    """次の区間のラベルを、前の区間までのラベルに置き換える対応表を作ります。"""
+    votes = {}
+    for next_label, previous_label in label_pairs:
+        votes.setdefault(next_label, {}).setdefault(previous_label, 0)
+        votes[next_label][previous_label] += 1
+    mapping, taken = {}, set()
+    for next_label, counts in sorted(votes.items(), key=lambda item: -max(item[1].values())):
+        best = max(counts, key=counts.get)
+        if best not in taken:
+            mapping[next_label] = best; taken.add(best)
+    # 重なりで照合できなかった話者には、まだ使っていない新しいラベルを割り当てます
+    for next_label in next_labels:
+        if next_label in mapping: continue
+        taken_labels = used_labels | set(mapping.values())
+        # A〜Z を使い切ったときは、番号で続けます
+        fresh = next((f"スピーカー{chr(code)}" for code in range(ord("A"), ord("Z") + 1) if f"スピーカー{chr(code)}" not in taken_labels),
+                     f"スピーカー{len(taken_labels) + 1}")
+        mapping[next_label] = fresh
+    return mapping
+
+
+def stitch_segments(segment_texts, overlap_window=8):
+    """区間ごとの文字起こし(時間順)を、重なりを除いて1つにつなぎ、話者ラベルをそろえます。"""
+    merged = []
+    used_labels = set()
+    for index, text in enumerate(segment_texts):
+        lines = _parse_lines(text)
+        if index == 0 or not merged:
+            merged.extend(lines)
+            used_labels.update(label for label, _ in lines if label)
+            continue
+        drop, label_pairs = _align_overlap(merged, lines, overlap_window)
+        next_labels = list(dict.fromkeys(label for label, _ in lines if label))
+        mapping = _label_mapping(label_pairs, next_labels, used_labels)
+        for label, line_text in lines[drop:]:
+            label = mapping.get(label, label) if label else None
+            merged.append((label, line_text))
+            if label: used_labels.add(label)
+    return "\n".join(f"{label}: {text}" if label else text for label, text in merged)
+
+
+# ---------------------------------------------------------------
+# まとめて実行
+# ---------------------------------------------------------------
+def segment_params(segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """区間の切り方と指示の目印です。どちらかが変わったら、保存済みの区間の結果は使いません。"""
+    prompt_fingerprint = hashlib.sha256(SEGMENT_PROMPT.encode("utf-8")).hexdigest()[:8]
+    return f"{segment_seconds}:{overlap_seconds}:{prompt_fingerprint}"
+
+
+def _completed_prefix(texts):
+    """先頭から、とぎれずに終わっている区間だけの結果です (途中経過の表示用)。"""
+    prefix = []
+    for text in texts:
+        if text is None: break
+        prefix.append(text)
+    return prefix
+
+
+def transcribe_long_audio(api_key, path, segments, on_progress=None, max_workers=MAX_PARALLEL_SEGMENTS, content_hash=None, params=None,
+                          on_model_call=None):
+    """
+    区間を並列に文字起こしし、つなぎ直したテキストを返します。
+    on_progress(終わった区間の数, 全区間の数, 先頭からつないだ途中のテキスト) は、呼び出し元のスレッドで呼ばれます
+    (st.progress や、途中の文字起こしの表示を更新できます)。
+    content_hash を渡すと、区間ごとの結果を保存し、保存済みの区間は文字起こしし直しません。
+    on_model_call() は、文字起こしの残っている区間があり、実際にAIを呼ぶときだけ、呼び出し元のスレッドで1回呼ばれます。
+    """
+    params = params or segment_params()
+    done_texts = transcription_jobs.load_segments(content_hash, params) if content_hash else {}
+    texts = [done_texts.get(index) for index, _, _ in segments]
+
+    def run(index, start, end):
+        text = transcribe_segment(api_key, path, start, end)
+        # 呼び出し元が再実行などで中断しても、終わった区間は残るよう、作業スレッドの中で保存します
+        if content_hash: transcription_jobs.save_segment(content_hash, params, index, text)
+        return text
+
+    pending = [(index, start, end) for index, start, end in segments if texts[index] is None]
+    done = len(segments) - len(pending)
+    if on_progress and done: on_progress(done, len(segments), stitch_segments(_completed_prefix(texts)))
+    if on_model_call and pending: on_model_call()
+    # 先頭の区間から順に頼むので、会議の最初の方から先に表示されます
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(run, index, start, end): index for index, start, end in pending}
+        for future in as_completed(futures):
+            texts[futures[future]] = future.result()
+            done += 1
+            if on_progress: on_progress(done, len(segments), stitch_segments(_completed_prefix(texts)))
+    finally:
+        # 再実行や停止(on_progress の中で例外になります)で抜けたときは、まだ始まっていない区間を取り消し、
+        # 終わるのを待たずに戻ります。実行中の区間だけは最後まで進み、その結果は次の実行で使われます
+        executor.shutdown(wait=False, cancel_futures=True)
+    return stitch_segments(texts)
+
+
+def transcribe_meeting(api_key, spooled, on_progress=None, on_model_call=None):
+    """
+    会議音声(media_upload.spool() で書き出したもの)を、話者分離つきで書き起こします (議事録ツールの入口)。
+    保存済みならそれを返します。長い音声は区間に分けて並列に、短い音声や区間に分けられない形式は1回で書き起こします。
+    つないだ結果は、元の音声のハッシュで保存するので、ほかのツールからも同じ書き起こしを使えます。
+    on_model_call() は、保存済みの結果だけで済まず、実際にAIを呼ぶときだけ呼ばれます (利用回数を数える場合など)。
+    """
+    cached = transcription.lookup(spooled.content_hash, transcription.SPEAKERS, count_hit=True)
+    if cached is not None: return cached
+    duration = audio_preprocess.probe_duration(spooled.path)
+    if duration is None or duration <= LONG_AUDIO_THRESHOLD_SECONDS:
+        return transcription.transcribe_spooled(api_key, spooled, style=transcription.SPEAKERS, on_model_call=on_model_call)
+    params = segment_params()
+    text = transcribe_long_audio(api_key, spooled.path, plan_segments(duration), on_progress, content_hash=spooled.content_hash, params=params,
+                                 on_model_call=on_model_call)
+    transcription.remember(spooled.content_hash, text, transcription.SPEAKERS)
+    transcription_jobs.clear_segments(spooled.content_hash, params)
+    return text
@@ -0,0 +1,206 @@
+# ===============================================================
+# ★★★ media_upload.py ＜大きな音声の、ファイル経由の受け渡し＞ ★★★
+# ===============================================================
+# アップロードされた音声を uploaded_file.getvalue() で丸ごとコピーし、リクエストに埋め込むのをやめます。
+# - spool() で、少しずつ一時ファイルへ書き出しながら、中身のハッシュを計算します (メモリに丸ごと載せません)
+# - 大きな音声は、一時ファイルから Gemini の File API へ送り、返ってきた印(URI)だけをリクエストに入れます
+# - 同じAPIキーで同じ音声なら、期限内は前に送ったファイルを使い回します (送り直しません)
+# - 期限の切れたアップロードは、ときどき自動で片付けます。そのAPIキーで上げたファイルは File API からも消します
+#   (ほかのキーで上げたものは、キーを保存していないので消せません。File API 側の48時間の自動削除に任せます)
+# - どの大きさの音声も、先に下ごしらえ(audio_preprocess: モノラル・16kHz・Opus・無音の切り落とし)をします。
+#   一時ファイルから一時ファイルへ変換するので、大きな音声でもメモリは増えません (ffmpeg がなければ、元のまま扱います)
+# - 下ごしらえ後の小さな音声は、これまでどおりリクエストに直接入れます
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from google.generativeai.client import FileServiceClient
+
+from tools import audio_preprocess, state_store
+
+# これより大きな音声は、File API 経由で送ります (リクエストに直接入れられるのは、全体で約20MBまでです)
+INLINE_MAX_BYTES = 4 * 1024 * 1024
+SPOOL_CHUNK_BYTES = 1024 * 1024
+# File API のファイルは48時間で消えます。余裕を持って、それより前に使うのをやめます
+UPLOAD_TTL_SECONDS = 47 * 60 * 60
+# アップロード直後は処理中(PROCESSING)のことがあるので、使えるようになるまで待ちます
+ACTIVE_WAIT_SECONDS = 120
+CLEANUP_EVERY_SECONDS = 60 * 60
+
+_lock = threading.Lock()
+_clients = {}          # api_key -> FileServiceClient
+_uploading = {}        # (user_id, content_hash) -> threading.Event
+_last_cleanup = 0.0
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS media_uploads (
+        user_id TEXT NOT NULL, content_hash TEXT NOT NULL, file_name TEXT NOT NULL, file_uri TEXT NOT NULL,
+        mime_type TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL,
+        PRIMARY KEY (user_id, content_hash))""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def _user_id(api_key):
+    """アップロードしたファイルは、そのAPIキーからしか使えません。キーそのものは保存せず、ハッシュで区別します。"""
+    return hashlib.sha256(f"media_upload:{api_key}".encode("utf-8")).hexdigest()[:24]
+
+
+def _get_file_client(api_key):
+    # genai.upload_file はグローバルな genai.configure を使うため、キーごとのクライアントを直接持ちます (gemini_client と同じ考え方)
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = FileServiceClient(client_options={"api_key": api_key})
+            _clients[api_key] = client
+        return client
+
+
+# ---------------------------------------------------------------
+# 一時ファイルへの書き出し
+# ---------------------------------------------------------------
+class SpooledAudio:
+    """一時ファイルに書き出した音声です。with 文を抜けると、一時ファイルを消します。"""
+
+    def __init__(self, path, content_hash, size, mime_type):
+        self.path = path
+        self.content_hash = content_hash
+        self.size = size
+        self.mime_type = mime_type
+
+    def read_bytes(self):
+        with open(self.path, "rb") as audio_file:
+            return audio_file.read()
+
+    def close(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def spool(uploaded_file, fallback_mime=None):
+    """アップロードされたファイルを、少しずつ一時ファイルへ書き出します。ハッシュは transcription.audio_hash と同じです。"""
+    uploaded_file.seek(0)
+    head = uploaded_file.read(16)
+    uploaded_file.seek(0)
+    digest, size = hashlib.sha256(), 0
+    suffix = "." + (audio_preprocess.sniff_format(head) or "audio")
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        while True:
+            chunk = uploaded_file.read(SPOOL_CHUNK_BYTES)
+            if not chunk: break
+            digest.update(chunk); size += len(chunk)
+            temp_file.write(chunk)
+    uploaded_file.seek(0)
+    return SpooledAudio(temp_file.name, digest.hexdigest(), size, audio_preprocess.mime_type_for(head, fallback_mime))
+
+
+# ---------------------------------------------------------------
+# File API
+# ---------------------------------------------------------------
+def _lookup(user_id, content_hash):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT file_uri, mime_type FROM media_uploads WHERE user_id = ? AND content_hash = ? AND expires_at > ?",
+                           (user_id, content_hash, time.time())).fetchone()
+    finally:
+        conn.close()
+    return row
+
+
+def _upload(api_key, spooled):
+    client = _get_file_client(api_key)
+    uploaded = client.create_file(spooled.path, mime_type=spooled.mime_type, display_name=spooled.content_hash[:16])
+    deadline = time.time() + ACTIVE_WAIT_SECONDS
+    while uploaded.state.name == "PROCESSING" and time.time() < deadline:
+        time.sleep(2)
+        uploaded = client.get_file(name=uploaded.name)
+    if uploaded.state.name != "ACTIVE": raise RuntimeError(f"音声ファイルの受け付けに失敗しました ({uploaded.state.name})")
+    return uploaded
+
+
+def file_part(api_key, spooled):
+    """File API に送った音声を指す部品を返します。期限内に同じ音声を送っていれば、送り直しません。"""
+    cleanup_expired(api_key)
+    user_id = _user_id(api_key)
+    key = (user_id, spooled.content_hash)
+    while True:
+        row = _lookup(user_id, spooled.content_hash)
+        if row: return {"file_data": {"file_uri": row[0], "mime_type": row[1]}}
+        with _lock:
+            event = _uploading.get(key)
+            if event is None:
+                _uploading[key] = threading.Event()
+                break
+        event.wait()  # 同じ音声を送っている途中の呼び出しを待って、その印を使います
+    try:
+        uploaded = _upload(api_key, spooled)
+        now = time.time()
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("""INSERT OR REPLACE INTO media_uploads
+                                (user_id, content_hash, file_name, file_uri, mime_type, size, created_at, expires_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (user_id, spooled.content_hash, uploaded.name, uploaded.uri, spooled.mime_type, spooled.size, now, now + UPLOAD_TTL_SECONDS))
+        finally:
+            conn.close()
+        return {"file_data": {"file_uri": uploaded.uri, "mime_type": spooled.mime_type}}
+    finally:
+        with _lock:
+            _uploading.pop(key).set()
+
+
+def audio_part(api_key, spooled):
+    """音声を下ごしらえしてから、大きければ File API 経由の部品を、小さければバイト列の部品を返します。"""
+    # 期限内に送ってあれば、変換もせずに、その印を使います
+    row = _lookup(_user_id(api_key), spooled.content_hash)
+    if row: return {"file_data": {"file_uri": row[0], "mime_type": row[1]}}
+    normalized_path = audio_preprocess.normalize_file(spooled.path)
+    if normalized_path is None:
+        # ffmpeg がない環境: 大きな音声は元のまま送り、小さな音声は手元で変換できる範囲(WAV)だけ変換します
+        if spooled.size > INLINE_MAX_BYTES: return file_part(api_key, spooled)
+        part, _ = audio_preprocess.to_audio_part(spooled.read_bytes(), spooled.mime_type)
+        return part
+    # 目印(content_hash)は元の音声のままにして、同じ音声なら、次からは変換後のファイルを使い回します
+    with SpooledAudio(normalized_path, spooled.content_hash, os.path.getsize(normalized_path), "audio/ogg") as normalized:
+        chosen = normalized if normalized.size < spooled.size else spooled  # 変換した方が大きければ、元のまま使います
+        if chosen.size > INLINE_MAX_BYTES: return file_part(api_key, chosen)
+        return {"mime_type": chosen.mime_type, "data": chosen.read_bytes()}
+
+
+def cleanup_expired(api_key=None, force=False):
+    """
+    期限の切れたアップロードの記録を消し、消した件数を返します。
+    api_key を渡すと、そのキーで上げたファイルは File API からも消します (ほかのキーのものは、48時間で自動的に消えます)。
+    """
+    global _last_cleanup
+    now = time.time()
+    with _lock:
+        if not force and now - _last_cleanup < CLEANUP_EVERY_SECONDS: return 0
+        _last_cleanup = now
+    conn = _connect()
+    try:
+        own_files = []
+        if api_key:
+            own_files = [name for (name,) in conn.execute("SELECT file_name FROM media_uploads WHERE user_id = ? AND expires_at <= ?",
+                                                          (_user_id(api_key), now))]
+        with conn:
+            removed = conn.execute("DELETE FROM media_uploads WHERE expires_at <= ?", (now,)).rowcount
+    finally:
+        conn.close()
+    for file_name in own_files:
+        try:
+            _get_file_client(api_key).delete_file(name=file_name)
+        except Exception:
+            pass  # すでに消えている場合など。File API 側でも、48時間で自動的に消えます
+    return removed
@@ -0,0 +1,101 @@
+# ===============================================================
+# ★★★ okozukai_export.py ＜必要な時だけ作る・ストリーミング書き出し＞ ★★★
+# ===============================================================
+# 支出履歴のCSV / Parquet ファイルは、ユーザーがボタンを押した時にだけ作ります。
+# 台帳から少しずつ読み出し、一時ファイルへ順番に書き込むので、
+# 履歴全体を1つの巨大な文字列やDataFrameとしてメモリに載せることはありません。
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from tools import okozukai_ledger
+
+CSV_COLUMNS = ["日付", "品物名", "金額", "レシート合計"]
+ROWS_PER_CHUNK = 1000
+
+EXPORT_FORMATS = {
+    "CSV": {"suffix": ".csv", "mime": "text/csv"},
+    "Parquet": {"suffix": ".parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def iter_export_rows():
+    """台帳のレシートを、1品目1行の形に平らにして返します。"""
+    for receipt in okozukai_ledger.iter_receipts():
+        receipt_date = receipt.get('date', 'N/A'); receipt_total = receipt.get('total_amount', 0)
+        items = receipt.get('items', [])
+        if not items:
+            yield {"日付": receipt_date, "品物名": "品目なし", "金額": 0.0, "レシート合計": receipt_total}
+            continue
+        for item in items:
+            yield {"日付": receipt_date, "品物名": item.get('name', 'N/A'), "金額": okozukai_ledger.to_amount(item.get('price', 0)), "レシート合計": receipt_total}
+
+
+def _iter_row_chunks(rows_per_chunk=ROWS_PER_CHUNK):
+    chunk = []
+    for row in iter_export_rows():
+        chunk.append(row)
+        if len(chunk) >= rows_per_chunk:
+            yield chunk; chunk = []
+    if chunk: yield chunk
+
+
+def iter_csv_chunks(rows_per_chunk=ROWS_PER_CHUNK):
+    """utf-8-sig のCSVを、rows_per_chunk 行ずつのバイト列として返します。"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    yield "\ufeff".encode("utf-8") + buffer.getvalue().encode("utf-8")
+    for chunk in _iter_row_chunks(rows_per_chunk):
+        buffer.seek(0); buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _write_csv(path):
+    with open(path, "wb") as f:
+        for data in iter_csv_chunks(): f.write(data)
+
+
+def _write_parquet(path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet形式での書き出しには pyarrow が必要です。")
+    schema = pa.schema([("日付", pa.string()), ("品物名", pa.string()), ("金額", pa.float64()), ("レシート合計", pa.float64())])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in _iter_row_chunks():
+            columns = {
+                "日付": [str(row["日付"]) for row in chunk],
+                "品物名": [str(row["品物名"]) for row in chunk],
+                "金額": [okozukai_ledger.to_amount(row["金額"]) for row in chunk],
+                "レシート合計": [okozukai_ledger.to_amount(row["レシート合計"]) for row in chunk],
+            }
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+def build_export(export_format):
+    """
+    一時ファイルに書き出し、(ファイルパス, ダウンロード用のファイル名, MIMEタイプ) を返します。
+    使い終わったファイルは discard_export で削除してください。
+    """
+    spec = EXPORT_FORMATS[export_format]
+    fd, path = tempfile.mkstemp(prefix="okozukai_export_", suffix=spec["suffix"])
+    os.close(fd)
+    try:
+        if export_format == "Parquet": _write_parquet(path)
+        else: _write_csv(path)
+    except Exception:
+        discard_export(path)
+        raise
+    file_name = f"okozukai_history_{datetime.now().strftime('%Y%m%d')}{spec['suffix']}"
+    return path, file_name, spec["mime"]
+
+
+def discard_export(path):
+    if not path: return
+    try: os.remove(path)
+    except OSError: pass
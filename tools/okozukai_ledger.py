@@ -0,0 +1,178 @@
+# ===============================================================
+# ★★★ okozukai_ledger.py ＜月別パーティション式・レシート台帳＞ ★★★
+# ===============================================================
+# レシートは1件ずつ、月(YYYY-MM)ごとのパーティションとして保存します。
+# - 月ごとの合計と件数、品物ごとの集計は、確定のたびに更新しておきます
+# - 履歴の表示は、開いた月の、開いたページの分だけを読み込みます
+# - つまり、履歴がどれだけ増えても、1回の描画で読むデータ量は変わりません
+import json
+from datetime import datetime
+
+from tools import state_store
+
+DEFAULT_PAGE_SIZE = 10
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS okozukai_receipts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        month TEXT NOT NULL, date TEXT NOT NULL,
+        total_amount REAL NOT NULL, items TEXT NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS okozukai_receipts_month ON okozukai_receipts (month, id)",
+    """CREATE TABLE IF NOT EXISTS okozukai_months (
+        month TEXT PRIMARY KEY, receipt_count INTEGER NOT NULL, total_amount REAL NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS okozukai_item_totals (
+        month TEXT NOT NULL, name TEXT NOT NULL, quantity INTEGER NOT NULL, total_price REAL NOT NULL,
+        PRIMARY KEY (month, name))""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def to_amount(value):
+    try: return float(str(value).replace(",", "").replace("円", "").strip() or 0)
+    except (TypeError, ValueError): return 0.0
+
+
+def _month_of(date_str):
+    """'YYYY-MM-DD HH:MM' 形式の日時から 'YYYY-MM' を取り出します。"""
+    try: return datetime.strptime(date_str[:10], '%Y-%m-%d').strftime('%Y-%m')
+    except (TypeError, ValueError): return datetime.now().strftime('%Y-%m')
+
+
+def current_month():
+    return datetime.now().strftime('%Y-%m')
+
+
+# ---------------------------------------------------------------
+# 書き込み
+# ---------------------------------------------------------------
+def _insert_receipt(conn, receipt):
+    date_str = receipt.get('date') or datetime.now().strftime('%Y-%m-%d %H:%M')
+    month = _month_of(date_str)
+    total = to_amount(receipt.get('total_amount', 0))
+    items = receipt.get('items', []) or []
+    conn.execute("INSERT INTO okozukai_receipts (month, date, total_amount, items) VALUES (?, ?, ?, ?)",
+                 (month, date_str, total, json.dumps(items, ensure_ascii=False)))
+    conn.execute("""INSERT INTO okozukai_months (month, receipt_count, total_amount) VALUES (?, 1, ?)
+                    ON CONFLICT(month) DO UPDATE SET receipt_count = receipt_count + 1, total_amount = total_amount + excluded.total_amount""",
+                 (month, total))
+    for item in items:
+        name = str(item.get('name') or '').strip()
+        if not name: continue
+        conn.execute("""INSERT INTO okozukai_item_totals (month, name, quantity, total_price) VALUES (?, ?, 1, ?)
+                        ON CONFLICT(month, name) DO UPDATE SET quantity = quantity + 1, total_price = total_price + excluded.total_price""",
+                     (month, name, to_amount(item.get('price', 0))))
+
+
+def add_receipt(date_str, total_amount, items):
+    """レシートを1件追加し、その月の集計も同じトランザクションで更新します。"""
+    conn = _connect()
+    try:
+        with conn:
+            _insert_receipt(conn, {"date": date_str, "total_amount": total_amount, "items": items})
+    finally:
+        conn.close()
+
+
+def clear():
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM okozukai_receipts")
+            conn.execute("DELETE FROM okozukai_months")
+            conn.execute("DELETE FROM okozukai_item_totals")
+    finally:
+        conn.close()
+
+
+def import_legacy_receipts(state_key):
+    """状態ファイルの1つのリストに溜まっていた旧レシートを、台帳へ移します (1回だけ)。"""
+    if not state_store.read_key(state_key): return
+    with state_store.state_write_lock():
+        legacy = state_store.read_key(state_key)
+        if not legacy: return
+        conn = _connect()
+        try:
+            with conn:
+                for receipt in legacy: _insert_receipt(conn, receipt)
+        finally:
+            conn.close()
+        state_store.delete_key(state_key)
+
+
+# ---------------------------------------------------------------
+# 読み込み (集計は保存済みの値を読むだけです)
+# ---------------------------------------------------------------
+def list_months():
+    """記録のある月を、新しい順に返します。"""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT month, receipt_count, total_amount FROM okozukai_months ORDER BY month DESC").fetchall()
+    finally:
+        conn.close()
+    return [{"month": m, "receipt_count": c, "total_amount": t} for m, c, t in rows]
+
+
+def month_summary(month):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT receipt_count, total_amount FROM okozukai_months WHERE month = ?", (month,)).fetchone()
+    finally:
+        conn.close()
+    count, total = row if row else (0, 0.0)
+    return {"month": month, "receipt_count": count, "total_amount": total}
+
+
+def top_items(month, limit=10):
+    conn = _connect()
+    try:
+        rows = conn.execute("""SELECT name, quantity, total_price FROM okozukai_item_totals
+                               WHERE month = ? ORDER BY total_price DESC LIMIT ?""", (month, limit)).fetchall()
+    finally:
+        conn.close()
+    return [{"name": n, "quantity": q, "total_price": p} for n, q, p in rows]
+
+
+def receipt_count():
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT COALESCE(SUM(receipt_count), 0) FROM okozukai_months").fetchone()
+    finally:
+        conn.close()
+    return row[0]
+
+
+def _row_to_receipt(row):
+    receipt_id, date_str, total, items_raw = row
+    try: items = json.loads(items_raw)
+    except json.JSONDecodeError: items = []
+    return {"id": receipt_id, "date": date_str, "total_amount": total, "items": items}
+
+
+def fetch_page(month, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """指定した月のレシートを、新しい順に1ページ分だけ返します。"""
+    offset = max(page - 1, 0) * page_size
+    conn = _connect()
+    try:
+        rows = conn.execute("""SELECT id, date, total_amount, items FROM okozukai_receipts
+                               WHERE month = ? ORDER BY id DESC LIMIT ? OFFSET ?""", (month, page_size, offset)).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_receipt(row) for row in rows]
+
+
+def iter_receipts(batch_size=500):
+    """全レシートを古い順に、batch_size 件ずつ読み出しながら1件ずつ返します。"""
+    last_id = 0
+    while True:
+        conn = _connect()
+        try:
+            rows = conn.execute("""SELECT id, date, total_amount, items FROM okozukai_receipts
+                                   WHERE id > ? ORDER BY id LIMIT ?""", (last_id, batch_size)).fetchall()
+        finally:
+            conn.close()
+        if not rows: return
+        for row in rows: yield _row_to_receipt(row)
+        last_id = rows[-1][0]
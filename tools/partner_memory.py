@@ -0,0 +1,192 @@
+# ===============================================================
+# ★★★ partner_memory.py ＜AIパートナーの、長く続く記憶＞ ★★★
+# ===============================================================
+# 認知予防ツールの会話を、ユーザーごと(APIキーのハッシュごと)にSQLiteへ残します。
+# - 毎回、全履歴を送り直すことはしません
+# - 直近の数往復と、今の発言に関係のありそうな過去の話だけを、決まったトークン数の中で選んで添えます
+#   (関係の強さは、文字のN-gramによるBM25で、手元の索引から計算します)
+# - 会話がたまったら、裏側で短い「まとめ」を作り、まとめも検索の対象にします
+import hashlib
+import math
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+from tools import gemini_client, prompt_registry, state_store
+
+MEMORY_TOKEN_BUDGET = 800
+RECENT_TURNS = 2
+MAX_SNIPPETS = 6
+# まとめていない会話がこの数になったら、まとめを作ります
+SUMMARIZE_EVERY_N_TURNS = 8
+NGRAM_SIZE = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 1つの検索語で見る候補の上限 (よくある語で、全件を読まないようにします)
+MAX_POSTINGS_PER_TERM = 500
+# 一番関係の強い記憶のスコアに対して、この割合に届かないものは添えません (たまたま1語だけ重なった話など)
+MIN_RELATIVE_SCORE = 0.3
+
+SUMMARY_PROMPT = """以下は、高齢の方とAIパートナーとの会話の記録です。
+次回以降の会話で思い出せるように、ご本人について分かったこと(人物・場所・出来事・気持ち・好きなもの)を、
+日本語の短い箇条書きで、5行以内にまとめてください。推測は書かないでください。"""
+
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS partner_memory_docs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, kind TEXT NOT NULL,
+        text TEXT NOT NULL, length INTEGER NOT NULL, summarized INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS partner_memory_docs_by_user ON partner_memory_docs (user_id, kind, id)",
+    """CREATE TABLE IF NOT EXISTS partner_memory_terms (
+        user_id TEXT NOT NULL, term TEXT NOT NULL, doc_id INTEGER NOT NULL, tf INTEGER NOT NULL,
+        PRIMARY KEY (user_id, term, doc_id))""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def user_id_for(api_key):
+    """APIキーそのものは保存せず、ハッシュをユーザーの目印にします。"""
+    return hashlib.sha256(f"partner_memory:{api_key}".encode("utf-8")).hexdigest()[:24]
+
+
+# ---------------------------------------------------------------
+# 索引 (文字N-gram)
+# ---------------------------------------------------------------
+def _terms(text):
+    chars = [c for c in unicodedata.normalize("NFKC", text).lower() if c.isalnum()]
+    if len(chars) < NGRAM_SIZE: return Counter(chars)
+    return Counter("".join(chars[i:i + NGRAM_SIZE]) for i in range(len(chars) - NGRAM_SIZE + 1))
+
+
+def _add_doc(conn, user_id, kind, text, summarized=0):
+    terms = _terms(text)
+    cursor = conn.execute("INSERT INTO partner_memory_docs (user_id, kind, text, length, summarized, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                          (user_id, kind, text, sum(terms.values()), summarized, time.time()))
+    conn.executemany("INSERT INTO partner_memory_terms (user_id, term, doc_id, tf) VALUES (?, ?, ?, ?)",
+                     [(user_id, term, cursor.lastrowid, tf) for term, tf in terms.items()])
+    return cursor.lastrowid
+
+
+def _format_turn(user_text, reply_text):
+    return f"ご本人: {user_text}\nAI: {reply_text}"
+
+
+# ---------------------------------------------------------------
+# 書き込み
+# ---------------------------------------------------------------
+def remember_turn(api_key, user_text, reply_text):
+    """1往復を保存します。まとめていない会話がたまっていれば、裏側でまとめを作ります。"""
+    user_id = user_id_for(api_key)
+    conn = _connect()
+    try:
+        with conn:
+            _add_doc(conn, user_id, "turn", _format_turn(user_text, reply_text))
+            pending = conn.execute("SELECT COUNT(*) FROM partner_memory_docs WHERE user_id = ? AND kind = 'turn' AND summarized = 0", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    if pending >= SUMMARIZE_EVERY_N_TURNS:
+        with _summarizing_lock:
+            if user_id in _summarizing: return
+            _summarizing.add(user_id)
+        threading.Thread(target=_summarize, args=(api_key, user_id), daemon=True).start()
+
+
+def _summarize(api_key, user_id):
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute("SELECT id, text FROM partner_memory_docs WHERE user_id = ? AND kind = 'turn' AND summarized = 0 ORDER BY id",
+                                (user_id,)).fetchall()
+        finally:
+            conn.close()
+        if not rows: return
+        summary = gemini_client.generate(api_key, [SUMMARY_PROMPT, "\n\n".join(text for _, text in rows)]).strip()
+        if not summary: return
+        conn = _connect()
+        try:
+            with conn:
+                _add_doc(conn, user_id, "summary", summary, summarized=1)
+                conn.executemany("UPDATE partner_memory_docs SET summarized = 1 WHERE id = ?", [(doc_id,) for doc_id, _ in rows])
+        finally:
+            conn.close()
+    except Exception:
+        pass  # まとめに失敗しても、会話そのものは保存済みです。次の機会に、改めてまとめます
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard(user_id)
+
+
+def forget(api_key):
+    """このユーザーの記憶を、すべて消します。"""
+    user_id = user_id_for(api_key)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM partner_memory_terms WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM partner_memory_docs WHERE user_id = ?", (user_id,))
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------------
+# 読み出し
+# ---------------------------------------------------------------
+def _search(conn, user_id, query, exclude_ids, limit):
+    """BM25で、query に関係の強い記憶を (doc_id, スコア) の順に返します。"""
+    query_terms = _terms(query)
+    if not query_terms: return []
+    doc_count, average_length = conn.execute("SELECT COUNT(*), AVG(length) FROM partner_memory_docs WHERE user_id = ?", (user_id,)).fetchone()
+    if not doc_count: return []
+    average_length = average_length or 1
+    scores = Counter()
+    for term in query_terms:
+        postings = conn.execute("""SELECT t.doc_id, t.tf, d.length FROM partner_memory_terms t JOIN partner_memory_docs d ON d.id = t.doc_id
+                                   WHERE t.user_id = ? AND t.term = ? ORDER BY t.doc_id DESC LIMIT ?""",
+                                (user_id, term, MAX_POSTINGS_PER_TERM)).fetchall()
+        if not postings: continue
+        idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for doc_id, tf, length in postings:
+            if doc_id in exclude_ids: continue
+            scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+    ranked = scores.most_common(limit)
+    return [(doc_id, score) for doc_id, score in ranked if score >= ranked[0][1] * MIN_RELATIVE_SCORE] if ranked else []
+
+
+def build_context(api_key, query, token_budget=MEMORY_TOKEN_BUDGET):
+    """
+    今の発言に添える「記憶」の文章を返します。何も覚えていなければ空文字です。
+    直近の会話 → 関係の強い過去の話(まとめを含む) の順に、token_budget に収まる分だけを選びます。
+    """
+    user_id = user_id_for(api_key)
+    conn = _connect()
+    try:
+        recent = conn.execute("SELECT id, text FROM partner_memory_docs WHERE user_id = ? AND kind = 'turn' ORDER BY id DESC LIMIT ?",
+                              (user_id, RECENT_TURNS)).fetchall()
+        recent_ids = {doc_id for doc_id, _ in recent}
+        ranked = _search(conn, user_id, query, recent_ids, MAX_SNIPPETS)
+        related = {}
+        if ranked:
+            placeholders = ",".join("?" * len(ranked))
+            related = dict(conn.execute(f"SELECT id, text FROM partner_memory_docs WHERE id IN ({placeholders})", [doc_id for doc_id, _ in ranked]).fetchall())
+    finally:
+        conn.close()
+
+    sections, used = [], 0
+    def take(text):
+        nonlocal used
+        cost = prompt_registry.estimate_tokens(text)
+        if used + cost > token_budget: return False
+        used += cost; return True
+
+    recent_texts = [text for _, text in reversed(recent) if take(text)]
+    related_texts = [related[doc_id] for doc_id, _ in ranked if doc_id in related and take(related[doc_id])]
+    if related_texts: sections.append("## 以前のお話から (関係がありそうなもの)\n" + "\n---\n".join(related_texts))
+    if recent_texts: sections.append("## 直前の会話\n" + "\n---\n".join(recent_texts))
+    if not sections: return ""
+    return "# あなたが覚えている、この方との会話の記憶 (必要な時だけ、自然に触れてください)\n" + "\n\n".join(sections)
@@ -0,0 +1,58 @@
+# ===============================================================
+# ★★★ prompt_registry.py ＜大きな固定プロンプトの登録簿＞ ★★★
+# ===============================================================
+# 毎回、全文を送り直している大きな指示書(プロンプト)を、名前と版で登録しておきます。
+# - 呼び出し側は gemini_client.generate(..., prompt_name="…") のように名前で指定します
+# - 指示書は、会話の中身(contents)ではなく system_instruction として、毎回同じ形・同じ位置で送ります
+#   (指示書ごとにモデルを1つ作って使い回せるうえ、Gemini側の自動の入力キャッシュに乗りやすくなります)
+# - 明示的なコンテキストキャッシュ(CachedContent)は使いません。
+#   最小 32,768 トークンが必要ですが、このアプリの指示書は、どれもその数十分の一の大きさです
+# - stats() で、指示書ごとの呼び出し回数と、応答の usage_metadata に記録された
+#   「キャッシュから読まれた入力トークン数」(= 送り直さずに済んだ分の実測値) が分かります
+import hashlib
+import threading
+
+_lock = threading.Lock()
+_prompts = {}        # name -> {"text", "version", "fingerprint", "tokens"}
+_stats = {}          # name -> {"calls", "prompt_tokens", "cached_tokens"}
+
+
+def estimate_tokens(text):
+    """ざっくりとしたトークン数です (日本語は1文字≒1トークン、英数字は4文字≒1トークン)。"""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4
+
+
+def register(name, text, version="1"):
+    """指示書を登録します。同じ名前で文面か版が変わると、fingerprint も変わります (応答キャッシュの鍵に使います)。"""
+    text = text.strip()
+    fingerprint = hashlib.sha256(f"{name}\n{version}\n{text}".encode("utf-8")).hexdigest()[:16]
+    with _lock:
+        _prompts[name] = {"text": text, "version": version, "fingerprint": fingerprint, "tokens": estimate_tokens(text)}
+    return name
+
+
+def get(name):
+    with _lock:
+        return _prompts[name]
+
+
+def record_call(name, usage_metadata=None):
+    """1回の呼び出しを記録します。usage_metadata は応答に付いてくるものをそのまま渡します (なければ回数だけ数えます)。"""
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+    with _lock:
+        counts = _stats.setdefault(name, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        counts["calls"] += 1
+        counts["prompt_tokens"] += prompt_tokens
+        counts["cached_tokens"] += cached_tokens
+
+
+def stats():
+    """指示書ごとの {"version", "tokens", "calls", "prompt_tokens", "cached_tokens"} を返します。"""
+    with _lock:
+        return {
+            name: {"version": prompt["version"], "tokens": prompt["tokens"],
+                   **_stats.get(name, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0})}
+            for name, prompt in _prompts.items()
+        }
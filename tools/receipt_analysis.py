@@ -0,0 +1,51 @@
+# ===============================================================
+# ★★★ receipt_analysis.py ＜お小遣い管理: レシート画像の解析＞ ★★★
+# ===============================================================
+# レシート画像1枚を、下ごしらえ(receipt_image)してから、Geminiで合計金額と購入品リストに読み解きます。
+# 画面(app.py)とは分けてあるので、別スレッドやベンチマークからも、同じ指示書・同じスキーマで呼べます。
+import io
+
+from PIL import Image
+
+from tools import prompt_registry, receipt_image, structured_output
+
+OKOZUKAI_PROMPT = """あなたは、レシートの画像を直接解析する、超優秀な経理アシスタントAIです。
+# 指示
+レシートの画像の中から、以下の情報を注意深く、正確に抽出してください。
+1.  **合計金額 (total_amount)**: 支払いの総額。**特に「合計」の金額に注意してください。正確に抽出すべき情報は、「合計」の金額です。**
+2.  **購入品リスト (items)**: 購入した「品物名(name)」と「その単価(price)」のリスト。
+# 出力形式
+*   抽出した結果を、必ず以下のJSON形式で出力してください。
+*   数値は、数字のみを抽出してください（円やカンマは不要）。
+*   値が見つからない場合は、数値項目は "0"、リスト項目は空のリスト `[]` としてください。
+*   「小計」「お預り」「お釣り」「店名」「合計」といった単語そのものは、購入品リストに含めないでください。
+*   JSON以外の、前置きや説明は、絶対に出力しないでください。
+{
+  "total_amount": "ここに合計金額の数値",
+  "items": [
+    { "name": "ここに品物名1", "price": "ここに単価1" },
+    { "name": "ここに品物名2", "price": "ここに単価2" }
+  ]
+}
+"""
+OKOZUKAI_PROMPT_NAME = prompt_registry.register("okozukai.receipt", OKOZUKAI_PROMPT)
+
+RECEIPT_SCHEMA = structured_output.object_schema({
+    "total_amount": {"type": "NUMBER"},
+    "items": {"type": "ARRAY", "items": structured_output.object_schema({"name": {"type": "STRING"}, "price": {"type": "NUMBER"}})},
+})
+
+
+def analyze_receipt_image(api_key, image_bytes, preprocess=True):
+    """
+    レシート画像を1枚解析し、(抽出結果, 画像の統計) を返します。別スレッドから呼ぶため、stの命令は使いません。
+    preprocess=False なら、下ごしらえをせずに元の画像をそのまま送ります (前後比較のベンチマーク用です。統計は None です)。
+    """
+    if not preprocess:
+        mime_type = Image.MIME.get(Image.open(io.BytesIO(image_bytes)).format, "image/jpeg")
+        return structured_output.generate_json(api_key, [{"mime_type": mime_type, "data": image_bytes}],
+                                               schema=RECEIPT_SCHEMA, prompt_name=OKOZUKAI_PROMPT_NAME), None
+    # 送信前に、向き補正・切り抜き・グレースケール化・縮小をして、送るバイト数を減らします
+    receipt_jpeg, receipt_stats = receipt_image.preprocess_receipt_image(image_bytes)
+    extracted_data = structured_output.generate_json(api_key, [receipt_image.to_image_part(receipt_jpeg)], schema=RECEIPT_SCHEMA, prompt_name=OKOZUKAI_PROMPT_NAME)
+    return extracted_data, receipt_stats
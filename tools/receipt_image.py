@@ -0,0 +1,133 @@
+# ===============================================================
+# ★★★ receipt_image.py ＜レシート画像の下ごしらえ＞ ★★★
+# ===============================================================
+# スマホで撮ったままの写真は数MBあり、モバイル回線では送信そのものが一番の待ち時間になります。
+# AIに渡す前に、以下の順で、文字が読める範囲まで小さくします。
+#   1. EXIFの向き情報どおりに回転
+#   2. 白いレシート部分だけを自動で切り抜き
+#   3. グレースケール化
+#   4. 長辺を TARGET_LONG_EDGE ピクセルまで縮小
+#   5. JPEG_QUALITY で再エンコード
+import hashlib
+import io
+
+from PIL import Image, ImageFilter, ImageOps
+
+TARGET_LONG_EDGE = 1600
+JPEG_QUALITY = 80
+
+# 切り抜き判定は、この大きさまで縮めた画像で行います (速さのため)
+_ANALYSIS_LONG_EDGE = 400
+# 切り抜き結果がこれより小さい場合は、誤検出とみなして切り抜きません
+_MIN_CROP_AREA_RATIO = 0.15
+_CROP_MARGIN_RATIO = 0.02
+
+
+def _otsu_threshold(gray_image):
+    """大津の二値化で、紙(明るい)と背景(暗い)の境目になる明るさを求めます。"""
+    histogram = gray_image.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg, weight_bg, best_threshold, best_variance = 0.0, 0, 0, 0.0
+    for level, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0: continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0: break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_variance, best_threshold = variance, level
+    return best_threshold
+
+
+def find_receipt_bbox(gray_image):
+    """レシート(明るい紙)の範囲を (left, top, right, bottom) で返します。見つからなければ None です。"""
+    small = gray_image.copy()
+    small.thumbnail((_ANALYSIS_LONG_EDGE, _ANALYSIS_LONG_EDGE))
+    small = small.filter(ImageFilter.MedianFilter(5))
+    threshold = _otsu_threshold(small)
+    mask = small.point(lambda v: 255 if v > threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox: return None
+    scale_x = gray_image.width / small.width
+    scale_y = gray_image.height / small.height
+    left, top, right, bottom = bbox
+    margin_x = gray_image.width * _CROP_MARGIN_RATIO
+    margin_y = gray_image.height * _CROP_MARGIN_RATIO
+    box = (max(int(left * scale_x - margin_x), 0), max(int(top * scale_y - margin_y), 0),
+           min(int(right * scale_x + margin_x), gray_image.width), min(int(bottom * scale_y + margin_y), gray_image.height))
+    area_ratio = ((box[2] - box[0]) * (box[3] - box[1])) / float(gray_image.width * gray_image.height)
+    if area_ratio < _MIN_CROP_AREA_RATIO: return None
+    return box
+
+
+def preprocess_receipt_image(image_source, long_edge=TARGET_LONG_EDGE, quality=JPEG_QUALITY, grayscale=True, autocrop=True):
+    """
+    レシート画像を下ごしらえし、(JPEGのバイト列, 統計情報の辞書) を返します。
+    image_source には、ファイルパス、バイト列、st.file_uploader のファイルのどれでも渡せます。
+    """
+    if isinstance(image_source, (bytes, bytearray)):
+        original_bytes = len(image_source)
+        image_source = io.BytesIO(image_source)
+    else:
+        original_bytes = getattr(image_source, "size", None)
+    image = Image.open(image_source)
+    original_size = image.size
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"): image = image.convert("RGB")
+
+    gray = image.convert("L")
+    bbox = find_receipt_bbox(gray) if autocrop else None
+    image = gray if grayscale else image
+    if bbox: image = image.crop(bbox)
+    if max(image.size) > long_edge:
+        image.thumbnail((long_edge, long_edge), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    jpeg_bytes = output.getvalue()
+    stats = {
+        "original_bytes": original_bytes,
+        "processed_bytes": len(jpeg_bytes),
+        "original_size": original_size,
+        "processed_size": image.size,
+        "cropped": bbox is not None,
+        "dhash": difference_hash(image),
+    }
+    return jpeg_bytes, stats
+
+
+def to_image_part(jpeg_bytes):
+    """generate_content にそのまま渡せる形にします。"""
+    return {"mime_type": "image/jpeg", "data": jpeg_bytes}
+
+
+# ---------------------------------------------------------------
+# 重複チェック用のハッシュ
+# ---------------------------------------------------------------
+def content_hash(data):
+    """ファイルの中身そのもののハッシュです。同じファイルなら必ず一致します。"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def difference_hash(image, hash_size=8):
+    """
+    知覚ハッシュ(dHash)を64ビットの整数で返します。
+    撮り直しや縮小・再圧縮をしても、同じレシートならビットの違いが小さくなります。
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count("1")
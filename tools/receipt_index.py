@@ -0,0 +1,84 @@
+# ===============================================================
+# ★★★ receipt_index.py ＜解析済みレシート画像の索引＞ ★★★
+# ===============================================================
+# 一度解析したレシート画像を、2種類のハッシュで覚えておきます。
+# - content_hash: ファイルの中身が完全に同じなら一致 → 保存済みの解析結果をそのまま返し、AIは呼びません
+# - dhash: 撮り直した同じレシートでも近い値になる → 確定済みのものと近ければ、確定前に注意を出します
+import json
+from datetime import datetime
+
+from tools import state_store
+from tools.receipt_image import hamming_distance
+
+# dHash(64ビット)のうち、この数以下のビットしか違わなければ「ほぼ同じ画像」とみなします
+NEAR_DUPLICATE_MAX_DISTANCE = 6
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS receipt_image_index (
+        content_hash TEXT PRIMARY KEY, dhash TEXT NOT NULL, extraction TEXT NOT NULL,
+        confirmed_at TEXT, created_at TEXT NOT NULL)""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def lookup_exact(content_hash):
+    """完全に同じ画像の記録を {"extraction", "confirmed_at"} で返します。なければ None です。"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT extraction, confirmed_at FROM receipt_image_index WHERE content_hash = ?", (content_hash,)).fetchone()
+    finally:
+        conn.close()
+    if row is None: return None
+    try: extraction = json.loads(row[0])
+    except json.JSONDecodeError: return None
+    return {"extraction": extraction, "confirmed_at": row[1]}
+
+
+def find_near_duplicate(dhash, exclude_content_hash=None, max_distance=NEAR_DUPLICATE_MAX_DISTANCE):
+    """確定済みのレシートの中で、最も近い画像を {"confirmed_at", "distance"} で返します。なければ None です。"""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT content_hash, dhash, confirmed_at FROM receipt_image_index WHERE confirmed_at IS NOT NULL").fetchall()
+    finally:
+        conn.close()
+    best = None
+    for content_hash, dhash_hex, confirmed_at in rows:
+        if content_hash == exclude_content_hash: continue
+        distance = hamming_distance(dhash, int(dhash_hex, 16))
+        if distance <= max_distance and (best is None or distance < best["distance"]):
+            best = {"confirmed_at": confirmed_at, "distance": distance}
+    return best
+
+
+def remember(content_hash, dhash, extraction):
+    """AIの解析結果を、画像のハッシュと一緒に保存します。"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("""INSERT INTO receipt_image_index (content_hash, dhash, extraction, created_at) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(content_hash) DO UPDATE SET dhash = excluded.dhash, extraction = excluded.extraction""",
+                         (content_hash, f"{dhash:016x}", json.dumps(extraction, ensure_ascii=False), datetime.now().strftime('%Y-%m-%d %H:%M')))
+    finally:
+        conn.close()
+
+
+def mark_confirmed(content_hash):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("UPDATE receipt_image_index SET confirmed_at = ? WHERE content_hash = ?", (datetime.now().strftime('%Y-%m-%d %H:%M'), content_hash))
+    finally:
+        conn.close()
+
+
+def clear_confirmations():
+    """支出履歴をリセットしたときに呼びます。解析結果は残し、確定済みの印だけを外します。"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("UPDATE receipt_image_index SET confirmed_at = NULL")
+    finally:
+        conn.close()
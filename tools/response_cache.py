@@ -0,0 +1,167 @@
+# ===============================================================
+# ★★★ response_cache.py ＜AI応答の共有キャッシュ＞ ★★★
+# ===============================================================
+# 同じ入力を、何度もGeminiに送らないためのキャッシュです。
+# - キーは (モデル名, プロンプトの版, スキーマ, 正規化した入力) のハッシュです
+#   (前後の空白や全角・半角の違いは、同じ入力として扱います)
+# - 中身はSQLiteに保存するので、再起動しても、別のセッションからでも使えます
+# - 古くなったもの(TTL)は読まずに捨て、合計サイズが上限を超えたら、最も長く使われていないものから消します
+# - 使うかどうかは、呼び出しごとに選びます (structured_output.generate_json の cache_namespace)
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+
+from tools import state_store
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+MAX_CACHE_BYTES = 20 * 1024 * 1024
+# 上限を超えたときは、ここまで減らします (毎回の書き込みで消さずに済むように、少し余裕を持たせます)
+EVICT_TO_RATIO = 0.8
+
+_stats_lock = threading.Lock()
+_session_stats = {}  # namespace -> {"hits", "misses"} (このプロセスが起動してからの分)
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS llm_response_cache (
+        cache_key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL,
+        created_at REAL NOT NULL, last_used_at REAL NOT NULL, expires_at REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS llm_response_cache_lru ON llm_response_cache (last_used_at)",
+    """CREATE TABLE IF NOT EXISTS llm_response_cache_stats (
+        namespace TEXT PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL)""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+# ---------------------------------------------------------------
+# キーの作成
+# ---------------------------------------------------------------
+def normalize_text(text):
+    """全角・半角をそろえ、連続する空白を1つにまとめます。"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def _normalize_part(part):
+    if isinstance(part, str): return normalize_text(part)
+    if isinstance(part, (bytes, bytearray)): return {"sha256": hashlib.sha256(part).hexdigest()}
+    if isinstance(part, dict):
+        data = part.get("data")
+        if isinstance(data, (bytes, bytearray)):
+            return {"mime_type": part.get("mime_type"), "sha256": hashlib.sha256(data).hexdigest()}
+        return {k: _normalize_part(v) for k, v in sorted(part.items())}
+    if isinstance(part, (list, tuple)): return [_normalize_part(p) for p in part]
+    return part
+
+
+def make_key(model_name, prompt_version, contents, schema=None, system_instruction=None):
+    payload = {
+        "model": model_name, "prompt_version": prompt_version, "schema": schema,
+        "system_instruction": _normalize_part(system_instruction) if system_instruction else None,
+        "contents": _normalize_part(contents),
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------
+# 読み書き
+# ---------------------------------------------------------------
+def _count(conn, namespace, hit):
+    with _stats_lock:
+        counts = _session_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counts["hits" if hit else "misses"] += 1
+    conn.execute("""INSERT INTO llm_response_cache_stats (namespace, hits, misses) VALUES (?, ?, ?)
+                    ON CONFLICT(namespace) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses""",
+                 (namespace, 1 if hit else 0, 0 if hit else 1))
+
+
+def get(cache_key, namespace):
+    """保存済みの値(JSONとして読める値)を返します。なければ None です。"""
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            row = conn.execute("SELECT value, expires_at FROM llm_response_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is not None and row[1] <= now:
+                conn.execute("DELETE FROM llm_response_cache WHERE cache_key = ?", (cache_key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE llm_response_cache SET last_used_at = ? WHERE cache_key = ?", (now, cache_key))
+            _count(conn, namespace, hit=row is not None)
+    finally:
+        conn.close()
+    if row is None: return None
+    try: return json.loads(row[0])
+    except json.JSONDecodeError: return None
+
+
+def put(cache_key, namespace, value, ttl_seconds=DEFAULT_TTL_SECONDS):
+    raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("""INSERT OR REPLACE INTO llm_response_cache
+                            (cache_key, namespace, value, size, created_at, last_used_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         (cache_key, namespace, raw, len(raw.encode("utf-8")), now, now, now + ttl_seconds))
+            _evict(conn, now)
+    finally:
+        conn.close()
+
+
+def _evict(conn, now):
+    conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_response_cache").fetchone()[0]
+    if total <= MAX_CACHE_BYTES: return
+    target = MAX_CACHE_BYTES * EVICT_TO_RATIO
+    doomed = []
+    for cache_key, size in conn.execute("SELECT cache_key, size FROM llm_response_cache ORDER BY last_used_at"):
+        if total <= target: break
+        doomed.append((cache_key,)); total -= size
+    conn.executemany("DELETE FROM llm_response_cache WHERE cache_key = ?", doomed)
+
+
+def get_or_compute(cache_key, namespace, compute, ttl_seconds=DEFAULT_TTL_SECONDS):
+    """保存済みならそれを、なければ compute() の結果を保存して返します。"""
+    value = get(cache_key, namespace)
+    if value is not None: return value
+    value = compute()
+    put(cache_key, namespace, value, ttl_seconds)
+    return value
+
+
+# ---------------------------------------------------------------
+# 統計
+# ---------------------------------------------------------------
+def stats():
+    """
+    namespace ごとの {"hits", "misses", "entries", "bytes", "session_hits", "session_misses"} を返します。
+    hits / misses は起動をまたいだ累計、session_ は、このプロセスが起動してからの分です。
+    """
+    conn = _connect()
+    try:
+        totals = {ns: {"hits": h, "misses": m} for ns, h, m in conn.execute("SELECT namespace, hits, misses FROM llm_response_cache_stats")}
+        for ns, entries, size in conn.execute("SELECT namespace, COUNT(*), SUM(size) FROM llm_response_cache GROUP BY namespace"):
+            totals.setdefault(ns, {"hits": 0, "misses": 0}).update(entries=entries, bytes=size)
+    finally:
+        conn.close()
+    with _stats_lock:
+        for ns, counts in _session_stats.items():
+            totals.setdefault(ns, {"hits": 0, "misses": 0}).update(session_hits=counts["hits"], session_misses=counts["misses"])
+    for counts in totals.values():
+        for field in ("entries", "bytes", "session_hits", "session_misses"): counts.setdefault(field, 0)
+    return totals
+
+
+def clear(namespace=None):
+    conn = _connect()
+    try:
+        with conn:
+            if namespace is None: conn.execute("DELETE FROM llm_response_cache")
+            else: conn.execute("DELETE FROM llm_response_cache WHERE namespace = ?", (namespace,))
+    finally:
+        conn.close()
@@ -0,0 +1,92 @@
+# ===============================================================
+# ★★★ session_history.py ＜上限付きの会話・翻訳履歴＞ ★★★
+# ===============================================================
+# 画面に出す履歴は、新しいものから RECENT_LIMIT 件だけをメモリ(deque)に持ちます。
+# あふれた古い履歴はSQLiteへ移し、ユーザーが開いた時に、1ページ分ずつ読み出します。
+# 長く使い続けても、セッションのメモリと、再実行ごとの描画の量は一定のままです。
+import json
+import time
+import uuid
+from collections import deque
+
+from tools import state_store
+
+RECENT_LIMIT = 10
+DEFAULT_PAGE_SIZE = 10
+# 移した履歴は、この日数が過ぎたら消します (セッションが終われば、もう読まれないため)
+SPILL_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS session_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, history_id TEXT NOT NULL,
+        record TEXT NOT NULL, created_at REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS session_history_by_id ON session_history (history_id, id)",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def ensure(session_state, prefix, maxlen=RECENT_LIMIT):
+    """
+    セッションに、履歴のバッファ(f"{prefix}results")と、移し先の識別子(f"{prefix}history_id")を用意します。
+    以前のリスト形式の履歴が残っていれば、新しいものから maxlen 件をバッファへ移し、残りは保存します。
+    """
+    results_key, id_key = f"{prefix}results", f"{prefix}history_id"
+    if id_key not in session_state: session_state[id_key] = f"{prefix}{uuid.uuid4().hex}"
+    current = session_state.get(results_key)
+    if not isinstance(current, deque):
+        records = list(current or [])
+        session_state[results_key] = deque(records[:maxlen], maxlen=maxlen)
+        if records[maxlen:]: _spill(session_state[id_key], records[maxlen:])
+    return session_state[results_key]
+
+
+def push(session_state, prefix, record):
+    """最新の履歴を先頭に加えます。あふれた一番古い1件は、保存先へ移します。"""
+    buffer = session_state[f"{prefix}results"]
+    if len(buffer) == buffer.maxlen: _spill(session_state[f"{prefix}history_id"], [buffer[-1]])
+    buffer.appendleft(record)
+
+
+def _spill(history_id, records):
+    """records は新しい順です。保存先でも、id の大きい方が新しくなるように、古い順に書き込みます。"""
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany("INSERT INTO session_history (history_id, record, created_at) VALUES (?, ?, ?)",
+                             [(history_id, json.dumps(r, ensure_ascii=False, separators=(",", ":")), now) for r in reversed(records)])
+            conn.execute("DELETE FROM session_history WHERE created_at < ?", (now - SPILL_RETENTION_SECONDS,))
+    finally:
+        conn.close()
+
+
+def spilled_count(session_state, prefix):
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM session_history WHERE history_id = ?", (session_state[f"{prefix}history_id"],)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def fetch_spilled(session_state, prefix, page, page_size=DEFAULT_PAGE_SIZE):
+    """移した古い履歴のうち、page ページ目(0始まり・新しい順)だけを返します。"""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT record FROM session_history WHERE history_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                            (session_state[f"{prefix}history_id"], page_size, page * page_size)).fetchall()
+    finally:
+        conn.close()
+    return [json.loads(row[0]) for row in rows]
+
+
+def clear(session_state, prefix):
+    session_state[f"{prefix}results"].clear()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM session_history WHERE history_id = ?", (session_state[f"{prefix}history_id"],))
+    finally:
+        conn.close()
@@ -0,0 +1,291 @@
+# ===============================================================
+# ★★★ state_store.py ＜プロセス共有キャッシュ付き・永続化エンジン＞ ★★★
+# ===============================================================
+# app.py と各ツールは、必ずこのモジュール経由で状態を読み書きします。
+# - 解析済みの状態は、プロセスに1つだけキャッシュされ、全セッションで共有されます
+# - 他のプロセスが書き込むと、ファイルのmtimeと version の変化を検知して読み直します
+# - 書き込みは、スレッドロック＋アドバイザリロック(flock)で1つずつ直列化されます
+# - 読んで、変えて、書く処理は update_app_state でまとめて行うと、更新が失われません
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windowsなど。プロセス内のロックだけで直列化します
+    fcntl = None
+
+# 以前の multitool_state.json は、初回起動時に自動で取り込みます
+DB_FILE = Path("multitool_state.db")
+LEGACY_STATE_FILE = Path("multitool_state.json")
+LOCK_FILE = Path("multitool_state.lock")
+
+# この回数だけ書き込むごとに、裏側でジャーナル(WAL)を圧縮します
+COMPACT_EVERY_N_WRITES = 50
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+_applied_schemas = set()           # このプロセスで実行済みの、各ツールのテーブル定義
+
+_write_lock = threading.RLock()    # プロセス内の書き込みを直列化
+_lock_depth = threading.local()    # state_write_lock の入れ子の深さ
+_cache_lock = threading.RLock()    # キャッシュの入れ替えを保護
+_cache = {}                        # key -> 解析済みの値 (読み取り専用として扱うこと)
+_cache_raw = {}                    # key -> JSON文字列 (差分検出用)
+_cache_version = None
+_cache_stamp = None                # (DBのmtime, WALのmtime, WALのサイズ)
+
+_write_count = 0
+_compacting = False
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_connection():
+    """WALモードのSQLite接続を返します。呼び出し側で close してください。"""
+    conn = sqlite3.connect(DB_FILE, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _ensure_schema(conn)
+    return conn
+
+
+def connect(ddl):
+    """
+    get_connection() と同じ接続を返します。
+    ddl (CREATE TABLE IF NOT EXISTS などの文のタプル) は、プロセスで最初の1回だけ実行します。
+    """
+    conn = get_connection()
+    if ddl in _applied_schemas: return conn
+    with _schema_lock:
+        if ddl not in _applied_schemas:
+            with conn:
+                for statement in ddl: conn.execute(statement)
+            _applied_schemas.add(ddl)
+    return conn
+
+
+def _ensure_schema(conn):
+    global _schema_ready
+    if _schema_ready: return
+    with _schema_lock:
+        if _schema_ready: return
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+            imported = conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone()
+            if not imported:
+                _import_legacy_json(conn)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', '1')")
+        _schema_ready = True
+
+
+def _import_legacy_json(conn):
+    """旧JSONファイルの中身を、キーごとの行として取り込みます。"""
+    if not LEGACY_STATE_FILE.exists(): return
+    try:
+        with LEGACY_STATE_FILE.open("r", encoding="utf-8") as f:
+            legacy = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return
+    if isinstance(legacy, dict):
+        conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", [(k, _encode(v)) for k, v in legacy.items()])
+
+
+@contextmanager
+def state_write_lock():
+    """
+    プロセス内(スレッド)とプロセス間(flock)の両方で、書き込みを1つずつにします。
+    同じスレッドの中では入れ子にできます (flockは一番外側でだけ取ります)。
+    """
+    with _write_lock:
+        depth = getattr(_lock_depth, "value", 0)
+        if fcntl is None or depth > 0:
+            _lock_depth.value = depth + 1
+            try: yield
+            finally: _lock_depth.value = depth
+            return
+        with LOCK_FILE.open("a") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            _lock_depth.value = 1
+            try: yield
+            finally:
+                _lock_depth.value = 0
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+
+# ---------------------------------------------------------------
+# キャッシュの検証と読み直し
+# ---------------------------------------------------------------
+def _file_stamp():
+    stamp = []
+    for path in (DB_FILE, Path(f"{DB_FILE}-wal")):
+        try:
+            st_ = os.stat(path)
+            stamp.append((st_.st_mtime_ns, st_.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _read_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _refresh_cache(force=False):
+    """ファイルが変わっていなければ何もしません。変わっていれば version を確かめて読み直します。"""
+    global _cache, _cache_raw, _cache_version, _cache_stamp
+    stamp = _file_stamp()
+    with _cache_lock:
+        if not force and _cache_version is not None and stamp == _cache_stamp: return
+        conn = get_connection()
+        try:
+            version = _read_version(conn)
+            if force or version != _cache_version:
+                rows = conn.execute("SELECT key, value FROM kv").fetchall()
+                cache, cache_raw = {}, {}
+                for key, raw in rows:
+                    try: cache[key] = json.loads(raw)
+                    except json.JSONDecodeError: continue
+                    cache_raw[key] = raw
+                _cache, _cache_raw = cache, cache_raw
+                _cache_version = version
+        finally:
+            conn.close()
+        _cache_stamp = stamp
+
+
+# ---------------------------------------------------------------
+# 読み込み
+# ---------------------------------------------------------------
+def read_app_state():
+    """
+    全キーを辞書として返します (従来の read_app_state と同じ形)。
+    辞書そのものはコピーですが、中のリストなどはキャッシュと共有しています。
+    値を書き換えるときは、その場で変更せず、新しい値を代入して保存してください。
+    """
+    _refresh_cache()
+    with _cache_lock:
+        return dict(_cache)
+
+
+def read_key(key, default=None):
+    """1つのキーだけを返します。ファイル全体は解析しません。"""
+    _refresh_cache()
+    with _cache_lock:
+        return _cache.get(key, default)
+
+
+# ---------------------------------------------------------------
+# 書き込み (変更されたキーの行だけを書き換えます)
+# ---------------------------------------------------------------
+def _commit(changed, deleted=()):
+    """ロックを取った状態で呼びます。DBへ書き込み、version を進め、キャッシュにも反映します。"""
+    global _cache, _cache_raw, _cache_version, _cache_stamp
+    if not changed and not deleted: return
+    conn = get_connection()
+    try:
+        with conn:
+            if changed:
+                conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", [(k, raw) for k, raw, _ in changed])
+            if deleted:
+                conn.executemany("DELETE FROM kv WHERE key = ?", [(k,) for k in deleted])
+            conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+            version = _read_version(conn)
+    finally:
+        conn.close()
+    with _cache_lock:
+        cache, cache_raw = dict(_cache), dict(_cache_raw)
+        for key, raw, value in changed:
+            cache[key] = value; cache_raw[key] = raw
+        for key in deleted:
+            cache.pop(key, None); cache_raw.pop(key, None)
+        _cache, _cache_raw = cache, cache_raw
+        _cache_version = version
+        _cache_stamp = None  # 次の読み込みで version だけ確かめ直します
+    _after_write()
+
+
+def _diff(data, keys):
+    target_keys = list(keys) if keys is not None else list(data.keys())
+    changed = []
+    for key in target_keys:
+        if key not in data: continue
+        raw = _encode(data[key])
+        if _cache_raw.get(key) != raw:
+            changed.append((key, raw, data[key]))
+    return changed
+
+
+def write_app_state(data, keys=None):
+    """
+    変更のあったキーだけを保存します。
+    keys を渡すと、そのキーだけを書き込みます (大きな値の再シリアライズを避けられます)。
+    他のセッションの変更を上書きしたくない場合は update_app_state を使ってください。
+    """
+    with state_write_lock():
+        _refresh_cache()
+        _commit(_diff(data, keys))
+
+
+def update_app_state(mutator, keys=None):
+    """
+    最新の状態を読み、mutator(state) で書き換え、差分を保存するまでを、ロックの中で一気に行います。
+    mutator には状態のコピーが渡されます。リストなどは、その場で変更せず新しい値を代入してください。
+    書き込み後の状態を返します。
+    """
+    with state_write_lock():
+        _refresh_cache()
+        with _cache_lock:
+            working = dict(_cache)
+        mutator(working)
+        _commit(_diff(working, keys))
+        return working
+
+
+def write_key(key, value):
+    write_app_state({key: value}, keys=[key])
+
+
+def increment_key(key, delta=1, default=0):
+    """数値のキーを、他のセッションと競合せずに増減させます。増減後の値を返します。"""
+    def _increment(state):
+        state[key] = state.get(key, default) + delta
+    return update_app_state(_increment, keys=[key])[key]
+
+
+def delete_key(key):
+    with state_write_lock():
+        _refresh_cache()
+        _commit([], deleted=[key])
+
+
+# ---------------------------------------------------------------
+# 裏側での圧縮 (WALのチェックポイント)
+# ---------------------------------------------------------------
+def _after_write():
+    global _write_count, _compacting
+    with _cache_lock:
+        _write_count += 1
+        if _write_count % COMPACT_EVERY_N_WRITES != 0 or _compacting: return
+        _compacting = True
+    threading.Thread(target=_compact, daemon=True).start()
+
+
+def _compact():
+    global _compacting
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        try: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally: conn.close()
+    except sqlite3.Error:
+        pass
+    finally:
+        _compacting = False
@@ -0,0 +1,118 @@
+# ===============================================================
+# ★★★ structured_output.py ＜JSON応答の共通窓口＞ ★★★
+# ===============================================================
+# AIにJSONで答えてもらうツールは、すべて generate_json() を使います。
+# - ツールごとに応答のスキーマを宣言し、GeminiのJSONモードで返してもらいます
+# - 返ってきたテキストは、1つの頑丈な抽出関数 parse_json_response() で読みます
+#   (```json の囲み、前置きの文章、末尾の余計なカンマ などがあっても読めます)
+# - それでも読めない場合は、テキストだけの安い呼び出しで「JSONに直して」と頼み、
+#   何秒も何分もかかった元の呼び出しを、ユーザーにやり直させることはしません
+# - cache_namespace を渡した呼び出しは、読めたJSONを response_cache に保存し、同じ入力では再利用します
+import json
+import re
+
+from tools import gemini_client, prompt_registry, response_cache
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_OPEN_FENCE_PATTERN = re.compile(r"^```(?:json|JSON)?")
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+
+REPAIR_PROMPT = """次のテキストは、本来JSONであるべきAIの応答ですが、JSONとして読み込めませんでした。
+内容を一切変えずに、正しいJSONだけを出力してください。前置きや説明は不要です。"""
+
+
+class StructuredOutputError(ValueError):
+    """JSONとして読めなかった応答です。raw_text に元のテキストが入っています。"""
+
+    def __init__(self, message, raw_text):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+def _candidates(text):
+    yield text
+    for match in _FENCE_PATTERN.finditer(text):
+        yield match.group(1)
+    # 囲みが閉じられていない場合も、開き側だけ取り除いて試します
+    # (lstrip("```json") は「文字」を取り除くため、接頭辞の除去には正規表現を使います)
+    if text.lstrip().startswith("```"):
+        yield _OPEN_FENCE_PATTERN.sub("", text.lstrip(), count=1)
+
+
+def _raw_decode_anywhere(text):
+    """テキスト中の最初の { か [ から、読めるところまでをJSONとして読みます。"""
+    decoder = json.JSONDecoder()
+    for index, char in enumerate(text):
+        if char not in "{[": continue
+        try:
+            value, _ = decoder.raw_decode(text, index)
+            return value
+        except json.JSONDecodeError:
+            continue
+    raise json.JSONDecodeError("JSONが見つかりません", text, 0)
+
+
+def parse_json_response(text):
+    """AIの応答テキストからJSONを取り出します。読めなければ StructuredOutputError を出します。"""
+    if text is None: raise StructuredOutputError("応答が空です。", "")
+    for candidate in _candidates(text.strip()):
+        candidate = candidate.strip()
+        for attempt in (candidate, _TRAILING_COMMA_PATTERN.sub(r"\1", candidate)):
+            try: return json.loads(attempt)
+            except json.JSONDecodeError: pass
+            try: return _raw_decode_anywhere(attempt)
+            except json.JSONDecodeError: pass
+    raise StructuredOutputError("AIの応答をJSONとして読み込めませんでした。", text)
+
+
+def string_array():
+    return {"type": "ARRAY", "items": {"type": "STRING"}}
+
+
+def object_schema(properties, required=None):
+    """スキーマを短く書くための補助です。required を省略すると、全項目を必須にします。"""
+    return {"type": "OBJECT", "properties": properties, "required": list(properties) if required is None else required}
+
+
+def json_generation_config(schema=None):
+    config = {"response_mime_type": "application/json"}
+    if schema is not None: config["response_schema"] = schema
+    return config
+
+
+def generate_json(api_key, contents, schema=None, system_instruction=None, repair=True, prompt_name=None,
+                  cache_namespace=None, prompt_version=None, cache_key_contents=None,
+                  cache_ttl_seconds=response_cache.DEFAULT_TTL_SECONDS, on_model_call=None, **kwargs):
+    """
+    JSONモード(＋スキーマ)でGeminiを呼び、解析済みのJSONを返します。
+    読めなかった場合は、repair=True ならテキストだけで修復を1回だけ頼みます。
+    それでも読めなければ、元の応答を raw_text に持った StructuredOutputError を出します。
+    cache_namespace を渡すと、応答キャッシュを使います (キーには contents の代わりに cache_key_contents も使えます)。
+    prompt_name には、prompt_registry に登録した指示書の名前を渡せます。
+    on_model_call() は、キャッシュを使えず、実際にAIを呼ぶときだけ呼ばれます (利用回数を数える場合など)。
+    """
+    if prompt_name is not None: kwargs["prompt_name"] = prompt_name
+
+    def compute():
+        if on_model_call: on_model_call()
+        return _generate_json(api_key, contents, schema, system_instruction, repair, **kwargs)
+
+    if cache_namespace is None: return compute()
+    instruction_key = system_instruction if prompt_name is None else f"{prompt_name}@{prompt_registry.get(prompt_name)['fingerprint']}"
+    cache_key = response_cache.make_key(
+        kwargs.get("model_name", gemini_client.DEFAULT_MODEL), prompt_version,
+        contents if cache_key_contents is None else cache_key_contents, schema, instruction_key)
+    return response_cache.get_or_compute(cache_key, cache_namespace, compute, ttl_seconds=cache_ttl_seconds)
+
+
+def _generate_json(api_key, contents, schema, system_instruction, repair, **kwargs):
+    raw_text = gemini_client.generate(api_key, contents, system_instruction=system_instruction, generation_config=json_generation_config(schema), **kwargs)
+    try:
+        return parse_json_response(raw_text)
+    except StructuredOutputError:
+        if not repair: raise
+    try:
+        repaired_text = gemini_client.generate(api_key, [REPAIR_PROMPT, raw_text], generation_config=json_generation_config(schema))
+        return parse_json_response(repaired_text)
+    except Exception:
+        raise StructuredOutputError("AIの応答をJSONとして読み込めませんでした。", raw_text)
@@ -0,0 +1,137 @@
+# ===============================================================
+# ★★★ transcription.py ＜全ツール共通・文字起こしの窓口＞ ★★★
+# ===============================================================
+# 音声の文字起こしは、すべてのツールが、この transcribe() を通して行います。
+# - 書き起こした結果は、音声ファイルの中身のハッシュ(と書き起こし方)ごとにSQLiteへ保存します
+# - 同じ録音なら、どのツールから渡されても、2回目以降はAIを呼ばずに保存済みの結果を返します
+# - 同じ録音を同時に頼まれた場合も、AIを呼ぶのは1回だけです (残りは、その結果を待ちます)
+# - 大きなファイルは、一時ファイルから File API 経由で送ります (transcribe_spooled / media_upload)
+# - stats() で、保存済みの結果を使えた回数(hits)と、AIを呼んだ回数(misses)が分かります
+import hashlib
+import threading
+import time
+
+from tools import audio_preprocess, gemini_client, media_upload, state_store
+
+# 書き起こし方ごとの指示です。指示を変えたら、名前の末尾の版を上げてください
+STYLES = {
+    "plain@1": "この日本語の音声を、できる限り正確に、文字に書き起こしてください。書き起こした日本語テキストのみを回答してください。",
+    "speakers@1": "この日本語の音声を、話者分離（例：「スピーカーA:」「スピーカーB:」）を、意識しながら、できる限り正確に、文字に書き起こしてください。書き起こした日本語テキストのみを回答してください。",
+}
+PLAIN = "plain@1"
+SPEAKERS = "speakers@1"
+
+_inflight_lock = threading.Lock()
+_inflight = {}        # (content_hash, style) -> threading.Event
+_stats_lock = threading.Lock()
+_session_stats = {"hits": 0, "misses": 0}
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS transcripts (
+        content_hash TEXT NOT NULL, style TEXT NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL,
+        PRIMARY KEY (content_hash, style))""",
+    """CREATE TABLE IF NOT EXISTS transcript_stats (
+        name TEXT PRIMARY KEY, count INTEGER NOT NULL)""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def audio_hash(audio_bytes):
+    """音声の中身のハッシュです (下ごしらえの前の、受け取ったままのバイト列から計算します)。"""
+    return hashlib.sha256(bytes(audio_bytes)).hexdigest()
+
+
+def lookup(content_hash, style=PLAIN, count_hit=False):
+    """保存済みの書き起こしを返します。なければ None です。count_hit=True なら、見つかった時に hits を数えます。"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT text FROM transcripts WHERE content_hash = ? AND style = ?", (content_hash, style)).fetchone()
+    finally:
+        conn.close()
+    if row and count_hit: _count("hits")
+    return row[0] if row else None
+
+
+def remember(content_hash, text, style=PLAIN):
+    """ほかの方法で得た書き起こし(翻訳と同時に得たものなど)を保存して、次から使えるようにします。"""
+    if not text or not text.strip(): return
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO transcripts (content_hash, style, text, created_at) VALUES (?, ?, ?, ?)",
+                         (content_hash, style, text.strip(), time.time()))
+    finally:
+        conn.close()
+
+
+def _count(name):
+    with _stats_lock:
+        _session_stats[name] += 1
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("INSERT INTO transcript_stats (name, count) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET count = count + 1", (name,))
+    finally:
+        conn.close()
+
+
+def _transcribe_once(content_hash, style, compute):
+    """保存済みならそれを返し、なければ compute() で書き起こして保存します。同じ音声の同時の依頼は、1回にまとめます。"""
+    while True:
+        cached = lookup(content_hash, style, count_hit=True)
+        if cached is not None: return cached
+        with _inflight_lock:
+            event = _inflight.get((content_hash, style))
+            if event is None:
+                _inflight[(content_hash, style)] = threading.Event()
+                break
+        event.wait()  # 同じ録音を書き起こし中の呼び出しを待ってから、保存された結果を読み直します
+    try:
+        _count("misses")
+        text = compute()
+        remember(content_hash, text, style)
+        return text
+    finally:
+        with _inflight_lock:
+            _inflight.pop((content_hash, style)).set()
+
+
+def transcribe(api_key, audio_bytes, fallback_mime=None, style=PLAIN):
+    """
+    音声を書き起こしたテキストを返します (書き起こせなければ空文字)。
+    保存済みならそれを返し、なければ下ごしらえした音声をAIに送って、結果を保存します。
+    """
+    return _transcribe_once(audio_hash(audio_bytes), style, lambda: transcribe_uncached(api_key, audio_bytes, fallback_mime, style))
+
+
+def transcribe_spooled(api_key, spooled, style=PLAIN, on_model_call=None):
+    """
+    media_upload.spool() で一時ファイルに書き出した音声を書き起こします。大きな音声は File API 経由で送ります。
+    on_model_call() は、保存済みの結果を使えず、実際にAIを呼ぶときだけ呼ばれます (利用回数を数える場合など)。
+    """
+    def compute():
+        if on_model_call: on_model_call()
+        return gemini_client.generate(api_key, [STYLES[style], media_upload.audio_part(api_key, spooled)]).strip()
+    return _transcribe_once(spooled.content_hash, style, compute)
+
+
+def transcribe_uncached(api_key, audio_bytes, fallback_mime=None, style=PLAIN):
+    audio_part, _ = audio_preprocess.to_audio_part(audio_bytes, fallback_mime)
+    return gemini_client.generate(api_key, [STYLES[style], audio_part]).strip()
+
+
+def stats():
+    """{"hits", "misses", "session_hits", "session_misses", "stored"} を返します (hits / misses は起動をまたいだ累計)。"""
+    conn = _connect()
+    try:
+        totals = dict(conn.execute("SELECT name, count FROM transcript_stats").fetchall())
+        stored = conn.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+    finally:
+        conn.close()
+    with _stats_lock:
+        session = dict(_session_stats)
+    return {"hits": totals.get("hits", 0), "misses": totals.get("misses", 0),
+            "session_hits": session["hits"], "session_misses": session["misses"], "stored": stored}
@@ -0,0 +1,139 @@
+# ===============================================================
+# ★★★ transcription_jobs.py ＜議事録の文字起こしジョブの記録＞ ★★★
+# ===============================================================
+# Streamlit は、ボタンを押すたび(ダウンロードボタンも含む)に、画面のコードを頭から実行し直します。
+# ファイルが添付されたままだと、そのたびに文字起こしが始まってしまうため、
+# 「どのアップロードを、いつ、どこまで処理したか」を、アップロードごとにSQLiteへ記録します。
+# - ジョブの目印は、アップロードの file_id と、中身のハッシュの組み合わせです
+# - 1つのアップロードを実際に処理できるのは、claim() で権利を得た1回だけです
+# - 処理済みのジョブは、保存した結果を読み出すだけで、AIは呼びません
+# - 長い音声は、区間ごとの結果をその都度保存します (チェックポイント)。
+#   再実行や接続切れで中断しても、同じセッション(または止まったとみなされた後の別のセッション)が、
+#   終わっていない区間だけをやり直します
+import time
+
+from tools import state_store
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 「処理中」のまま、この秒数のあいだ進みのないジョブは、途中で止まったものとみなし、やり直しを認めます
+# (区間が1つ終わるたびに touch() で時刻を更新します)
+STALE_AFTER_SECONDS = 10 * 60
+# この日数を過ぎたジョブの記録は消します
+RETENTION_SECONDS = 30 * 24 * 60 * 60
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS transcription_jobs (
+        job_key TEXT PRIMARY KEY, content_hash TEXT NOT NULL, status TEXT NOT NULL,
+        transcript TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, owner TEXT)""",
+    """CREATE TABLE IF NOT EXISTS transcription_segments (
+        content_hash TEXT NOT NULL, params TEXT NOT NULL, segment_index INTEGER NOT NULL,
+        text TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (content_hash, params, segment_index))""",
+)
+
+
+def _connect():
+    return state_store.connect(_SCHEMA)
+
+
+def job_key(file_id, content_hash):
+    return f"{file_id}:{content_hash}"
+
+
+def get(key):
+    """ジョブの記録 {"status", "content_hash", "transcript", "error", "updated_at"} を返します。なければ None です。"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT status, content_hash, transcript, error, updated_at FROM transcription_jobs WHERE job_key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    if row is None: return None
+    return {"status": row[0], "content_hash": row[1], "transcript": row[2], "error": row[3], "updated_at": row[4]}
+
+
+def claim(key, content_hash, owner=None):
+    """
+    このアップロードを処理する権利を取ります。取れたら True です。
+    初めてのジョブ、失敗したジョブ、途中で止まったジョブ、同じ owner が中断したジョブだけが取れます。
+    (処理済みのものと、ほかの owner が処理中のものは取れません)
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM transcription_jobs WHERE updated_at < ?", (now - RETENTION_SECONDS,))
+            conn.execute("DELETE FROM transcription_segments WHERE created_at < ?", (now - RETENTION_SECONDS,))
+            inserted = conn.execute("""INSERT OR IGNORE INTO transcription_jobs (job_key, content_hash, status, created_at, updated_at, owner)
+                                       VALUES (?, ?, ?, ?, ?, ?)""", (key, content_hash, RUNNING, now, now, owner)).rowcount
+            if inserted: return True
+            return conn.execute("""UPDATE transcription_jobs SET status = ?, error = NULL, updated_at = ?, owner = ?
+                                   WHERE job_key = ? AND (status = ? OR (status = ? AND (updated_at < ? OR owner = ?)))""",
+                                (RUNNING, now, owner, key, FAILED, RUNNING, now - STALE_AFTER_SECONDS, owner)).rowcount > 0
+    finally:
+        conn.close()
+
+
+def touch(key):
+    """処理が進んでいることを記録します (止まったジョブとみなされないように)。"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("UPDATE transcription_jobs SET updated_at = ? WHERE job_key = ? AND status = ?", (time.time(), key, RUNNING))
+    finally:
+        conn.close()
+
+
+def finish(key, transcript):
+    _update(key, DONE, transcript=transcript)
+
+
+def fail(key, error):
+    _update(key, FAILED, error=str(error))
+
+
+def _update(key, status, transcript=None, error=None):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("UPDATE transcription_jobs SET status = ?, transcript = ?, error = ?, updated_at = ? WHERE job_key = ?",
+                         (status, transcript, error, time.time(), key))
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------------
+# 区間ごとのチェックポイント
+# ---------------------------------------------------------------
+# 区間の結果は、元の音声のハッシュと、区間の切り方(params)で保存します。
+# (区間として切り出した音声のバイト列は、変換のたびに少し変わるため、目印には使えません)
+def save_segment(content_hash, params, segment_index, text):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("""INSERT OR REPLACE INTO transcription_segments (content_hash, params, segment_index, text, created_at)
+                            VALUES (?, ?, ?, ?, ?)""", (content_hash, params, segment_index, text, time.time()))
+    finally:
+        conn.close()
+
+
+def load_segments(content_hash, params):
+    """保存済みの区間の結果を {区間番号: テキスト} で返します。"""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT segment_index, text FROM transcription_segments WHERE content_hash = ? AND params = ?",
+                            (content_hash, params)).fetchall()
+    finally:
+        conn.close()
+    return dict(rows)
+
+
+def clear_segments(content_hash, params):
+    """つなぎ終えた後の、区間ごとの結果を消します。"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM transcription_segments WHERE content_hash = ? AND params = ?", (content_hash, params))
+    finally:
+        conn.close()
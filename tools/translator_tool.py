@@ -2,25 +2,102 @@
 # ★★★ translator_tool.py ＜ちゃろさんの設計思想・完全統合版＞ ★★★
 # ===============================================================
 import streamlit as st
-import google.generativeai as genai
 import time
 import json
 from streamlit_mic_recorder import mic_recorder
 from google.api_core import exceptions
 from datetime import datetime, timezone, timedelta
+from tools import structured_output
+from tools import session_history
+from tools import audio_preprocess
+from tools import transcription
+from tools.structured_output import StructuredOutputError
+
+# --- 翻訳AIへの指示書 ---
+TRANSLATION_PROMPT = """
+# 命令書: 言語ニュアンスの、探求者としての、あなたの、責務
+あなたは、プロフェッショナルな、翻訳アシスタントです。
+あなたの、唯一の、任務は、ユーザーから、渡された、日本語を、分析し、ニュアンスの異なる、3つの、プロフェッショナルな、英訳候補を、生成し、以下の、JSON形式で、厳格に、出力することです。
+## JSON出力に関する、絶対的な、契約条件：
+あなたの回答は、必ず、以下のJSON構造に、厳密に、従うこと。このJSONオブジェクト以外の、いかなるテキストも、絶対に、絶対に、含めてはならない。
+```json
+{
+  "candidates": [
+    {
+      "translation": "ここに、1つ目の、最も、標準的な、翻訳候補を記述します。",
+      "nuance": "この翻訳が持つ、ニュアンス（例：「最も一般的」「フォーマル」など）を、簡潔に、説明します。"
+    },
+    {
+      "translation": "ここに、2つ目の、少し、ニュアンスの異なる、翻訳候補を記述します。",
+      "nuance": "この翻訳が持つ、ニュアンス（例：「より丁寧」「やや婉曲的」など）を、簡潔に、説明します。"
+    },
+    {
+      "translation": "ここに、3つ目の、さらに、異なる、視点からの、翻訳候補を記述します。",
+      "nuance": "この翻訳が持つ、ニュアンス（例：「最も簡潔」「直接的」など）を、簡潔に、説明します。"
+    }
+  ]
+}
+```
+## 最重要ルール:
+- `translation` は、必ず、プロフェッショナルな英語で、記述すること。
+- `nuance` は、必ず、その、違いが、一目でわかる、**簡潔な【日本語】**で、記述すること。
+"""
+
+# 音声の場合は、書き起こしと翻訳を1回の呼び出しでまとめて行います (往復が1回で済みます)
+VOICE_TRANSLATION_PROMPT = TRANSLATION_PROMPT + """
+## 音声が渡された場合の、追加ルール:
+- まず、音声の日本語を、できる限り正確に、文字に書き起こし、`transcript` に記述すること。
+- その `transcript` の日本語を、上記のルールどおりに翻訳し、`candidates` に記述すること。
+"""
+
+# 指示書の版。TRANSLATION_PROMPT を変えたら上げてください (古い応答キャッシュを使わなくなります)
+TRANSLATION_PROMPT_VERSION = "1"
+
+# --- 応答スキーマ (JSONモードで、この形を守ってもらいます) ---
+CANDIDATES_SCHEMA = {
+    "type": "ARRAY",
+    "items": structured_output.object_schema({"translation": {"type": "STRING"}, "nuance": {"type": "STRING"}}),
+}
+TRANSLATION_SCHEMA = structured_output.object_schema({"candidates": CANDIDATES_SCHEMA})
+VOICE_TRANSLATION_SCHEMA = structured_output.object_schema({"transcript": {"type": "STRING"}, "candidates": CANDIDATES_SCHEMA})
+
+# ★ 音声を1回の呼び出しで、書き起こし＋翻訳します (False にすると、従来の2回の呼び出しに戻ります)
+COMBINED_VOICE_TRANSLATION = True
 
 # --- 補助関数 (ちゃろさんの高機能版・デバッグ機能付き) ---
-def translate_with_gemini(content_to_process, api_key):
+def has_valid_candidates(result):
+    candidates = result.get("candidates") if isinstance(result, dict) else None
+    return bool(candidates) and isinstance(candidates, list) and all(isinstance(c, dict) and str(c.get("translation", "")).strip() for c in candidates)
+
+def transcribe_and_translate_in_one_call(audio_part, api_key):
+    """音声を1回だけ送り、書き起こしと翻訳候補をまとめて受け取ります。形が正しくなければ None を返します。"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+        result = structured_output.generate_json(api_key, [VOICE_TRANSLATION_PROMPT, audio_part], schema=VOICE_TRANSLATION_SCHEMA, repair=False)
+    except StructuredOutputError:
+        return None
+    if not str(result.get("transcript", "")).strip() or not has_valid_candidates(result): return None
+    return result
 
+def translate_with_gemini(content_to_process, api_key):
+    try:
+        translated_proposals = None
         if isinstance(content_to_process, bytes):
-            with st.spinner("（あなたの声を、言葉に、変えています...）"):
-                audio_part = {"mime_type": "audio/webm", "data": content_to_process}
-                transcription_prompt = "この日本語の音声を、できる限り正確に、文字に書き起こしてください。書き起こした日本語テキストのみを回答してください。"
-                transcription_response = model.generate_content([transcription_prompt, audio_part])
-                processed_text = transcription_response.text.strip()
+            # 以前に書き起こした録音なら、その結果を使い、翻訳だけを行います
+            audio_hash = transcription.audio_hash(content_to_process)
+            processed_text = transcription.lookup(audio_hash, count_hit=True)
+            if processed_text is None and COMBINED_VOICE_TRANSLATION:
+                # 本当の形式を見分け、モノラル・16kHz・前後の無音なしにそろえてから送ります
+                audio_part, _ = audio_preprocess.to_audio_part(content_to_process, "audio/webm")
+                with st.spinner("（あなたの声を、聞き取りながら、翻訳候補を、考えています...）"):
+                    combined_result = transcribe_and_translate_in_one_call(audio_part, api_key)
+                if combined_result:
+                    processed_text = combined_result["transcript"].strip()
+                    translated_proposals = {"candidates": combined_result["candidates"]}
+                    transcription.remember(audio_hash, processed_text)
+            # まとめた応答が検証を通らなかった場合は、従来どおり、書き起こし→翻訳の2段階で行います
+            if processed_text is None:
+                with st.spinner("（あなたの声を、言葉に、変えています...）"):
+                    processed_text = transcription.transcribe(api_key, content_to_process, "audio/webm")
             
             # ▼▼▼【デバッグコード①】ここから追加しました ▼▼▼
             st.info("【デバッグ情報】AIが聞き取ったあなたの言葉↓")
@@ -35,57 +112,24 @@ def translate_with_gemini(content_to_process, api_key):
             processed_text = content_to_process
             original_input_display = processed_text
 
-        with st.spinner("AIが、最適な、3つの、翻訳候補を、考えています..."):
-            system_prompt = """
-            # 命令書: 言語ニュアンスの、探求者としての、あなたの、責務
-            あなたは、プロフェッショナルな、翻訳アシスタントです。
-            あなたの、唯一の、任務は、ユーザーから、渡された、日本語を、分析し、ニュアンスの異なる、3つの、プロフェッショナルな、英訳候補を、生成し、以下の、JSON形式で、厳格に、出力することです。
-            ## JSON出力に関する、絶対的な、契約条件：
-            あなたの回答は、必ず、以下のJSON構造に、厳密に、従うこと。このJSONオブジェクト以外の、いかなるテキストも、絶対に、絶対に、含めてはならない。
-            ```json
-            {
-              "candidates": [
-                {
-                  "translation": "ここに、1つ目の、最も、標準的な、翻訳候補を記述します。",
-                  "nuance": "この翻訳が持つ、ニュアンス（例：「最も一般的」「フォーマル」など）を、簡潔に、説明します。"
-                },
-                {
-                  "translation": "ここに、2つ目の、少し、ニュアンスの異なる、翻訳候補を記述します。",
-                  "nuance": "この翻訳が持つ、ニュアンス（例：「より丁寧」「やや婉曲的」など）を、簡潔に、説明します。"
-                },
-                {
-                  "translation": "ここに、3つ目の、さらに、異なる、視点からの、翻訳候補を記述します。",
-                  "nuance": "この翻訳が持つ、ニュアンス（例：「最も簡潔」「直接的」など）を、簡潔に、説明します。"
-                }
-              ]
-            }
-            ```
-            ## 最重要ルール:
-            - `translation` は、必ず、プロフェッショナルな英語で、記述すること。
-            - `nuance` は、必ず、その、違いが、一目でわかる、**簡潔な【日本語】**で、記述すること。
-            """
-            request_contents = [system_prompt, processed_text]
-            response = model.generate_content(request_contents)
-            raw_response_text = response.text
+        if translated_proposals is None:
+            with st.spinner("AIが、最適な、3つの、翻訳候補を、考えています..."):
+                request_contents = [TRANSLATION_PROMPT, processed_text]
+                try:
+                    translated_proposals = structured_output.generate_json(
+                        api_key, request_contents, schema=TRANSLATION_SCHEMA,
+                        cache_namespace="translator", prompt_version=TRANSLATION_PROMPT_VERSION)
+                except StructuredOutputError as e:
+                    st.error("AIの応答データの構造が破損していました。")
+                    st.code(e.raw_text)
+                    return None, None
         
         # ▼▼▼【デバッグコード②】ここから追加しました ▼▼▼
-        st.info("【デバッグ情報】翻訳AIからの生の応答データ↓")
-        st.code(raw_response_text)
+        st.info("【デバッグ情報】翻訳AIからの応答データ↓")
+        st.code(json.dumps(translated_proposals, ensure_ascii=False, indent=2))
         # ▲▲▲ ここまで ▲▲▲
 
-        json_start_index = raw_response_text.find('{')
-        json_end_index = raw_response_text.rfind('}')
-        if json_start_index != -1 and json_end_index != -1:
-            pure_json_text = raw_response_text[json_start_index : json_end_index + 1]
-            try:
-                translated_proposals = json.loads(pure_json_text)
-                return original_input_display, translated_proposals
-            except json.JSONDecodeError:
-                st.error("AIの応答データの構造が破損していました。")
-                return None, None
-        else:
-            st.error("AIから予期せぬ形式の応答がありました。")
-            return None, None
+        return original_input_display, translated_proposals
     except exceptions.ResourceExhausted:
         st.error("APIキーの上限に達したようです。")
         return None, None
@@ -93,6 +137,10 @@ def translate_with_gemini(content_to_process, api_key):
         st.error(f"AI処理中に予期せぬエラーが発生しました: {e}")
         return None, None
 
+def compact_result(original, candidates):
+    """履歴には、表示に使う文字列だけを [ニュアンス, 翻訳] の組で残します。"""
+    return {"original": original, "candidates": [[c.get('nuance', 'N/A'), c.get('translation', '翻訳エラー')] for c in candidates if isinstance(c, dict)]}
+
 # --- メイン関数 ---
 def show_tool(gemini_api_key):
     st.header("🤝 翻訳ツール", divider='rainbow')
@@ -101,7 +149,7 @@ def show_tool(gemini_api_key):
     
     # セッションステートの初期化
     if f"{prefix}usage_count" not in st.session_state: st.session_state[f"{prefix}usage_count"] = 0
-    if f"{prefix}results" not in st.session_state: st.session_state[f"{prefix}results"] = []
+    session_history.ensure(st.session_state, prefix)
     if f"{prefix}last_mic_id" not in st.session_state: st.session_state[f"{prefix}last_mic_id"] = None
     if f"{prefix}text_to_process" not in st.session_state: st.session_state[f"{prefix}text_to_process"] = None
     if f"{prefix}last_input" not in st.session_state: st.session_state[f"{prefix}last_input"] = ""
@@ -167,7 +215,7 @@ def show_tool(gemini_api_key):
                 original, proposals_data = translate_with_gemini(content_to_process, gemini_api_key)
                 if proposals_data and "candidates" in proposals_data:
                     st.session_state[f"{prefix}usage_count"] += 1
-                    st.session_state[f"{prefix}results"].insert(0, {"original": original, "candidates": proposals_data["candidates"]})
+                    session_history.push(st.session_state, prefix, compact_result(original, proposals_data["candidates"]))
                     st.rerun()
                 else:
                     st.session_state[f"{prefix}last_input"] = ""
@@ -175,20 +223,27 @@ def show_tool(gemini_api_key):
         if st.session_state[f"{prefix}results"]:
             st.divider()
             st.subheader("📜 翻訳履歴")
-            for i, result in enumerate(st.session_state[f"{prefix}results"]):
+            for result in st.session_state[f"{prefix}results"]:
                 with st.container(border=True):
                     st.markdown(f"**🇯🇵 あなたの入力:** {result['original']}")
-                    if "candidates" in result and isinstance(result["candidates"], list):
+                    if result["candidates"]:
                         st.write("---")
                         cols = st.columns(len(result["candidates"]))
-                        for col_index, candidate in enumerate(result["candidates"]):
-                            with cols[col_index]:
-                                nuance = candidate.get('nuance', 'N/A')
-                                translation = candidate.get('translation', '翻訳エラー')
+                        for col, (nuance, translation) in zip(cols, result["candidates"]):
+                            with col:
                                 st.info(f"**{nuance}**")
                                 st.success(translation)
+
+            # 画面に出しきれない古い履歴は、開いた時に1ページ分だけ読み込みます
+            older_count = session_history.spilled_count(st.session_state, prefix)
+            if older_count and st.toggle(f"それより前の履歴を表示 ({older_count}件)", key=f"{prefix}show_older"):
+                page_count = (older_count + session_history.DEFAULT_PAGE_SIZE - 1) // session_history.DEFAULT_PAGE_SIZE
+                page = st.number_input("ページ", min_value=1, max_value=page_count, value=1, key=f"{prefix}older_page") - 1
+                for older in session_history.fetch_spilled(st.session_state, prefix, page):
+                    lines = [f"**🇯🇵 {older['original']}**"] + [f"- {translation} （{nuance}）" for nuance, translation in older["candidates"]]
+                    st.markdown("\n".join(lines))
         
         if st.button("翻訳履歴をクリア", key=f"{prefix}clear_history"):
-            st.session_state[f"{prefix}results"] = []
+            session_history.clear(st.session_state, prefix)
             st.session_state[f"{prefix}last_input"] = ""
             st.rerun()